@@ -3,6 +3,7 @@ from flask import Flask
 # from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import config
 
 # Initialize extensions
@@ -16,6 +17,11 @@ def create_app(config_name='development'):
     flask_app = Flask(__name__)
     flask_app.config.from_object(config[config_name])
     
+    # Behind a reverse proxy, take the client address from X-Forwarded-For
+    hops = flask_app.config.get('PROXY_FIX_HOPS', 0)
+    if hops > 0:
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+    
     # Initialize extensions with app
     # db.init_app(flask_app)
     # migrate.init_app(flask_app, db)
@@ -41,6 +47,7 @@ def create_app(config_name='development'):
     from app.routes.dorms import dorms_bp
     from app.routes.marks import marks_bp
     from app.routes.settings import settings_bp
+    from app.routes.jobs import jobs_bp
     
     flask_app.register_blueprint(auth_bp)
     flask_app.register_blueprint(main_bp)
@@ -55,6 +62,7 @@ def create_app(config_name='development'):
     flask_app.register_blueprint(dorms_bp, url_prefix='/dorms')
     flask_app.register_blueprint(marks_bp, url_prefix='/marks')
     flask_app.register_blueprint(settings_bp, url_prefix='/settings')
+    flask_app.register_blueprint(jobs_bp, url_prefix='/jobs')
     
     #error handlers
     from app.utils.error_handlers import register_error_handlers
@@ -64,6 +72,15 @@ def create_app(config_name='development'):
     from app.utils.template_helpers import register_template_helpers
     register_template_helpers(flask_app)
     
+    # CLI commands
+    from app.utils.result_snapshots import register_result_commands
+    register_result_commands(flask_app)
+    
+    # Import the modules defining background job handlers so every worker can run them
+    import app.utils.promotion
+    import app.utils.credentials
+    import app.utils.pins
+    
     # Import models to register user_loader
     import app.models
     
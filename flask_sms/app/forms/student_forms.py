@@ -2,6 +2,7 @@
 Student forms
 """
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SelectField, DateField, IntegerField, TextAreaField, SubmitField
 from wtforms.validators import DataRequired, Email, Length
 
@@ -41,3 +42,13 @@ class PromotionForm(FlaskForm):
     from_session = StringField('From Session', validators=[DataRequired()])
     to_session = StringField('To Session', validators=[DataRequired()])
     submit = SubmitField('Promote Students')
+
+
+class StudentImportForm(FlaskForm):
+    """Bulk student import form"""
+    csv_file = FileField('CSV File', validators=[FileRequired(), FileAllowed(['csv'], 'Upload a .csv file')])
+    my_class_id = SelectField('Class', coerce=int, validators=[DataRequired()])
+    section_id = SelectField('Section', coerce=int, validators=[DataRequired()])
+    year_admitted = IntegerField('Year Admitted', validators=[DataRequired()])
+    session = StringField('Session', validators=[DataRequired()])
+    submit = SubmitField('Import Students')
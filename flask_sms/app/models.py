@@ -1,13 +1,17 @@
 from app import login_manager
 from app.supabase_db import get_db, SupabaseModel
+from app.utils.user_cache import get_cached_user, cache_user
+from app.utils.projections import fields
 
 class User(SupabaseModel):
     """
     User model class extending the generic SupabaseModel.
     Adds application-specific helper methods for roles.
     """
-    def __init__(self, data):
-        super().__init__(data)
+    __slots__ = ()
+
+    def __init__(self, data, timestamps=()):
+        super().__init__(data, timestamps)
     
     def is_admin(self):
         """Check if user has admin privileges (admin or super_admin)"""
@@ -40,11 +44,16 @@ class User(SupabaseModel):
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
+    # Steady-state requests are served from the user cache without a DB hit
+    cached = get_cached_user(user_id)
+    if cached is not None:
+        return User(cached)
+    
     supabase = get_db()
     try:
-        response = supabase.table('users').select('*').eq('id', user_id).execute()
+        response = supabase.table('users').select(fields('users', 'session')).eq('id', user_id).execute()
         if response.data:
-            return User(response.data[0])
+            return User(cache_user(response.data[0]))
     except Exception as e:
         print(f"Error loading user: {e}")
     return None
@@ -5,12 +5,22 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models import User
 from app.supabase_db import get_db, SupabaseModel
-from werkzeug.security import check_password_hash, generate_password_hash
+from app.utils.user_cache import cache_user
+from app.utils.lookups import invalidate_lookups
+from app.utils.dashboard_stats import user_added
+from app.utils.login_throttle import retry_after, record_failure, clear_failures
+from app.utils.pagination import quote_literal, invalidate_counts
+from app.utils.projections import fields
+from werkzeug.security import check_password_hash
+from app.utils.passwords import hash_password
 from app.forms.auth_forms import LoginForm, RegisterForm, ChangePasswordForm
 from werkzeug.urls import url_parse
 
 auth_bp = Blueprint('auth', __name__)
 
+# Columns the session needs (see load_user) plus the hash to check
+LOGIN_COLUMNS = f"{fields('users', 'session')}, password"
+
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -20,44 +30,45 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        # Supabase Login Logic
-        identity = form.identity.data
-        
+        identity = form.identity.data.strip()
+        remote_addr = request.remote_addr
+
+        # Locked out: refuse before touching the database
+        wait = retry_after(identity, remote_addr)
+        if wait:
+            flash(f'Too many failed login attempts. Try again in {max(1, wait // 60)} minute(s).', 'danger')
+            return render_template('auth/login.html', form=form), 429
+
         try:
             supabase = get_db()
-            
-            # Or query: email = identity OR username = identity
-            # Note: Supabase-py doesn't support sophisticated OR queries easily in one go 
-            # without calling .or_(). Let's try matching email first, then username.
-            
-            # Try finding by email
-            response = supabase.table('users').select('*').eq('email', identity).execute()
+            # One round trip for email OR username, with only the session columns and the hash
+            response = supabase.table('users').select(LOGIN_COLUMNS).or_(
+                f'email.eq.{quote_literal(identity)},username.eq.{quote_literal(identity)}'
+            ).limit(2).execute()
             data = response.data
-            
-            # If not found, try username
-            if not data:
-                response = supabase.table('users').select('*').eq('username', identity).execute()
-                data = response.data
         except Exception as e:
             print(f"LOGIN ERROR: {str(e)}")
             flash(f"System Error: Cannot connect to authentication service. ({str(e)})", 'danger')
             return render_template('auth/login.html', form=form)
 
-        if data:
-            user_data = data[0] # Get first result
-            if check_password_hash(user_data['password'], form.password.data):
-                user_obj = User(user_data)
-                login_user(user_obj, remember=form.remember_me.data)
-                
-                next_page = request.args.get('next')
-                if not next_page or url_parse(next_page).netloc != '':
-                    next_page = url_for('main.dashboard')
-                flash('Login successful!', 'success')
-                return redirect(next_page)
-            else:
-                 flash('Invalid username/email or password', 'danger')
-        else:
-            flash('Invalid username/email or password', 'danger')
+        # An email match wins over someone else's username that happens to equal it
+        data.sort(key=lambda row: row.get('email') != identity)
+        if data and check_password_hash(data[0]['password'], form.password.data):
+            user_data = data[0]
+            clear_failures(identity)
+            user_obj = User(user_data)
+            login_user(user_obj, remember=form.remember_me.data)
+            # Prime the loader cache so the redirect doesn't fetch the row again
+            cache_user(user_data)
+
+            next_page = request.args.get('next')
+            if not next_page or url_parse(next_page).netloc != '':
+                next_page = url_for('main.dashboard')
+            flash('Login successful!', 'success')
+            return redirect(next_page)
+
+        record_failure(identity, remote_addr)
+        flash('Invalid username/email or password', 'danger')
     
     return render_template('auth/login.html', form=form)
 
@@ -90,11 +101,14 @@ def register():
             'email': form.email.data,
             'username': form.username.data,
             'user_type': 'student',
-            'password': generate_password_hash(form.password.data)
+            'password': hash_password(form.password.data)
         }
         
         try:
              response = supabase.table('users').insert(new_user).execute()
+             invalidate_lookups('users')
+             invalidate_counts('users')
+             user_added('student')
              flash('Registration successful! Please login.', 'success')
              return redirect(url_for('auth.login'))
         except Exception as e:
@@ -5,9 +5,10 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required
 # from app.models import MyClass, Section, ClassType, db, User
 from app.supabase_db import get_db, SupabaseModel
-from datetime import datetime
 from app.forms.class_forms import ClassForm, SectionForm
 from app.utils.helpers import admin_required
+from app.utils.lookups import lookup_choices, invalidate_lookups
+from app.utils.projections import projection
 
 classes_bp = Blueprint('classes', __name__)
 
@@ -17,16 +18,9 @@ classes_bp = Blueprint('classes', __name__)
 def index():
     """List all classes"""
     supabase = get_db()
-    # Join with class_type to get type info if needed, usually needed for display
-    res = supabase.table('my_classes').select('*, class_type:class_types(*)').execute()
-    classes = SupabaseModel.from_list(res.data)
-    
-    # Fix date formatting
-    for c in classes:
-        if c.created_at and isinstance(c.created_at, str):
-            try:
-                c.created_at = datetime.fromisoformat(c.created_at.replace('Z', '+00:00'))
-            except: pass
+    res = supabase.table('my_classes').select(projection('classes.index')).execute()
+    # created_at is decoded as each row is rendered
+    classes = SupabaseModel.lazy(res.data, timestamps=('created_at',))
 
     return render_template('classes/index.html', classes=classes)
 
@@ -41,8 +35,7 @@ def create():
     
     # Populate Class Types choice dynamically if needed, 
     # but currently form might handle it statically or we need to add logic here if ClassForm selects from DB
-    res_ct = supabase.table('class_types').select('id, name').execute()
-    form.class_type_id.choices = [(c['id'], c['name']) for c in res_ct.data]
+    form.class_type_id.choices = lookup_choices('class_types')
 
     if form.validate_on_submit():
         new_class = {
@@ -51,6 +44,7 @@ def create():
         }
         try:
             supabase.table('my_classes').insert(new_class).execute()
+            invalidate_lookups('my_classes')
             flash(f'Class {form.name.data} created successfully!', 'success')
             return redirect(url_for('classes.index'))
         except Exception as e:
@@ -73,8 +67,7 @@ def show(id):
     my_class = SupabaseModel(res_cls.data[0])
     
     # Get Sections
-    # Join teacher info
-    res_sec = supabase.table('sections').select('*, teacher:users(*)').eq('my_class_id', id).execute()
+    res_sec = supabase.table('sections').select(projection('classes.show')).eq('my_class_id', id).execute()
     sections = SupabaseModel.from_list(res_sec.data)
     
     return render_template('classes/show.html', my_class=my_class, sections=sections)
@@ -94,9 +87,7 @@ def create_section(id):
     form = SectionForm()
     
     # Populate teacher choices
-    res_t = supabase.table('users').select('id, name').eq('user_type', 'teacher').execute()
-    form.teacher_id.choices = [(t['id'], t['name']) for t in res_t.data]
-    form.teacher_id.choices.insert(0, (0, 'Select Teacher'))
+    form.teacher_id.choices = lookup_choices('users', 'Select Teacher', user_type='teacher')
     
     if form.validate_on_submit():
         new_section = {
@@ -108,6 +99,7 @@ def create_section(id):
         
         try:
             supabase.table('sections').insert(new_section).execute()
+            invalidate_lookups('sections')
             flash(f'Section {form.name.data} created successfully!', 'success')
             return redirect(url_for('classes.show', id=id))
         except Exception as e:
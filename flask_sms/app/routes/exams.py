@@ -7,6 +7,9 @@ from flask_login import login_required
 from app.supabase_db import get_db, SupabaseModel
 from app.forms.exam_forms import ExamForm
 from app.utils.helpers import admin_required, teacher_or_admin_required
+from app.utils.result_snapshots import rebuild_exam_snapshots
+from app.utils.projections import projection
+from app.utils.streaming import stream_page
 
 exams_bp = Blueprint('exams', __name__)
 
@@ -59,12 +62,23 @@ def show(id):
         abort(404)
     exam = SupabaseModel(res_exam.data[0])
     
-    # Get Exam Records (might need detailed join)
-    # exam_records (*, student:users(*), my_class:my_classes(*), section:sections(*))
-    res_rec = supabase.table('exam_records').select(
-        '*, student:users(*), my_class:my_classes(*), section:sections(*)'
-    ).eq('exam_id', id).execute()
+    # Only the record count is shown
+    res_rec = supabase.table('exam_records').select(projection('exams.show')).eq('exam_id', id).execute()
     
-    exam_records = SupabaseModel.from_list(res_rec.data)
+    exam_records = SupabaseModel.lazy(res_rec.data)
     
-    return render_template('exams/show.html', exam=exam, exam_records=exam_records)
+    return stream_page('exams/show.html', exam=exam, exam_records=exam_records)
+
+
+@exams_bp.route('/<int:id>/finalize', methods=['POST'])
+@login_required
+@admin_required
+def finalize(id):
+    """Store the computed results of every class in the exam"""
+    supabase = get_db()
+    try:
+        classes, students = rebuild_exam_snapshots(supabase, id)
+        flash(f'Results stored for {students} students in {classes} classes.', 'success')
+    except Exception as e:
+        flash(f'Could not store results: {str(e)}', 'danger')
+    return redirect(url_for('exams.show', id=id))
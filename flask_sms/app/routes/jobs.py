@@ -0,0 +1,67 @@
+"""
+Background job status routes
+"""
+from flask import Blueprint, render_template, jsonify, abort, Response
+from flask_login import login_required, current_user
+from app.utils.jobs import get_job, recent_jobs, take_job_file
+from app.utils.exports import content_disposition
+
+jobs_bp = Blueprint('jobs', __name__)
+
+JOB_TITLES = {
+    'promote_students': 'Student promotion',
+    'generate_pins': 'PIN generation',
+    'reset_class_passwords': 'Class password reset',
+    'refresh_class_snapshot': 'Class results update',
+}
+
+
+def _is_admin():
+    return current_user.user_type in ('super_admin', 'admin')
+
+
+def _load(job_id):
+    """The job, if it exists and the current user started it or is an admin"""
+    job = get_job(job_id)
+    if job is None or (job['user_id'] != str(current_user.id) and not _is_admin()):
+        abort(404)
+    return job
+
+
+@jobs_bp.route('/')
+@login_required
+def index():
+    """Recent background jobs; admins see everyone's"""
+    jobs = recent_jobs(user_id=None if _is_admin() else current_user.id)
+    return render_template('jobs/index.html', jobs=jobs, titles=JOB_TITLES)
+
+
+@jobs_bp.route('/<job_id>')
+@login_required
+def show(job_id):
+    """Job status page; refreshes itself until the job finishes"""
+    return render_template('jobs/show.html', job=_load(job_id), titles=JOB_TITLES)
+
+
+@jobs_bp.route('/<job_id>.json')
+@login_required
+def status(job_id):
+    """Job progress for polling"""
+    job = _load(job_id)
+    return jsonify({key: job[key] for key in ('id', 'name', 'status', 'attempts', 'progress',
+                                              'total', 'message', 'error', 'result', 'has_file')})
+
+
+@jobs_bp.route('/<job_id>/download')
+@login_required
+def download(job_id):
+    """The job's file; it is deleted once downloaded"""
+    _load(job_id)
+    taken = take_job_file(job_id)
+    if taken is None:
+        abort(404)
+    filename, mimetype, data = taken
+    return Response(data, mimetype=mimetype, headers={
+        'Content-Disposition': content_disposition(filename),
+        'Cache-Control': 'no-store',
+    })
@@ -1,13 +1,17 @@
 """
 Main routes - Dashboard, Home, Profile
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from app.supabase_db import get_db, SupabaseModel
+from app.supabase_db import get_db, get_pool_metrics, SupabaseModel
 # from app.models import User, StudentRecord, StaffRecord, db
 from app.forms.profile_forms import ProfileForm, ChangePasswordForm
 from app.utils.helpers import admin_required, teacher_required
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash
+from app.utils.passwords import hash_password, get_hash_metrics
+from app.utils.user_cache import invalidate_user
+from app.utils.lookups import invalidate_lookups
+from app.utils.dashboard_stats import get_dashboard_stats
 
 main_bp = Blueprint('main', __name__)
 
@@ -36,19 +40,9 @@ def dashboard():
     user_type = current_user.get('user_type')
     
     if user_type == 'super_admin' or user_type == 'admin':
-        # Admin dashboard statistics
-        # Note: count() in supabase-py might need 'exact' param or similar depending on version
-        # .select('*', count='exact').eq(...) is standard way
-        
+        # Admin dashboard statistics (one cached aggregate query)
         try:
-           res_st = supabase.table('users').select('*', count='exact').eq('user_type', 'student').execute()
-           context['total_students'] = res_st.count
-           
-           res_te = supabase.table('users').select('*', count='exact').eq('user_type', 'teacher').execute()
-           context['total_teachers'] = res_te.count
-           
-           res_pa = supabase.table('users').select('*', count='exact').eq('user_type', 'parent').execute()
-           context['total_parents'] = res_pa.count
+           context.update(get_dashboard_stats(supabase))
         except:
            context['total_students'] = 0
            context['total_teachers'] = 0
@@ -109,6 +103,8 @@ def my_account():
         
         try:
             supabase.table('users').update(update_data).eq('id', current_user.get('id')).execute()
+            invalidate_lookups('users')
+            invalidate_user(current_user.get('id'))
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('main.my_account'))
         except Exception as e:
@@ -125,12 +121,15 @@ def change_password():
     
     if form.validate_on_submit():
         # Verify current password
-        # current_user has 'password' hash in it? Yes from load_user
-        if check_password_hash(current_user.get('password'), form.current_password.data):
-             new_hash = generate_password_hash(form.new_password.data)
-             supabase = get_db()
+        # The cached current_user carries no password hash, so read it here
+        supabase = get_db()
+        res = supabase.table('users').select('password').eq('id', current_user.get('id')).execute()
+        current_hash = res.data[0]['password'] if res.data else None
+        if current_hash and check_password_hash(current_hash, form.current_password.data):
+             new_hash = hash_password(form.new_password.data)
              try:
                  supabase.table('users').update({'password': new_hash}).eq('id', current_user.get('id')).execute()
+                 invalidate_user(current_user.get('id'))
                  flash('Password changed successfully!', 'success')
                  return redirect(url_for('main.my_account'))
              except Exception as e:
@@ -151,3 +150,19 @@ def privacy_policy():
 def terms_of_use():
     """Terms of use page"""
     return render_template('main/terms_of_use.html')
+
+
+@main_bp.route('/system/db-pool')
+@login_required
+@admin_required
+def db_pool():
+    """Supabase connection pool metrics of the worker serving this request"""
+    return jsonify(get_pool_metrics())
+
+
+@main_bp.route('/system/password-hashing')
+@login_required
+@admin_required
+def password_hashing():
+    """Password hashing metrics of the worker serving this request"""
+    return jsonify(get_hash_metrics())
@@ -2,11 +2,22 @@
 Marks/Grades management routes
 """
 from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
-from flask_login import login_required
+from flask_login import login_required, current_user
 # from app.models import Mark, Exam, Subject, StudentRecord, MyClass, User, db
 from app.supabase_db import get_db, SupabaseModel
 from app.forms.mark_forms import MarkForm
 from app.utils.helpers import teacher_or_admin_required
+from app.utils.bulk_marks import collect_form_scores, save_marks_batch
+from grading import ResultsTable
+from app.utils.result_snapshots import (load_class_subjects, load_class_results, load_class_snapshot,
+                                        load_student_snapshot, student_name,
+                                        class_results_for_export, exam_class_ids,
+                                        invalidate_class_snapshots)
+from app.utils.projections import fields
+from app.utils.fanout import fetch_all
+from app.utils.grading_sheet import load_grading_sheet
+from app.utils.exports import export_response, safe_filename
+from app.utils.result_cards import load_class_cards, iter_card_pdfs, card_filename, result_cards_response
 
 from datetime import datetime
 
@@ -19,13 +30,15 @@ marks_bp = Blueprint('marks', __name__)
 def index():
     """Marks management page"""
     supabase = get_db()
-    res_e = supabase.table('exams').select('*').execute()
-    res_s = supabase.table('subjects').select('*').execute()
-    res_c = supabase.table('my_classes').select('*').execute()
+    reads = fetch_all(
+        exams=supabase.table('exams').select(fields('exams', 'ref')),
+        subjects=supabase.table('subjects').select(fields('subjects', 'ref')),
+        classes=supabase.table('my_classes').select(fields('my_classes', 'ref'))
+    )
     
-    exams = SupabaseModel.from_list(res_e.data)
-    subjects = SupabaseModel.from_list(res_s.data)
-    classes = SupabaseModel.from_list(res_c.data)
+    exams = SupabaseModel.from_list(reads['exams'])
+    subjects = SupabaseModel.from_list(reads['subjects'])
+    classes = SupabaseModel.from_list(reads['classes'])
     
     return render_template('marks/index.html', exams=exams, subjects=subjects, classes=classes)
 
@@ -37,39 +50,22 @@ def manage(exam_id, subject_id, class_id):
     """Manage marks for exam, subject, and class"""
     supabase = get_db()
     
-    # Fetch Exam, Subject
-    res_ex = supabase.table('exams').select('*').eq('id', exam_id).execute()
-    res_sub = supabase.table('subjects').select('*').eq('id', subject_id).execute()
+    reads = fetch_all(
+        exam=supabase.table('exams').select('*').eq('id', exam_id),
+        subject=supabase.table('subjects').select('*').eq('id', subject_id),
+        # Roster with each student's current mark attached, one read per page
+        students=lambda: load_grading_sheet(supabase, exam_id, subject_id, class_id)
+    )
     
-    if not res_ex.data or not res_sub.data:
+    if not reads['exam'] or not reads['subject']:
         abort(404)
         
-    exam = SupabaseModel(res_ex.data[0])
-    subject = SupabaseModel(res_sub.data[0])
-    
-    # Fetch Students in Class
-    # Need user name, so join user
-    res_stu = supabase.table('student_records').select('*, user:users!student_records_user_id_fkey(*)').eq('my_class_id', class_id).execute()
-    students = SupabaseModel.from_list(res_stu.data)
-    
-    # Fetch existing Marks for this batch
-    # Filter by exam, subject, and class_id (optional to filter by class in marks table if populated, else by student_ids)
-    # Marks table has my_class_id, so we use it.
-    res_marks = supabase.table('marks').select('*').eq('exam_id', exam_id).eq('subject_id', subject_id).eq('my_class_id', class_id).execute()
-    
-    marks_lookup = { m['student_id']: SupabaseModel(m) for m in res_marks.data }
-    
-    # Map marks to students dict for template: marks[student.id] = mark_obj
-    marks = {}
-    for student in students:
-        # student.user_id is the user id, student.id is record id. 
-        # Marks usually link to User ID (student_id col in Marks table usually refers to user table id based on foreign key)
-        # Checking original models.py: Mark.student_id FK users.id.
-        marks[student.id] = marks_lookup.get(student.user_id)
+    exam = SupabaseModel(reads['exam'][0])
+    subject = SupabaseModel(reads['subject'][0])
     
     return render_template('marks/manage.html',
-                         exam=exam, subject=subject,
-                         students=students, marks=marks)
+                         exam=exam, subject=subject, class_id=class_id,
+                         students=reads['students'])
 
 
 @marks_bp.route('/save', methods=['POST'])
@@ -77,90 +73,47 @@ def manage(exam_id, subject_id, class_id):
 @teacher_or_admin_required
 def save():
     """Save marks"""
-    # This function iterates through students and updates marks.
-    # In Supabase/SQL, bulk upsert is better, but iterating is safer for logic if we need to calc totals individually.
-    
     exam_id = request.form.get('exam_id', type=int)
     subject_id = request.form.get('subject_id', type=int)
     class_id = request.form.get('class_id', type=int)
+    page = request.form.get('page', 1, type=int)
     
     supabase = get_db()
     
     # Get all students for class to iterate form data
-    res_stu = supabase.table('student_records').select('*').eq('my_class_id', class_id).execute()
-    students = SupabaseModel.from_list(res_stu.data)
+    res_stu = supabase.table('student_records').select('id, user_id, section_id, adm_no').eq('my_class_id', class_id).execute()
     
     # Get exam info for 'year'
     res_ex = supabase.table('exams').select('year').eq('id', exam_id).execute()
     exam_year = res_ex.data[0]['year'] if res_ex.data else None
     
-    upsert_data = []
+    # Only students on the submitted page of the sheet are written
+    scores = collect_form_scores(request.form, res_stu.data)
+    students = [s for s in res_stu.data if s['id'] in scores]
     
-    for student in students:
-        t1 = request.form.get(f't1_{student.id}', type=int)
-        exams = request.form.get(f'exams_{student.id}', type=int)
-        
-        # Original logic calculates total. 
-        # Note: If input is empty string, type=int returns None.
-        
-        val_t1 = t1 or 0
-        val_exams = exams or 0
-        total = val_t1 + val_exams
-        
-        # Prepare record
-        # filtering using match columns for upsert usually requires a unique constraint 
-        # on (exam_id, subject_id, student_id).
-        # Assuming Supabase/Postgres has this constraint (or ID based update).
-        # Since we don't have the mark ID easily here without querying, 
-        # we might need to check if exists or use upsert if schema supports it.
-        # Fallback: Select existing mark ID to update, else insert.
-        
-        # Optimize: We did fetch marks in manage(), but here we are in a disconnected POST.
-        # Queries inside loop are bad. But safer for now during migration.
-        
-        existing = supabase.table('marks').select('id').eq('exam_id', exam_id).eq('subject_id', subject_id).eq('student_id', student.user_id).execute()
-        
-        row = {
-            'exam_id': exam_id,
-            'subject_id': subject_id,
-            'student_id': student.user_id,
-            'my_class_id': class_id,
-            'section_id': student.section_id,
-            'year': exam_year,
-            't1': val_t1,
-            'exams': val_exams,
-            'total': total
-        }
-        
-        if existing.data:
-            # Update
-            supabase.table('marks').update(row).eq('id', existing.data[0]['id']).execute()
-        else:
-            # Insert
-            supabase.table('marks').insert(row).execute()
+    # One upsert for the whole page instead of a select + insert/update per student
+    report = save_marks_batch(supabase, exam_id, subject_id, class_id, students, scores, year=exam_year)
+    
+    # The stored positions are out of date now: drop them so result pages compute live results
+    # until the queued rebuild (one per class, however many pages are saved meanwhile) stores new ones
+    if report.saved:
+        invalidate_class_snapshots(supabase, [class_id], exam_id=exam_id, user_id=current_user.id)
+    
+    if report.failed:
+        flash(f'{len(report.saved)} marks saved, {len(report.failed)} not saved. {report.summary()}', 'warning')
+        return redirect(url_for('marks.manage',
+                              exam_id=exam_id,
+                              subject_id=subject_id,
+                              class_id=class_id,
+                              page=page))
 
     flash('Marks saved successfully!', 'success')
     return redirect(url_for('marks.manage',
                           exam_id=exam_id,
                           subject_id=subject_id,
-                          class_id=class_id))
-
+                          class_id=class_id,
+                          page=page))
 
-def calculate_grade(percentage):
-    if percentage >= 90: return 'A'
-    elif percentage >= 80: return 'B'
-    elif percentage >= 70: return 'C'
-    elif percentage >= 60: return 'D'
-    elif percentage >= 50: return 'E'
-    else: return 'F'
-
-def calculate_gpa(percentage):
-    if percentage >= 90: return 4.0
-    elif percentage >= 80: return 3.6
-    elif percentage >= 70: return 3.2
-    elif percentage >= 60: return 2.8
-    elif percentage >= 50: return 2.4
-    else: return 0.0
 
 @marks_bp.route('/results/<int:exam_id>/<int:class_id>')
 @login_required
@@ -169,85 +122,38 @@ def class_results(exam_id, class_id):
     """Generate class results report"""
     supabase = get_db()
     
-    res_ex = supabase.table('exams').select('*').eq('id', exam_id).execute()
-    res_cl = supabase.table('my_classes').select('*').eq('id', class_id).execute()
+    reads = fetch_all(
+        exam=supabase.table('exams').select('*').eq('id', exam_id),
+        my_class=supabase.table('my_classes').select('*').eq('id', class_id),
+        subjects=lambda: load_class_subjects(supabase, class_id)
+    )
     
-    if not res_ex.data or not res_cl.data:
+    if not reads['exam'] or not reads['my_class']:
         abort(404)
         
-    exam = SupabaseModel(res_ex.data[0])
-    my_class = SupabaseModel(res_cl.data[0])
+    exam = SupabaseModel(reads['exam'][0])
+    my_class = SupabaseModel(reads['my_class'][0])
+    subjects = reads['subjects']
     
-    # Students
-    res_st = supabase.table('student_records').select('*, user:users!student_records_user_id_fkey(*)').eq('my_class_id', class_id).execute()
-    students = SupabaseModel.from_list(res_st.data)
+    # Stored results are a single indexed read; compute live if none are stored yet
+    snapshot = load_class_snapshot(supabase, exam_id, class_id, subjects)
+    if snapshot:
+        return render_template('marks/class_results.html',
+                             exam=exam,
+                             my_class=my_class,
+                             subjects=subjects,
+                             **snapshot)
     
-    # Subjects
-    # Subjects might be associated to class, or all subjects
-    res_sub = supabase.table('subjects').select('*').eq('my_class_id', class_id).execute()
-    subjects = SupabaseModel.from_list(res_sub.data)
+    students, subjects, table = load_class_results(supabase, exam_id, class_id, subjects)
     
-    if not subjects:
-        res_sub_all = supabase.table('subjects').select('*').execute()
-        subjects = SupabaseModel.from_list(res_sub_all.data)
-
-    # Bulk fetch marks for this exam and class to avoid N+1 inside loop
-    res_marks = supabase.table('marks').select('*').eq('exam_id', exam_id).eq('my_class_id', class_id).execute()
-    # Index by (student_id, subject_id) -> record
-    marks_map = { (m['student_id'], m['subject_id']): m for m in res_marks.data }
-
-    results = []
-    
-    for student in students:
-        student_data = {
-            'student': student,
-            'marks': {},
-            'total_score': 0,
-            'subject_count': 0
-        }
-        
-        for subject in subjects:
-            # mark_data = marks_map.get( (student.user_id, subject.id) )
-            # student.user_id is int or str depending on DB. Supabase returns ints as ints usually.
-            mark_data = marks_map.get( (student.user_id, subject.id) )
-            
-            score = (mark_data.get('total') or 0) if mark_data else 0
-            student_data['marks'][subject.id] = score
-            student_data['total_score'] += score
-            student_data['subject_count'] += 1
-            
-        # Avoid division by zero
-        count = student_data['subject_count'] if student_data['subject_count'] > 0 else 1
-        percentage = student_data['total_score'] / count
-        
-        student_data['percentage'] = percentage
-        student_data['grade'] = calculate_grade(percentage)
-        student_data['gpa'] = calculate_gpa(percentage)
-        
-        results.append(student_data)
-        
-    # Class Statistics
-    if not results:
+    if not students:
         flash('No data found for this class.', 'warning')
         return redirect(url_for('marks.index'))
-
-    # Topper
-    topper = max(results, key=lambda x: x['total_score'])
-    
-    # Subject Highs
-    subject_highs = {}
-    for subject in subjects:
-        high_score = 0
-        scorer = None
-        for r in results:
-            s = r['marks'].get(subject.id, 0)
-            if s > high_score:
-                high_score = s
-                scorer = r['student'].user['name'] if isinstance(r['student'].user, dict) else r['student'].user.name
-        subject_highs[subject.id] = {'score': high_score, 'scorer': scorer}
-        
-    # Class Average
-    class_avg = sum(r['percentage'] for r in results) / len(results)
+    
+    results = sorted(table.rows(), key=lambda r: r['position'])
+    topper = table.row(table.topper_index)
+    subject_highs = table.subject_stats(student_name)
+    class_avg = table.class_average
     
     return render_template('marks/class_results.html',
                          exam=exam,
@@ -259,6 +165,86 @@ def class_results(exam_id, class_id):
                          class_avg=class_avg)
 
 
+@marks_bp.route('/results/<int:exam_id>/<int:class_id>/export.<fmt>')
+@login_required
+@teacher_or_admin_required
+def export_class_results(exam_id, class_id, fmt):
+    """Download a class results report as CSV or XLSX"""
+    supabase = get_db()
+    
+    reads = fetch_all(
+        exam=supabase.table('exams').select('id, name, year').eq('id', exam_id),
+        my_class=supabase.table('my_classes').select('id, name').eq('id', class_id),
+        subjects=lambda: load_class_subjects(supabase, class_id)
+    )
+    if not reads['exam'] or not reads['my_class']:
+        abort(404)
+    exam, my_class, subjects = reads['exam'][0], reads['my_class'][0], reads['subjects']
+    
+    results = class_results_for_export(supabase, exam_id, class_id, subjects)
+    if results is None:
+        flash('No data found for this class.', 'warning')
+        return redirect(url_for('marks.index'))
+    
+    def rows():
+        for r in results:
+            student = r['student']
+            yield ([student.user['name'] if student.user else None]
+                   + [r['marks'].get(subject.id) for subject in subjects]
+                   + [r['total_score'], round(r['percentage'], 1), r['grade'], r['gpa'], r['position']])
+    
+    header = ['Student Name'] + [subject.name for subject in subjects] + ['Total', '%', 'Grade', 'GPA', 'Position']
+    return export_response(fmt, f"{my_class['name']}_{exam['name']}_{exam['year']}_results", header,
+                           rows(), sheet_name=my_class['name'])
+
+
+@marks_bp.route('/results/<int:exam_id>/<int:class_id>/cards.zip')
+@login_required
+@teacher_or_admin_required
+def class_result_cards(exam_id, class_id):
+    """Download the result card of every student in a class as a ZIP of PDFs"""
+    supabase = get_db()
+    res_ex = supabase.table('exams').select('id, name, year').eq('id', exam_id).execute()
+    if not res_ex.data:
+        abort(404)
+    exam = res_ex.data[0]
+    
+    cards = load_class_cards(supabase, exam, class_id)
+    if cards is None:
+        abort(404)
+    if not cards:
+        flash('No students found in this class.', 'warning')
+        return redirect(url_for('marks.class_results', exam_id=exam_id, class_id=class_id))
+    
+    files = ((card_filename(card), data) for card, data in iter_card_pdfs(cards))
+    return result_cards_response(f"{cards[0]['class']}_{exam['name']}_{exam['year']}_result_cards", files)
+
+
+@marks_bp.route('/results/<int:exam_id>/cards.zip')
+@login_required
+@teacher_or_admin_required
+def exam_result_cards(exam_id):
+    """Download the result cards of every class with marks in an exam, one folder per class"""
+    supabase = get_db()
+    res_ex = supabase.table('exams').select('id, name, year').eq('id', exam_id).execute()
+    if not res_ex.data:
+        abort(404)
+    exam = res_ex.data[0]
+    
+    class_ids = exam_class_ids(supabase, exam_id)
+    if not class_ids:
+        flash('No marks have been entered for this exam yet.', 'warning')
+        return redirect(url_for('exams.show', id=exam_id))
+    
+    def files():
+        # Each class is loaded when the ZIP reaches it
+        for class_id in class_ids:
+            for card, data in iter_card_pdfs(load_class_cards(supabase, exam, class_id) or []):
+                yield f"{safe_filename(card['class'])}/{card_filename(card)}", data
+    
+    return result_cards_response(f"{exam['name']}_{exam['year']}_result_cards", files())
+
+
 @marks_bp.route('/result/<int:exam_id>/<int:student_id>')
 @login_required
 @teacher_or_admin_required
@@ -293,47 +279,36 @@ def student_result(exam_id, student_id):
     
     # Get Subjects
     class_id = my_class['id'] if isinstance(my_class, dict) else my_class.id
-    
-    res_sub = supabase.table('subjects').select('*').eq('my_class_id', class_id).execute()
-    subjects = SupabaseModel.from_list(res_sub.data)
-    if not subjects:
-        res_all = supabase.table('subjects').select('*').execute()
-        subjects = SupabaseModel.from_list(res_all.data)
+    subjects = load_class_subjects(supabase, class_id)
 
-    marks_data = []
-    total_score = 0
-    subject_count = 0
-    
     # Bulk Fetch Marks
     res_marks = supabase.table('marks').select('*').eq('exam_id', exam_id).eq('student_id', student_id).execute()
     marks_map = { m['subject_id']: m for m in res_marks.data }
     
-    for subject in subjects:
+    table = ResultsTable.from_marks([student], subjects, res_marks.data, student_key='id')
+    subject_grades = table.subject_grades(0)
+    
+    marks_data = []
+    for subject, grade in zip(subjects, subject_grades):
         mark = marks_map.get(subject.id)
-        
-        t1 = (mark.get('t1') or 0) if mark else 0
-        exams = (mark.get('exams') or 0) if mark else 0
-        total = (mark.get('total') or 0) if mark else 0
-        
-        grade = calculate_grade(total) 
-        sub_remark = mark['teacher_remark'] if mark and 'teacher_remark' in mark else ""
-        
         marks_data.append({
             'subject': subject,
-            't1': t1,
-            'exams': exams,
-            'total': total,
-            'grade': grade,
-            'remark': sub_remark
+            't1': (mark.get('t1') or 0) if mark else 0,
+            'exams': (mark.get('exams') or 0) if mark else 0,
+            'total': (mark.get('total') or 0) if mark else 0,
+            'grade': str(grade),
+            'remark': mark['teacher_remark'] if mark and 'teacher_remark' in mark else ""
         })
-        
-        total_score += total
-        subject_count += 1
-        
-    count = subject_count if subject_count > 0 else 1
-    percentage = total_score / count
-    overall_grade = calculate_grade(percentage)
-    gpa = calculate_gpa(percentage)
+    
+    result = table.row(0)
+    total_score = result['total_score']
+    percentage = result['percentage']
+    overall_grade = result['grade']
+    gpa = result['gpa']
+    
+    # Class position only exists once the class results have been stored
+    snapshot = load_student_snapshot(supabase, exam_id, student_id)
+    position = snapshot['position'] if snapshot else None
     
     return render_template('marks/student_result.html',
                          exam=exam,
@@ -345,4 +320,5 @@ def student_result(exam_id, student_id):
                          percentage=percentage,
                          overall_grade=overall_grade,
                          gpa=gpa,
+                         position=position,
                          now=datetime.now)
@@ -1,11 +1,21 @@
 """
 Payments management routes
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+import uuid
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app
 from flask_login import login_required
 # from app.models import Payment, PaymentRecord, Receipt, StudentRecord, MyClass, db
 from app.supabase_db import get_db, SupabaseModel
 from app.utils.helpers import admin_required, accountant_required
+from app.utils.lookups import get_lookup
+from app.utils.pagination import paginate, invalidate_counts
+from app.utils.billing import class_billing, school_billing, student_invoice, iter_class_invoices
+from app.utils.projections import projection, fields
+from app.utils.payment_posting import post_payment, PaymentError
+from app.utils.dashboard_stats import adjust_stat
+from app.utils.bulk_payments import parse_payment_rows, post_payment_rows
+from app.utils.exports import export_response
+from app.utils.streaming import stream_page
 
 payments_bp = Blueprint('payments', __name__)
 
@@ -15,9 +25,8 @@ payments_bp = Blueprint('payments', __name__)
 def index():
     """List all payments"""
     supabase = get_db()
-    res = supabase.table('payments').select('*, my_class:my_classes(*)').execute()
-    payments = SupabaseModel.from_list(res.data)
-    return render_template('payments/index.html', payments=payments)
+    payments = paginate(supabase, 'payments', projection('payments.index'))
+    return stream_page('payments/index.html', payments=payments)
 
 
 @payments_bp.route('/create', methods=['GET', 'POST'])
@@ -37,13 +46,13 @@ def create():
         }
         try:
             supabase.table('payments').insert(new_payment).execute()
+            invalidate_counts('payments')
             flash('Payment created successfully!', 'success')
             return redirect(url_for('payments.index'))
         except Exception as e:
             flash(f'Creation failed: {str(e)}', 'danger')
     
-    res_c = supabase.table('my_classes').select('*').execute()
-    classes = SupabaseModel.from_list(res_c.data)
+    classes = SupabaseModel.from_list(get_lookup('my_classes'))
     return render_template('payments/create.html', classes=classes)
 
 
@@ -53,16 +62,52 @@ def create():
 def manage(class_id):
     """Manage payments for a class"""
     supabase = get_db()
-    
-    res_stu = supabase.table('student_records').select('*, user:users(*)').eq('my_class_id', class_id).execute()
-    students = SupabaseModel.from_list(res_stu.data)
-    
-    res_pay = supabase.table('payments').select('*').eq('my_class_id', class_id).execute()
-    payments = SupabaseModel.from_list(res_pay.data)
+    billing = class_billing(supabase, class_id)
+    my_class = next((c for c in get_lookup('my_classes') if c['id'] == class_id), None)
     
     return render_template('payments/manage.html',
-                         students=students,
-                         payments=payments)
+                         billing=billing,
+                         my_class=my_class)
+
+
+@payments_bp.route('/manage/<int:class_id>/export.<fmt>')
+@login_required
+@accountant_required
+def export_manage(class_id, fmt):
+    """Download the billing of one class as CSV or XLSX"""
+    supabase = get_db()
+    my_class = next((c for c in get_lookup('my_classes') if c['id'] == class_id), None)
+    if not my_class:
+        abort(404)
+    payments = supabase.table('payments').select(fields('payments', 'billing')).eq(
+        'my_class_id', class_id).order('id').execute().data
+    
+    def rows():
+        for invoice in iter_class_invoices(supabase, class_id, payments):
+            student = invoice.student
+            yield ([student.adm_no, student.user['name'] if student.user else None]
+                   + [line.amount_paid for line in invoice.lines]
+                   + [invoice.total_due, invoice.total_paid, invoice.balance, invoice.unpaid_count])
+    
+    header = (['Adm No', 'Student Name'] + [f"{p['title']} (paid)" for p in payments]
+              + ['Billed', 'Paid', 'Balance', 'Unpaid Items'])
+    return export_response(fmt, f"{my_class['name']}_billing", header, rows(), sheet_name=my_class['name'])
+
+
+@payments_bp.route('/outstanding')
+@login_required
+@accountant_required
+def outstanding():
+    """Outstanding balances of every class in the school"""
+    supabase = get_db()
+    billing = school_billing(supabase)
+    class_names = {c['id']: c['name'] for c in get_lookup('my_classes')}
+    classes = sorted(billing.values(), key=lambda b: class_names.get(b.class_id) or '')
+    
+    return render_template('payments/outstanding.html',
+                         classes=classes,
+                         class_names=class_names,
+                         total_balance=sum(b.balance for b in classes))
 
 
 @payments_bp.route('/invoice/<int:student_id>')
@@ -71,48 +116,18 @@ def invoice(student_id):
     """Student payment invoice"""
     supabase = get_db()
     
-    # Check current user permission (Student can view own, Parent view child, Admin/Accountant view all)
-    # Assuming helpers logic or template handles strict permission or it's open for user if ID matches.
-    
-    # using student_record id (which is the param 'student_id' in URL? original code says get_or_404(student_id) on StudentRecord)
-    # Wait, URL usually passes primary key. If student_id is user_id, it is different.
-    # Original: StudentRecord.query.get_or_404(student_id) implies the param is the PK of StudentRecord table.
-    
-    res_st = supabase.table('student_records').select('*, user:users(*)').eq('id', student_id).execute()
+    # student_id is the student_records primary key
+    res_st = supabase.table('student_records').select(projection('payments.invoice')).eq('id', student_id).execute()
     if not res_st.data:
         abort(404)
         
     student_record = SupabaseModel(res_st.data[0])
-    
-    # Get all payments for student's class
-    res_pay = supabase.table('payments').select('*').eq('my_class_id', student_record.my_class_id).execute()
-    class_payments = SupabaseModel.from_list(res_pay.data)
-    
-    # Get existing records
-    # filter by student_id which is user_id in payment_records table usually
-    res_pr = supabase.table('payment_records').select('*').eq('student_id', student_record.user_id).execute()
-    paid_records = { pr['payment_id']: SupabaseModel(pr) for pr in res_pr.data }
-    
-    # Combine
-    invoice_items = []
-    for payment in class_payments:
-        item = {
-            'id': payment.id,
-            'title': payment.title,
-            'amount': payment.amount,
-            'paid': False,
-            'payment_record_id': None
-        }
-        if payment.id in paid_records:
-            pr = paid_records[payment.id]
-            item['paid'] = pr.paid
-            item['payment_record_id'] = pr.id
-            item['amount_paid'] = pr.amount_paid
-        invoice_items.append(item)
+    invoice = student_invoice(supabase, res_st.data[0])
     
     return render_template('payments/invoice.html',
                          student_record=student_record,
-                         invoice_items=invoice_items)
+                         invoice=invoice,
+                         posting_key=uuid.uuid4().hex)
 
 
 @payments_bp.route('/pay/<int:student_id>/<int:payment_id>', methods=['POST'])
@@ -121,53 +136,59 @@ def invoice(student_id):
 def pay(student_id, payment_id):
     """Process payment"""
     # student_id here is StudentRecord ID based on invoice route logic
-    supabase = get_db()
-    
-    res_st = supabase.table('student_records').select('*').eq('id', student_id).execute()
-    if not res_st.data: abort(404)
-    student_record = SupabaseModel(res_st.data[0])
-    
-    res_pay = supabase.table('payments').select('*').eq('id', payment_id).execute()
-    if not res_pay.data: abort(404)
-    payment = SupabaseModel(res_pay.data[0])
-    
-    # Check if record exists
-    res_pr = supabase.table('payment_records').select('*').eq('student_id', student_record.user_id).eq('payment_id', payment.id).execute()
-    
+    # The invoice form sends a key per rendered Pay button; replays of it are no-ops
+    key = (request.form.get('idempotency_key') or '')[:100] or uuid.uuid4().hex
     try:
-        pr_id = None
-        if not res_pr.data:
-            # Insert
-            new_pr = {
-                'payment_id': payment.id,
-                'student_id': student_record.user_id,
-                'year': payment.year,
-                'amount_paid': payment.amount,
-                'paid': True
-            }
-            res_ins = supabase.table('payment_records').insert(new_pr).execute()
-            pr_id = res_ins.data[0]['id']
-        else:
-            # Update
-            pr_id = res_pr.data[0]['id']
-            upd_pr = {
-                'paid': True,
-                'amount_paid': payment.amount
-            }
-            supabase.table('payment_records').update(upd_pr).eq('id', pr_id).execute()
-        
-        # Create receipt
-        new_receipt = {
-            'pr_id': pr_id,
-            'amount_paid': payment.amount,
-            'year': payment.year
-        }
-        supabase.table('receipts').insert(new_receipt).execute()
-        
-        flash(f'Payment for {payment.title} recorded successfully', 'success')
-        
-    except Exception as e:
+        result = post_payment(get_db(), student_id, payment_id, key)
+    except PaymentError as e:
         flash(f'Payment failed: {str(e)}', 'danger')
+        return redirect(url_for('payments.invoice', student_id=student_id))
+
+    if result.posted:
+        adjust_stat('outstanding_payments', -1)
+        flash(f'Payment recorded successfully (receipt #{result.receipt_id})', 'success')
+    elif result.status == 'duplicate':
+        flash(f'Payment was already recorded (receipt #{result.receipt_id})', 'info')
+    else:
+        flash('This payment has already been paid', 'info')
 
     return redirect(url_for('payments.invoice', student_id=student_id))
 
+
+@payments_bp.route('/bulk', methods=['GET', 'POST'])
+@login_required
+@accountant_required
+def bulk():
+    """Post many payments at once from pasted rows or a CSV upload"""
+    report = None
+    
+    if request.method == 'POST':
+        upload = request.files.get('csv_file')
+        if upload and upload.filename:
+            text = upload.read().decode('utf-8-sig', errors='replace')
+        else:
+            text = request.form.get('rows', '')
+        batch_key = (request.form.get('batch_key') or '')[:64] or uuid.uuid4().hex
+        
+        report = parse_payment_rows(text, max_rows=current_app.config.get('BULK_PAYMENT_MAX_ROWS', 1000))
+        if not report.results:
+            flash('No payment rows were submitted', 'warning')
+        else:
+            try:
+                post_payment_rows(get_db(), report, batch_key)
+            except Exception as e:
+                flash(f'Bulk posting failed: {str(e)}', 'danger')
+                report = None
+        
+        if report and report.replayed:
+            flash('This batch has already been posted; nothing was written', 'info')
+        elif report and report.results:
+            if report.posted:
+                adjust_stat('outstanding_payments', -report.settled)
+                flash(f'Posted {len(report.posted)} payment(s) totalling {report.total_posted:.2f}', 'success')
+            if report.failed:
+                flash(f'{len(report.failed)} row(s) were not posted: {report.summary()}', 'warning')
+    
+    return render_template('payments/bulk.html',
+                         report=report,
+                         batch_key=uuid.uuid4().hex)
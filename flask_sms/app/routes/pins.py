@@ -1,12 +1,14 @@
 """
 PINs management routes
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request
-from flask_login import login_required
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask_login import login_required, current_user
 # from app.models import Pin, db
-from app.supabase_db import get_db, SupabaseModel
+from app.supabase_db import get_db
 from app.utils.helpers import admin_required
-import secrets
+from app.utils.pagination import paginate
+from app.utils.streaming import stream_page
+from app.utils.jobs import enqueue
 
 pins_bp = Blueprint('pins', __name__)
 
@@ -17,9 +19,9 @@ pins_bp = Blueprint('pins', __name__)
 def index():
     """List all PINs"""
     supabase = get_db()
-    res = supabase.table('pins').select('*').order('created_at', desc=True).execute()
-    pins = SupabaseModel.from_list(res.data)
-    return render_template('pins/index.html', pins=pins)
+    # Newest first; ids grow with created_at
+    pins = paginate(supabase, 'pins', '*', desc=True, timestamps=('created_at',))
+    return stream_page('pins/index.html', pins=pins)
 
 
 @pins_bp.route('/create', methods=['GET', 'POST'])
@@ -29,18 +31,10 @@ def create():
     """Generate new PINs"""
     if request.method == 'POST':
         count = request.form.get('count', type=int, default=1)
-        supabase = get_db()
-        
-        pins_data = []
-        for _ in range(count):
-            code = secrets.token_hex(8).upper()
-            pins_data.append({'code': code})
-        
-        try:
-            supabase.table('pins').insert(pins_data).execute()
-            flash(f'{count} PIN(s) generated successfully!', 'success')
-            return redirect(url_for('pins.index'))
-        except Exception as e:
-            flash(f'Pin generation failed: {str(e)}', 'danger')
+        max_count = current_app.config.get('PIN_MAX_COUNT', 10000)
+        if count and 0 < count <= max_count:
+            job_id = enqueue('generate_pins', user_id=current_user.id, return_url=url_for('pins.index'), count=count)
+            return redirect(url_for('jobs.show', job_id=job_id))
+        flash(f'Enter how many PINs to generate, at most {max_count}.', 'danger')
     
     return render_template('pins/create.html')
@@ -1,14 +1,26 @@
 """
 Student management routes
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, current_app
 from flask_login import login_required, current_user
 # from app.models import User, StudentRecord, MyClass, Section, Promotion, BloodGroup, State, Lga, Nationality, db
 from app.supabase_db import get_db, SupabaseModel
 from datetime import datetime
-from werkzeug.security import generate_password_hash
-from app.forms.student_forms import StudentForm, PromotionForm
+from app.forms.student_forms import StudentForm, PromotionForm, StudentImportForm
 from app.utils.helpers import admin_required, teacher_or_admin_required
+from app.utils.lookups import get_lookup, lookup_choices, invalidate_lookups
+from app.utils.user_cache import invalidate_user
+from app.utils.dashboard_stats import user_added, user_removed, adjust_stat
+from app.utils.pagination import paginate, invalidate_counts, iter_batches
+from app.utils.projections import projection
+from app.utils.fanout import fetch_all
+from app.utils.exports import export_response
+from app.utils.streaming import stream_page
+from app.utils.passwords import hash_password
+from app.utils.jobs import enqueue
+from app.utils.result_snapshots import invalidate_class_snapshots
+from app.utils.student_import import (parse_student_csv, validate_students, import_students,
+                                      REQUIRED_COLUMNS, OPTIONAL_COLUMNS)
 # from sqlalchemy import or_
 
 students_bp = Blueprint('students', __name__)
@@ -19,51 +31,11 @@ students_bp = Blueprint('students', __name__)
 @teacher_or_admin_required
 def index():
     """List all students"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    start = (page - 1) * per_page
-    end = start + per_page - 1
-    
     supabase = get_db()
-    # Fetch students with user info. Supabase join syntax:
-    # student_records (*, user:user_id (*), my_class:my_class_id (*), section:section_id (*))
-    
-    # FIX: Ambiguous FK relationship between student_records and users.
-    # Specify the relationship explicitly using the FK constraint name or column name if supported by postgrest-py
-    # Using specific resource embedding syntax: resource!fk_name(*)
-    
-    res = supabase.table('student_records').select(
-        '*, user:users!student_records_user_id_fkey(*), my_class:my_classes(*), section:sections(*)', count='exact'
-    ).eq('grad', False).eq('wd', False).range(start, end).execute()
-    
-    total_count = res.count
-    
-    # Create a wrapper object to mimic Flask-SQLAlchemy pagination object
-    class PaginationMock:
-        def __init__(self, items, page, per_page, total):
-            self.items = SupabaseModel.from_list(items)
-            self.page = page
-            self.per_page = per_page
-            self.total = total
-            self.pages = (total + per_page - 1) // per_page
-            self.has_prev = page > 1
-            self.has_next = page < self.pages
-            self.prev_num = page - 1
-            self.next_num = page + 1
-            
-        def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
-             last = 0
-             for num in range(1, self.pages + 1):
-                if num <= left_edge or \
-                   (num > self.page - left_current - 1 and \
-                    num < self.page + right_current) or \
-                   num > self.pages - right_edge:
-                    if last + 1 != num:
-                        yield None
-                    yield num
-                    last = num
-
-    students = PaginationMock(res.data, page, per_page, total_count)
+    students = paginate(
+        supabase, 'student_records', projection('students.index'),
+        filters={'grad': False, 'wd': False}
+    )
     
     return render_template('students/index.html', students=students)
 
@@ -85,7 +57,7 @@ def list_by_class(class_id):
     
     # Get Students
     res = supabase.table('student_records').select(
-         '*, user:users!student_records_user_id_fkey(*), my_class:my_classes(*), section:sections(*)'
+        projection('students.list_by_class')
     ).eq('my_class_id', class_id).eq('grad', False).eq('wd', False).execute()
     
     students = SupabaseModel.from_list(res.data)
@@ -93,6 +65,30 @@ def list_by_class(class_id):
     return render_template('students/list_by_class.html', students=students, my_class=my_class)
 
 
+@students_bp.route('/list/<int:class_id>/export.<fmt>')
+@login_required
+@teacher_or_admin_required
+def export_class_list(class_id, fmt):
+    """Download the students of a class as CSV or XLSX"""
+    supabase = get_db()
+    
+    res_cls = supabase.table('my_classes').select('id, name').eq('id', class_id).execute()
+    if not res_cls.data:
+        abort(404)
+    class_name = res_cls.data[0]['name']
+    
+    def rows():
+        for batch in iter_batches(supabase, 'student_records', projection('students.list_by_class'),
+                                  filters={'my_class_id': class_id, 'grad': False, 'wd': False}):
+            for student in batch:
+                user = student.get('user') or {}
+                section = student.get('section') or {}
+                yield [student['adm_no'], user.get('name'), section.get('name'), (user.get('gender') or '').title()]
+    
+    return export_response(fmt, f'{class_name}_students', ['Adm No', 'Name', 'Section', 'Gender'],
+                           rows(), sheet_name=class_name)
+
+
 @students_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -102,19 +98,10 @@ def create():
     supabase = get_db()
     
     # Populate choices
-    res_c = supabase.table('my_classes').select('id, name').execute()
-    form.my_class_id.choices = [(c['id'], c['name']) for c in res_c.data]
-    
-    res_s = supabase.table('sections').select('id, name').eq('active', True).execute()
-    form.section_id.choices = [(s['id'], s['name']) for s in res_s.data]
-    
-    res_p = supabase.table('users').select('id, name').eq('user_type', 'parent').execute()
-    form.my_parent_id.choices = [(p['id'], p['name']) for p in res_p.data]
-    form.my_parent_id.choices.insert(0, (0, 'Select Parent'))
-    
-    res_bg = supabase.table('blood_groups').select('id, name').execute()
-    form.blood_group_id.choices = [(b['id'], b['name']) for b in res_bg.data]
-    form.blood_group_id.choices.insert(0, (0, 'Select Blood Group'))
+    form.my_class_id.choices = lookup_choices('my_classes')
+    form.section_id.choices = lookup_choices('sections', active=True)
+    form.my_parent_id.choices = lookup_choices('users', 'Select Parent', user_type='parent')
+    form.blood_group_id.choices = lookup_choices('blood_groups', 'Select Blood Group')
     
     if form.validate_on_submit():
         # Check Existing
@@ -139,7 +126,7 @@ def create():
             'gender': form.gender.data,
             'address': form.address.data,
             'bg_id': form.blood_group_id.data if form.blood_group_id.data > 0 else None,
-            'password': generate_password_hash(form.password.data)
+            'password': hash_password(form.password.data)
         }
         
         try:
@@ -159,6 +146,10 @@ def create():
                 'age': form.age.data
             }
             supabase.table('student_records').insert(student_data).execute()
+            invalidate_class_snapshots(supabase, [form.my_class_id.data])
+            invalidate_lookups('users')
+            invalidate_counts('users', 'student_records')
+            user_added('student')
             
             flash(f'Student {form.name.data} created successfully!', 'success')
             return redirect(url_for('students.index'))
@@ -169,6 +160,53 @@ def create():
     return render_template('students/create.html', form=form)
 
 
+@students_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_csv():
+    """Admit a whole intake of students from a CSV file"""
+    form = StudentImportForm()
+    supabase = get_db()
+    
+    form.my_class_id.choices = lookup_choices('my_classes')
+    form.section_id.choices = lookup_choices('sections', active=True)
+    report = None
+    
+    if form.validate_on_submit():
+        text = form.csv_file.data.read().decode('utf-8-sig', errors='replace')
+        report = parse_student_csv(text, max_rows=current_app.config.get('IMPORT_MAX_ROWS', 2000))
+        
+        if report.missing_columns:
+            flash(f"The file is missing the column(s): {', '.join(report.missing_columns)}", 'danger')
+        elif not report.results:
+            flash('The file has no student rows', 'warning')
+        else:
+            defaults = {
+                'my_class_id': form.my_class_id.data,
+                'section_id': form.section_id.data,
+                'year_admitted': form.year_admitted.data,
+                'session': form.session.data
+            }
+            try:
+                validate_students(supabase, report, defaults,
+                                  get_lookup('my_classes'),
+                                  get_lookup('sections', columns='id, name, my_class_id'))
+                import_students(supabase, report)
+            except Exception as e:
+                flash(f'Import failed: {str(e)}', 'danger')
+            
+            if report.imported:
+                invalidate_lookups('users')
+                invalidate_counts('users', 'student_records')
+                adjust_stat('total_students', len(report.imported))
+                flash(f'Imported {len(report.imported)} student(s)', 'success')
+            if report.failed:
+                flash(f'{len(report.failed)} row(s) were not imported: {report.summary()}', 'warning')
+    
+    return render_template('students/import.html', form=form, report=report,
+                           required_columns=REQUIRED_COLUMNS, optional_columns=OPTIONAL_COLUMNS)
+
+
 @students_bp.route('/<int:id>')
 @login_required
 def show(id):
@@ -217,10 +255,17 @@ def edit(id):
     """Edit student"""
     supabase = get_db()
     
-    # Fetch existing - Fix ambiguous relationship
-    res = supabase.table('student_records').select('*, user:users!student_records_user_id_fkey(*)').eq('id', id).execute()
-    if not res.data: abort(404)
-    student_data = res.data[0]
+    # The record and every form lookup are independent reads; fetch them together
+    reads = fetch_all(
+        # Fix ambiguous relationship
+        record=supabase.table('student_records').select('*, user:users!student_records_user_id_fkey(*)').eq('id', id),
+        classes=lambda: lookup_choices('my_classes'),
+        sections=lambda: lookup_choices('sections', active=True),
+        parents=lambda: lookup_choices('users', 'Select Parent', user_type='parent'),
+        blood_groups=lambda: lookup_choices('blood_groups', 'Select Blood Group')
+    )
+    if not reads['record']: abort(404)
+    student_data = reads['record'][0]
     student_record = SupabaseModel(student_data)
     user_data = student_data['user'] # Nested dict
     
@@ -236,39 +281,10 @@ def edit(id):
     form = StudentForm(obj=user)
     
     # Populate choices
-    res_c = supabase.table('my_classes').select('id, name').execute()
-    form.my_class_id.choices = [(c['id'], c['name']) for c in res_c.data]
-    
-    res_s = supabase.table('sections').select('id, name').eq('active', True).execute()
-    form.section_id.choices = [(s['id'], s['name']) for s in res_s.data]
-    
-    res_p = supabase.table('users').select('id, name').eq('user_type', 'parent').execute()
-    form.my_parent_id.choices = [(p['id'], p['name']) for p in res_p.data]
-    form.my_parent_id.choices.insert(0, (0, 'Select Parent'))
-    
-    res_bg = supabase.table('blood_groups').select('id, name').execute()
-    form.blood_group_id.choices = [(b['id'], b['name']) for b in res_bg.data]
-    form.blood_group_id.choices.insert(0, (0, 'Select Blood Group'))
-    
-    # Handling SelectField population for state/lga/nationality if they exist in DB
-    # Assuming tables 'states', 'lgas', 'nationalities' exist or we remove if not critical 
-    # The original generic 'edit' usually expects these. I will mock empty or fetch if they exist.
-    # For now, let's assume they might not be critical or we strictly need them.
-    # The user provided query: State.query.all()
-    try:
-        res_st = supabase.table('states').select('id, name').execute()
-        form.state_id.choices = [(s['id'], s['name']) for s in res_st.data]
-    except: form.state_id.choices = []
-
-    try:
-        res_lg = supabase.table('lgas').select('id, name').execute()
-        form.lga_id.choices = [(l['id'], l['name']) for l in res_lg.data]
-    except: form.lga_id.choices = []
-    
-    try:
-        res_n = supabase.table('nationalities').select('id, name').execute()
-        form.nationality_id.choices = [(n['id'], n['name']) for n in res_n.data]
-    except: form.nationality_id.choices = []
+    form.my_class_id.choices = reads['classes']
+    form.section_id.choices = reads['sections']
+    form.my_parent_id.choices = reads['parents']
+    form.blood_group_id.choices = reads['blood_groups']
 
     # Pre-populate form with student_record specific fields that are not in User
     if request.method == 'GET':
@@ -299,6 +315,10 @@ def edit(id):
             'my_parent_id': form.my_parent_id.data if form.my_parent_id.data > 0 else None
         }
         supabase.table('student_records').update(student_updates).eq('id', id).execute()
+        if student_record.my_class_id != student_updates['my_class_id']:
+            invalidate_class_snapshots(supabase, [student_record.my_class_id, student_updates['my_class_id']])
+        invalidate_lookups('users')
+        invalidate_user(user.id)
         
         flash('Student updated successfully!', 'success')
         return redirect(url_for('students.show', id=id))
@@ -314,7 +334,7 @@ def delete(id):
     supabase = get_db()
     
     # Get student record to find user_id
-    res = supabase.table('student_records').select('user_id').eq('id', id).execute()
+    res = supabase.table('student_records').select('user_id, my_class_id').eq('id', id).execute()
     if not res.data:
         abort(404)
         
@@ -322,9 +342,15 @@ def delete(id):
     
     # Delete Student Record first (if no cascade)
     supabase.table('student_records').delete().eq('id', id).execute()
+    invalidate_class_snapshots(supabase, [res.data[0]['my_class_id']])
     
     # Delete User
-    supabase.table('users').delete().eq('id', user_id).execute()
+    res_del = supabase.table('users').delete().eq('id', user_id).execute()
+    invalidate_lookups('users')
+    invalidate_counts('users', 'student_records')
+    invalidate_user(user_id)
+    if res_del.data:
+        user_removed('student')
     
     flash('Student deleted successfully!', 'success')
     return redirect(url_for('students.index'))
@@ -336,9 +362,28 @@ def delete(id):
 def graduated():
     """List graduated students"""
     supabase = get_db()
-    res = supabase.table('student_records').select('*, user:users(*)').eq('grad', True).execute()
-    students = SupabaseModel.from_list(res.data)
-    return render_template('students/graduated.html', students=students)
+    students = paginate(supabase, 'student_records', projection('students.graduated'), filters={'grad': True},
+                        timestamps=('grad_date',))
+    return stream_page('students/graduated.html', students=students)
+
+
+@students_bp.route('/graduated/export.<fmt>')
+@login_required
+@admin_required
+def export_graduated(fmt):
+    """Download every graduated student as CSV or XLSX"""
+    supabase = get_db()
+    
+    def rows():
+        for batch in iter_batches(supabase, 'student_records', projection('students.graduated'),
+                                  filters={'grad': True}):
+            for student in batch:
+                user = student.get('user') or {}
+                grad_date = student.get('grad_date')
+                yield [user.get('name'), student['adm_no'], grad_date[:4] if grad_date else 'N/A']
+    
+    return export_response(fmt, 'graduated_students', ['Name', 'Admission No', 'Graduation Year'],
+                           rows(), sheet_name='Graduated')
 
 
 @students_bp.route('/<int:id>/not-graduated', methods=['POST'])
@@ -347,7 +392,9 @@ def graduated():
 def not_graduated(id):
     """Mark student as not graduated"""
     supabase = get_db()
-    supabase.table('student_records').update({'grad': False, 'grad_date': None}).eq('id', id).execute()
+    res = supabase.table('student_records').update({'grad': False, 'grad_date': None}).eq('id', id).execute()
+    invalidate_counts('student_records')
+    invalidate_class_snapshots(supabase, [r.get('my_class_id') for r in res.data or []])
     
     flash('Student marked as not graduated', 'success')
     return redirect(url_for('students.graduated'))
@@ -374,17 +421,40 @@ def reset_pass(st_id):
     # We must replicate set_password logic here: hash and update DB.
     
     new_pass = student_record.adm_no
-    new_hash = generate_password_hash(new_pass)
+    new_hash = hash_password(new_pass)
     
     # Update User table
     # student_record.user is a dict, so student_record.user['id']
     user_id = student_record.user['id']
     supabase.table('users').update({'password': new_hash}).eq('id', user_id).execute()
+    invalidate_user(user_id)
     
     flash(f'Password reset for {student_record.user["name"]}. New password: {new_pass}', 'success')
     return redirect(url_for('students.show', id=st_id))
 
 
+@students_bp.route('/list/<int:class_id>/reset-passwords', methods=['POST'])
+@login_required
+@admin_required
+def reset_class_pass(class_id):
+    """Queue a password reset of every student in a class and its credential sheet"""
+    supabase = get_db()
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in ('pdf', 'csv'):
+        abort(400)
+    
+    res_cls = supabase.table('my_classes').select('id, name').eq('id', class_id).execute()
+    if not res_cls.data:
+        abort(404)
+    
+    # The sheet is kept on the job for a one-time download from its status page
+    job_id = enqueue('reset_class_passwords', user_id=current_user.id,
+                     return_url=url_for('students.list_by_class', class_id=class_id),
+                     class_id=class_id, class_name=res_cls.data[0]['name'], fmt=fmt,
+                     mode=request.form.get('mode', 'random'))
+    return redirect(url_for('jobs.show', job_id=job_id))
+
+
 @students_bp.route('/promotion', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -404,7 +474,7 @@ def promotion():
                               tc=to_class, ts=to_section,
                               from_session=from_session, to_session=to_session))
     
-    res_c = supabase.table('my_classes').select('*').execute()
+    res_c = supabase.table('my_classes').select(projection('students.promotion')).execute()
     classes = SupabaseModel.from_list(res_c.data)
     return render_template('students/promotion.html', classes=classes)
 
@@ -422,7 +492,7 @@ def promotion_selector():
     from_session = request.args.get('from_session')
     to_session = request.args.get('to_session')
     
-    res_s = supabase.table('student_records').select('*, user:users(*)').eq('my_class_id', fc).eq('section_id', fs).eq('session', from_session).execute()
+    res_s = supabase.table('student_records').select(projection('students.promotion_selector')).eq('my_class_id', fc).eq('section_id', fs).eq('session', from_session).execute()
     students = SupabaseModel.from_list(res_s.data)
     
     res_fc = supabase.table('my_classes').select('*').eq('id', fc).execute()
@@ -442,38 +512,20 @@ def promotion_selector():
 @admin_required
 def promote():
     """Execute student promotion"""
-    supabase = get_db()
     student_ids = request.form.getlist('student_ids[]')
     to_class = request.form.get('to_class', type=int)
     to_section = request.form.get('to_section', type=int)
     to_session = request.form.get('to_session')
     
-    for student_id in student_ids:
-        res_sr = supabase.table('student_records').select('*').eq('id', student_id).execute()
-        if res_sr.data:
-            student_record = res_sr.data[0]
-            # Create promotion record
-            promotion = {
-                'student_id': student_record['user_id'],
-                'from_class': student_record['my_class_id'],
-                'from_section': student_record['section_id'],
-                'to_class': to_class,
-                'to_section': to_section,
-                'from_session': student_record['session'],
-                'to_session': to_session
-            }
-            supabase.table('promotions').insert(promotion).execute()
-            
-            # Update student record
-            updates = {
-                'my_class_id': to_class,
-                'section_id': to_section,
-                'session': to_session
-            }
-            supabase.table('student_records').update(updates).eq('id', student_id).execute()
+    if not student_ids:
+        flash('No students were selected for promotion.', 'warning')
+        return redirect(url_for('students.promotion'))
     
-    flash(f'{len(student_ids)} students promoted successfully!', 'success')
-    return redirect(url_for('students.index'))
+    # All selected students move together or not at all, in the background
+    job_id = enqueue('promote_students', user_id=current_user.id, return_url=url_for('students.index'),
+                     record_ids=sorted({int(i) for i in student_ids}),
+                     to_class=to_class, to_section=to_section, to_session=to_session)
+    return redirect(url_for('jobs.show', job_id=job_id))
 
 
 @students_bp.route('/promotion/manage')
@@ -482,12 +534,9 @@ def promote():
 def promotion_manage():
     """Manage promotions"""
     supabase = get_db()
-    res = supabase.table('promotions').select('*, student:users(*), from_cls:my_classes!from_class(*), to_cls:my_classes!to_class(*)').order('created_at', desc=True).execute()
-    promotions = SupabaseModel.from_list(res.data)
-    # Note: Joins with alias 'from_cls' for 'my_classes' at foreign key 'from_class' might need explicit FK hint in Query.
-    # Supabase syntax: select('*, student:users(*), from_cls:my_classes!from_class(*)')
-    # Assuming FK exists. If not, simple select and manual fetch.
-    return render_template('students/promotion_manage.html', promotions=promotions)
+    res = supabase.table('promotions').select(projection('students.promotion_manage')).order('created_at', desc=True).execute()
+    promotions = SupabaseModel.lazy(res.data, timestamps=('created_at',))
+    return stream_page('students/promotion_manage.html', promotions=promotions)
 
 
 @students_bp.route('/promotion/reset/<int:pid>', methods=['POST'])
@@ -513,6 +562,7 @@ def promotion_reset(pid):
                 'session': promotion['from_session']
             }
             supabase.table('student_records').update(updates).eq('id', s_id).execute()
+            invalidate_class_snapshots(supabase, [promotion['from_class'], promotion['to_class']])
         
         # Delete promotion
         supabase.table('promotions').delete().eq('id', pid).execute()
@@ -7,6 +7,8 @@ from flask_login import login_required
 from app.supabase_db import get_db, SupabaseModel
 from app.forms.subject_forms import SubjectForm
 from app.utils.helpers import admin_required
+from app.utils.lookups import lookup_choices
+from app.utils.projections import projection
 
 subjects_bp = Blueprint('subjects', __name__)
 
@@ -16,7 +18,7 @@ subjects_bp = Blueprint('subjects', __name__)
 def index():
     """List all subjects"""
     supabase = get_db()
-    res = supabase.table('subjects').select('*, my_class:my_classes(*), teacher:users(*)').execute()
+    res = supabase.table('subjects').select(projection('subjects.index')).execute()
     subjects = SupabaseModel.from_list(res.data)
     return render_template('subjects/index.html', subjects=subjects)
 
@@ -30,12 +32,8 @@ def create():
     supabase = get_db()
     
     # Populate choices
-    res_c = supabase.table('my_classes').select('id, name').execute()
-    form.my_class_id.choices = [(c['id'], c['name']) for c in res_c.data]
-    
-    res_t = supabase.table('users').select('id, name').eq('user_type', 'teacher').execute()
-    form.teacher_id.choices = [(t['id'], t['name']) for t in res_t.data]
-    form.teacher_id.choices.insert(0, (0, 'Select Teacher'))
+    form.my_class_id.choices = lookup_choices('my_classes')
+    form.teacher_id.choices = lookup_choices('users', 'Select Teacher', user_type='teacher')
     
     if form.validate_on_submit():
         new_subject = {
@@ -73,12 +71,8 @@ def edit(id):
         form.process(data=subject_data)
     
     # Populate choices
-    res_c = supabase.table('my_classes').select('id, name').execute()
-    form.my_class_id.choices = [(c['id'], c['name']) for c in res_c.data]
-    
-    res_t = supabase.table('users').select('id, name').eq('user_type', 'teacher').execute()
-    form.teacher_id.choices = [(t['id'], t['name']) for t in res_t.data]
-    form.teacher_id.choices.insert(0, (0, 'Select Teacher'))
+    form.my_class_id.choices = lookup_choices('my_classes')
+    form.teacher_id.choices = lookup_choices('users', 'Select Teacher', user_type='teacher')
     
     if form.validate_on_submit():
         update_data = {
@@ -6,6 +6,8 @@ from flask_login import login_required
 # from app.models import TimeTable, TimeTableRecord, TimeSlot, MyClass, Subject, db
 from app.supabase_db import get_db, SupabaseModel
 from app.utils.helpers import admin_required
+from app.utils.lookups import get_lookup
+from app.utils.projections import projection
 
 timetables_bp = Blueprint('timetables', __name__)
 
@@ -15,7 +17,7 @@ timetables_bp = Blueprint('timetables', __name__)
 def index():
     """List all timetables"""
     supabase = get_db()
-    res = supabase.table('timetables').select('*, my_class:my_classes(*)').execute()
+    res = supabase.table('timetables').select(projection('timetables.index')).execute()
     timetables = SupabaseModel.from_list(res.data)
     return render_template('timetables/index.html', timetables=timetables)
 
@@ -41,8 +43,7 @@ def create():
         except Exception as e:
             flash(f'Creation failed: {str(e)}', 'danger')
     
-    res_c = supabase.table('my_classes').select('*').execute()
-    classes = SupabaseModel.from_list(res_c.data)
+    classes = SupabaseModel.from_list(get_lookup('my_classes'))
     return render_template('timetables/create.html', classes=classes)
 
 
@@ -7,8 +7,13 @@ from app.supabase_db import get_db, SupabaseModel
 from datetime import datetime
 # from app.models import User, StaffRecord, db
 from app.forms.user_forms import UserForm, StaffForm
-from werkzeug.security import generate_password_hash
+from app.utils.passwords import hash_password
 from app.utils.helpers import admin_required
+from app.utils.lookups import invalidate_lookups
+from app.utils.user_cache import invalidate_user
+from app.utils.dashboard_stats import user_added, user_removed
+from app.utils.pagination import paginate, invalidate_counts
+from app.utils.projections import projection
 
 users_bp = Blueprint('users', __name__)
 
@@ -19,48 +24,9 @@ users_bp = Blueprint('users', __name__)
 def index():
     """List all users"""
     user_type = request.args.get('type', 'all')
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    start = (page - 1) * per_page
-    end = start + per_page - 1
-    
     supabase = get_db()
-    query = supabase.table('users').select('*', count='exact')
-    
-    if user_type != 'all':
-        query = query.eq('user_type', user_type)
-    
-    # Range is 0-indexed and inclusive in Supabase
-    res = query.range(start, end).execute()
-    total_count = res.count
-    
-    # Create a wrapper object to mimic Flask-SQLAlchemy pagination object
-    class PaginationMock:
-        def __init__(self, items, page, per_page, total):
-            self.items = SupabaseModel.from_list(items)
-            self.page = page
-            self.per_page = per_page
-            self.total = total
-            self.pages = (total + per_page - 1) // per_page
-            self.has_prev = page > 1
-            self.has_next = page < self.pages
-            self.prev_num = page - 1
-            self.next_num = page + 1
-            
-        def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
-             # Simplified iteration logic
-             last = 0
-             for num in range(1, self.pages + 1):
-                if num <= left_edge or \
-                   (num > self.page - left_current - 1 and \
-                    num < self.page + right_current) or \
-                   num > self.pages - right_edge:
-                    if last + 1 != num:
-                        yield None
-                    yield num
-                    last = num
-
-    users = PaginationMock(res.data, page, per_page, total_count)
+    filters = {} if user_type == 'all' else {'user_type': user_type}
+    users = paginate(supabase, 'users', projection('users.index'), filters=filters, keyset=('name', 'id'))
     
     return render_template('users/index.html', users=users, user_type=user_type)
 
@@ -95,11 +61,14 @@ def create():
             'dob': str(form.dob.data) if form.dob.data else None,
             'gender': form.gender.data,
             'address': form.address.data,
-            'password': generate_password_hash(form.password.data)
+            'password': hash_password(form.password.data)
         }
         
         try:
              supabase.table('users').insert(new_user).execute()
+             invalidate_lookups('users')
+             invalidate_counts('users')
+             user_added(new_user['user_type'])
              flash(f'User {form.name.data} created successfully!', 'success')
              return redirect(url_for('users.index'))
         except Exception as e:
@@ -181,6 +150,12 @@ def edit(id):
         
         try:
              supabase.table('users').update(update_data).eq('id', id).execute()
+             invalidate_lookups('users')
+             invalidate_user(id)
+             if user.user_type != update_data['user_type']:
+                 invalidate_counts('users')
+                 user_removed(user.user_type)
+                 user_added(update_data['user_type'])
              flash('User updated successfully!', 'success')
              return redirect(url_for('users.show', id=id))
         except Exception as e:
@@ -196,7 +171,12 @@ def delete(id):
     """Delete user"""
     supabase = get_db()
     try:
-        supabase.table('users').delete().eq('id', id).execute()
+        res = supabase.table('users').delete().eq('id', id).execute()
+        invalidate_lookups('users')
+        invalidate_counts('users')
+        invalidate_user(id)
+        for deleted in res.data or []:
+            user_removed(deleted.get('user_type'))
         flash('User deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting user: {str(e)}', 'danger')
@@ -220,8 +200,9 @@ def reset_pass(id):
         if not password or len(password) < 6:
             flash('Password must be at least 6 characters long.', 'danger')
         else:
-            new_hash = generate_password_hash(password)
+            new_hash = hash_password(password)
             supabase.table('users').update({'password': new_hash}).eq('id', id).execute()
+            invalidate_user(id)
             flash(f'Password changed successfully for {user.name}.', 'success')
             return redirect(url_for('users.show', id=id))
             
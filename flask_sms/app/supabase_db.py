@@ -1,5 +1,16 @@
 import os
-from supabase import create_client, Client
+import atexit
+import threading
+import time
+from datetime import datetime
+import httpx
+from supabase import create_client, ClientOptions
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Fetch and clean environment variables
 url_raw = os.environ.get("SUPABASE_URL", "")
@@ -38,46 +49,268 @@ else:
     else:
         print(f"Supabase Client init using key starting with: {key[:5]}...")
 
-# Initialize client only if env vars exist (to avoid circular import errors during setup)
-supabase: Client = create_client(url, key) if url and key else None
+# Connection pool tuning; one pool per worker process is shared by every thread
+POOL_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_POOL_MAX_CONNECTIONS", 20))
+POOL_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_POOL_MAX_KEEPALIVE", 10))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_POOL_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("SUPABASE_READ_TIMEOUT", 30))
+USE_HTTP2 = HTTP2_AVAILABLE and os.environ.get("SUPABASE_HTTP2", "1") not in ("0", "false", "False")
+
+
+class PoolStats:
+    """Request counters for one worker's connection pool"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.total_seconds = 0.0
+            self.http_versions = {}
+
+    def record(self, seconds, http_version):
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += seconds
+            self.http_versions[http_version] = self.http_versions.get(http_version, 0) + 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """httpx transport that times every request (until response headers) into PoolStats"""
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request):
+        start = time.monotonic()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.stats.record_error()
+            raise
+        http_version = response.extensions.get("http_version", b"").decode() or "unknown"
+        self.stats.record(time.monotonic() - start, http_version)
+        return response
+
+    def connection_counts(self):
+        connections = list(getattr(self._pool, "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+class ClientManager:
+    """
+    Owns the Supabase client and the keep-alive HTTP pool behind it.
+
+    The client is built on first use, so a gunicorn master that imports the
+    app never opens sockets, and it is rebuilt in any process that did not
+    create it (after a fork), so workers never share TLS connections.
+    httpx.Client is thread-safe; creation is guarded by a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._http = None
+        self._transport = None
+        self._pid = None
+        self.stats = PoolStats()
+        self.clients_created = 0
+
+    def _credentials(self):
+        # Environment may have been loaded after this module was imported
+        current_url = (os.environ.get("SUPABASE_URL") or url or "").strip().strip("'").strip('"')
+        current_key = os.environ.get("SUPABASE_ANON_KEY") or os.environ.get("SUPABASE_KEY") or key
+        current_key = current_key.strip().strip("'").strip('"') if current_key else None
 
-def get_db():
-    """Get the Supabase client instance"""
-    if not supabase:
-        # Fallback or re-attempt if env vars were loaded late
-        current_url = os.environ.get("SUPABASE_URL")
-        current_key = os.environ.get("SUPABASE_ANON_KEY") or os.environ.get("SUPABASE_KEY")
-        
         if not current_url:
             print("ERROR: SUPABASE_URL is missing from environment.")
         if not current_key:
             print("ERROR: SUPABASE_ANON_KEY and SUPABASE_KEY are missing from environment.")
-            
-        if current_url and current_key:
-            return create_client(current_url, current_key)
-        raise Exception("Supabase credentials not found in environment")
-    return supabase
+        if not (current_url and current_key):
+            raise Exception("Supabase credentials not found in environment")
+        return current_url, current_key
+
+    def _build(self):
+        current_url, current_key = self._credentials()
+        self._transport = MeteredTransport(
+            self.stats,
+            http2=USE_HTTP2,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+            ),
+            retries=1  # retry connection failures only
+        )
+        self._http = httpx.Client(
+            transport=self._transport,
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            follow_redirects=True
+        )
+        self._client = create_client(current_url, current_key, options=ClientOptions(httpx_client=self._http))
+        self._pid = os.getpid()
+        self.clients_created += 1
+
+    def get(self):
+        client = self._client
+        if client is not None and self._pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._forget()
+                self._build()
+            return self._client
+
+    def _forget(self):
+        # After a fork the pool's sockets belong to the parent: drop them, don't close them
+        self._client = self._http = self._transport = None
+        self._pid = None
+
+    def after_fork(self):
+        """Called in a forked child; the next get() builds a fresh pool"""
+        self._lock = threading.Lock()
+        self._forget()
+        self.stats = PoolStats()
+        self.clients_created = 0
+
+    def close(self):
+        with self._lock:
+            if self._http is not None and self._pid == os.getpid():
+                self._http.close()
+            self._forget()
+
+    def metrics(self):
+        """Pool and request counters for this worker process"""
+        stats = self.stats
+        data = {
+            "pid": os.getpid(),
+            "http2": USE_HTTP2,
+            "max_connections": POOL_MAX_CONNECTIONS,
+            "max_keepalive": POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": POOL_KEEPALIVE_EXPIRY,
+            "clients_created": self.clients_created,
+            "requests": stats.requests,
+            "errors": stats.errors,
+            "avg_ms": round(stats.total_seconds * 1000 / stats.requests, 1) if stats.requests else None,
+            "http_versions": dict(stats.http_versions),
+        }
+        transport = self._transport
+        if transport is not None and self._pid == os.getpid():
+            data["connections"] = transport.connection_counts()
+        return data
+
+
+client_manager = ClientManager()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=client_manager.after_fork)
+atexit.register(client_manager.close)
+
+
+def get_db():
+    """Get the Supabase client of this worker process"""
+    return client_manager.get()
+
+
+def get_pool_metrics():
+    """Connection pool metrics of this worker process"""
+    return client_manager.metrics()
+
+def is_missing_function(error):
+    """True when a PostgREST error means the called RPC function is not installed"""
+    return getattr(error, 'code', None) in ('PGRST202', '42883')
+
+def parse_timestamp(value):
+    """datetime for an ISO date / timestamp string from PostgREST, or the value unchanged"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+
+
+def _wrap(value):
+    """Embedded rows as SupabaseModels, anything else unchanged"""
+    if isinstance(value, dict):
+        return SupabaseModel(value)
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return SupabaseModel.from_list(value)
+    return value
+
 
 class SupabaseModel:
     """
     Wrapper for Supabase dictionary responses to allow object-attribute access.
     Compatible with Jinja2 templates expecting user.name, etc.
+
+    The row dict is read in place rather than copied onto the instance, and
+    the two slots mean there is no per-instance __dict__, so wrapping a
+    listing costs a few dozen bytes per row. Embedded relations (user,
+    my_class, section...) are wrapped when they are read. Attributes set on
+    the model go to a side dict: the row may be shared, e.g. by a cache.
+    Columns named in timestamps are decoded to datetimes on first access.
     """
-    def __init__(self, data):
-        self._data = data
-        if data:
-            for key, value in data.items():
-                # If value is a dict, it might be a relationship -> wrap it too?
-                # For now, keep it simple. If we need deep wrapping, we can add it.
-                setattr(self, key, value)
-    
+    __slots__ = ('_data', '_extra', '_timestamps')
+
+    def __init__(self, data, timestamps=()):
+        object.__setattr__(self, '_data', data or {})
+        object.__setattr__(self, '_extra', None)
+        object.__setattr__(self, '_timestamps', timestamps)
+
+    def __getattr__(self, name):
+        # Only reached for names that are not methods or properties
+        extra = self._extra
+        if extra is not None and name in extra:
+            return extra[name]
+        try:
+            value = self._data[name]
+        except KeyError:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'") from None
+        if name in self._timestamps:
+            value = parse_timestamp(value)
+            self.__setattr__(name, value)
+            return value
+        return _wrap(value)
+
+    def __setattr__(self, name, value):
+        if self._extra is None:
+            object.__setattr__(self, '_extra', {})
+        self._extra[name] = value
+
+    def __getitem__(self, key):
+        try:
+            return self.__getattr__(key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self._data or bool(self._extra and key in self._extra)
+
     def get(self, key, default=None):
-        return self._data.get(key, default)
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self.get('id')!r}>"
     
     @classmethod
     def from_list(cls, data_list):
         """Convert a list of dictionaries to a list of SupabaseModels"""
         return [cls(item) for item in data_list] if data_list else []
+
+    @classmethod
+    def lazy(cls, data_list, timestamps=()):
+        """A ResultSet that wraps the rows one by one as it is iterated"""
+        return ResultSet(data_list or [], cls, timestamps)
     
     # Flask-Login required mixin methods
     @property
@@ -94,3 +327,37 @@ class SupabaseModel:
 
     def get_id(self):
         return str(self.id)
+
+
+class ResultSet:
+    """
+    Rows of a response, wrapped in `model` only while they are iterated.
+
+    Nothing is built up front: a template looping over it creates one
+    small model per row and drops it again, so a page can be rendered
+    (or streamed, see app.utils.streaming) while holding nothing but the
+    response rows. Models are not kept between loops, so attributes set
+    on them are lost; use from_list() for rows a route annotates.
+    """
+    __slots__ = ('rows', 'model', 'timestamps')
+
+    def __init__(self, rows, model=SupabaseModel, timestamps=()):
+        self.rows = rows
+        self.model = model
+        self.timestamps = frozenset(timestamps)
+
+    def __iter__(self):
+        model, timestamps = self.model, self.timestamps
+        for row in self.rows:
+            yield model(row, timestamps)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ResultSet(self.rows[index], self.model, self.timestamps)
+        return self.model(self.rows[index], self.timestamps)
@@ -0,0 +1,164 @@
+"""
+Billing engine.
+
+Builds invoices for one student, a whole class or the whole school in a
+fixed number of reads: the students, and the class payments with their
+payment_records embedded. iter_class_invoices() walks a class in keyset
+batches instead, for exports. Every student is billed for the payments of
+their class, like the invoice page and the dashboard's outstanding count.
+"""
+from app.supabase_db import SupabaseModel
+from app.utils.fanout import fetch_all
+from app.utils.pagination import iter_batches
+from app.utils.projections import fields, STUDENT_USER
+
+PAYMENT_COLUMNS = f"{fields('payments', 'billing')}, payment_records({fields('payment_records', 'billing')})"
+STUDENT_COLUMNS = f"{fields('student_records', 'roster')}, user:{STUDENT_USER}({fields('users', 'ref')})"
+
+
+def _money(value):
+    return float(value) if value not in (None, '') else 0.0
+
+
+class InvoiceLine:
+    """One payment on a student's invoice"""
+    def __init__(self, payment, record=None):
+        self.payment_id = payment['id']
+        self.title = payment['title']
+        self.year = payment.get('year')
+        self.amount = _money(payment['amount'])
+        self.record_id = record['id'] if record else None
+        self.amount_paid = _money(record.get('amount_paid')) if record else 0.0
+        self.paid = bool(record and (record.get('paid') or self.amount_paid >= self.amount))
+
+    @property
+    def balance(self):
+        return 0.0 if self.paid else max(self.amount - self.amount_paid, 0.0)
+
+
+class StudentInvoice:
+    """Every payment of a student's class with paid / unpaid / balance totals"""
+    def __init__(self, student, lines):
+        self.student = student
+        self.lines = lines
+
+    @property
+    def total_due(self):
+        return sum(line.amount for line in self.lines)
+
+    @property
+    def total_paid(self):
+        return sum(line.amount_paid for line in self.lines)
+
+    @property
+    def balance(self):
+        return sum(line.balance for line in self.lines)
+
+    @property
+    def paid_count(self):
+        return sum(1 for line in self.lines if line.paid)
+
+    @property
+    def unpaid_count(self):
+        return len(self.lines) - self.paid_count
+
+
+class ClassBilling:
+    """Invoices of every student in one class plus class totals"""
+    def __init__(self, class_id, invoices):
+        self.class_id = class_id
+        self.invoices = invoices
+
+    @property
+    def total_due(self):
+        return sum(i.total_due for i in self.invoices)
+
+    @property
+    def total_paid(self):
+        return sum(i.total_paid for i in self.invoices)
+
+    @property
+    def balance(self):
+        return sum(i.balance for i in self.invoices)
+
+    @property
+    def students_owing(self):
+        return sum(1 for i in self.invoices if i.balance > 0)
+
+
+def _build_invoices(students, payments):
+    """Match payment_records (keyed by users.id) to students, grouped by class"""
+    by_class = {}
+    for payment in payments:
+        by_class.setdefault(payment['my_class_id'], []).append(payment)
+
+    records = {}
+    for payment in payments:
+        for record in payment.get('payment_records') or []:
+            records[(payment['id'], record['student_id'])] = record
+
+    classes = {}
+    for row in students:
+        student = SupabaseModel(row)
+        lines = [InvoiceLine(p, records.get((p['id'], student.user_id)))
+                 for p in by_class.get(student.my_class_id, [])]
+        classes.setdefault(student.my_class_id, []).append(StudentInvoice(student, lines))
+    return {class_id: ClassBilling(class_id, invoices) for class_id, invoices in classes.items()}
+
+
+def class_billing(supabase, class_id):
+    """ClassBilling for one class in two concurrent reads"""
+    reads = fetch_all(
+        students=supabase.table('student_records').select(STUDENT_COLUMNS)
+            .eq('my_class_id', class_id).eq('grad', False).eq('wd', False).order('id'),
+        payments=supabase.table('payments').select(PAYMENT_COLUMNS).eq('my_class_id', class_id).order('id')
+    )
+    billing = _build_invoices(reads['students'], reads['payments'])
+    return billing.get(class_id, ClassBilling(class_id, []))
+
+
+def school_billing(supabase):
+    """{class_id: ClassBilling} for every class with students, in two concurrent reads"""
+    reads = fetch_all(
+        students=supabase.table('student_records').select(STUDENT_COLUMNS).eq('grad', False).eq('wd', False).order('id'),
+        payments=supabase.table('payments').select(PAYMENT_COLUMNS).not_.is_('my_class_id', 'null').order('id')
+    )
+    return _build_invoices(reads['students'], reads['payments'])
+
+
+def student_invoice(supabase, student_record):
+    """StudentInvoice for one student_records row (dict with id, user_id, my_class_id)"""
+    if not student_record.get('my_class_id'):
+        return StudentInvoice(SupabaseModel(student_record), [])
+    res = supabase.table('payments').select(PAYMENT_COLUMNS).eq(
+        'my_class_id', student_record['my_class_id']
+    ).eq('payment_records.student_id', student_record['user_id']).order('id').execute()
+    billing = _build_invoices([student_record], res.data)
+    return billing[student_record['my_class_id']].invoices[0]
+
+
+def iter_class_invoices(supabase, class_id, payments=None):
+    """
+    StudentInvoice of every student in a class, read in keyset batches of
+    students with one payment_records read per batch. Pass the class
+    payments (billing columns) if already loaded.
+    """
+    if payments is None:
+        payments = supabase.table('payments').select(fields('payments', 'billing')).eq(
+            'my_class_id', class_id).order('id').execute().data
+    payment_ids = [p['id'] for p in payments]
+
+    for students in iter_batches(supabase, 'student_records', STUDENT_COLUMNS,
+                                 filters={'my_class_id': class_id, 'grad': False, 'wd': False}):
+        records = []
+        if payment_ids:
+            records = supabase.table('payment_records').select(
+                f"payment_id, {fields('payment_records', 'billing')}"
+            ).in_('payment_id', payment_ids).in_('student_id', [s['user_id'] for s in students]).execute().data
+        by_payment = {}
+        for record in records:
+            by_payment.setdefault(record['payment_id'], []).append(record)
+        batch = [dict(p, payment_records=by_payment.get(p['id'], [])) for p in payments]
+        billing = _build_invoices(students, batch)
+        if class_id in billing:
+            yield from billing[class_id].invoices
@@ -0,0 +1,135 @@
+"""
+Batched marks writer shared by the bulk grading entry points
+"""
+
+# Requires the unique index from sql/001_marks_upsert_key.sql
+MARKS_CONFLICT_KEY = 'exam_id,subject_id,student_id'
+
+T1_MAX = 25
+EXAMS_MAX = 75
+
+
+class MarkRowResult:
+    """Outcome of one student's row in a bulk marks write"""
+    def __init__(self, record_id, label, row=None, error=None):
+        self.record_id = record_id
+        self.label = label
+        self.row = row
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class MarksSaveReport:
+    """Per-row report of a bulk marks write"""
+    def __init__(self):
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+
+    @property
+    def saved(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    def summary(self, limit=5):
+        """Short human readable description of the failed rows"""
+        failed = self.failed
+        parts = [f'{r.label}: {r.error}' for r in failed[:limit]]
+        if len(failed) > limit:
+            parts.append(f'and {len(failed) - limit} more')
+        return '; '.join(parts)
+
+
+def _parse_score(raw, label, maximum):
+    """Parse a submitted score. Blank inputs count as zero like the original form."""
+    if raw is None or str(raw).strip() == '':
+        return 0, None
+    try:
+        value = int(str(raw).strip())
+    except ValueError:
+        return None, f'{label} "{raw}" is not a whole number'
+    if value < 0 or value > maximum:
+        return None, f'{label} must be between 0 and {maximum}'
+    return value, None
+
+
+def collect_form_scores(form, students):
+    """
+    Pull the t1_<id>/exams_<id> inputs out of a submitted form for every
+    student that has at least one of them on the form
+    """
+    return {
+        s['id']: (form.get(f"t1_{s['id']}"), form.get(f"exams_{s['id']}"))
+        for s in students
+        if f"t1_{s['id']}" in form or f"exams_{s['id']}" in form
+    }
+
+
+def build_mark_rows(exam_id, subject_id, class_id, students, scores, year=None):
+    """
+    Build every marks row for an (exam, subject, class) in one pass.
+    students are student_records dicts, scores maps record id -> (t1, exams).
+    Returns the report with a MarkRowResult per student.
+    """
+    report = MarksSaveReport()
+    for student in students:
+        label = student.get('adm_no') or f"Student #{student['id']}"
+        t1_raw, exams_raw = scores.get(student['id'], (None, None))
+
+        t1, error = _parse_score(t1_raw, 'Internal mark', T1_MAX)
+        if error is None:
+            exams, error = _parse_score(exams_raw, 'Theory mark', EXAMS_MAX)
+        if error is not None:
+            report.add(MarkRowResult(student['id'], label, error=error))
+            continue
+
+        row = {
+            'exam_id': exam_id,
+            'subject_id': subject_id,
+            'student_id': student['user_id'],
+            'my_class_id': class_id,
+            'section_id': student.get('section_id'),
+            'year': year,
+            't1': t1,
+            'exams': exams,
+            'total': t1 + exams
+        }
+        report.add(MarkRowResult(student['id'], label, row=row))
+    return report
+
+
+def upsert_mark_rows(supabase, report):
+    """
+    Write every valid row of the report as a single upsert keyed on
+    (exam_id, subject_id, student_id). If the batch is rejected, rows are
+    retried individually so the failure is pinned to the rows that caused it.
+    """
+    pending = [r for r in report.results if r.ok]
+    if not pending:
+        return report
+
+    try:
+        supabase.table('marks').upsert([r.row for r in pending], on_conflict=MARKS_CONFLICT_KEY).execute()
+        return report
+    except Exception as e:
+        print(f"Bulk marks upsert failed, retrying row by row: {e}")
+
+    for result in pending:
+        try:
+            supabase.table('marks').upsert(result.row, on_conflict=MARKS_CONFLICT_KEY).execute()
+        except Exception as e:
+            result.error = str(e)
+    return report
+
+
+def save_marks_batch(supabase, exam_id, subject_id, class_id, students, scores, year=None):
+    """Validate and persist marks for a whole class in one round trip"""
+    report = build_mark_rows(exam_id, subject_id, class_id, students, scores, year=year)
+    return upsert_mark_rows(supabase, report)
@@ -0,0 +1,363 @@
+"""
+Bulk payment posting for fee-collection days.
+
+Rows of (admission number, payment id, amount) come from a pasted list or
+an uploaded CSV. The students, payments and existing payment_records they
+refer to are prefetched in chunks and every row is checked in memory
+first (rows for the same fee accumulate, so part payments add up). The
+accepted rows are then posted by the post_payment_batch() RPC
+(sql/008_post_payment_batch.sql), which adds each amount to amount_paid
+under the record's row lock, so a single payment or another batch posted
+meanwhile is never overwritten. Each receipt carries the batch key plus
+its line number, so a line is posted once however often, or however
+concurrently, the batch is submitted.
+
+Until the function is installed each row is posted on its own: its
+receipt is inserted first to claim the line, then amount_paid is raised
+with a compare-and-set update that is retried if the record changed.
+
+Requires the unique index and receipts.idempotency_key column from
+sql/006_post_payment.sql.
+"""
+import csv
+import io
+from app.supabase_db import is_missing_function
+
+RECORDS_CONFLICT_KEY = 'payment_id,student_id'
+
+CSV_COLUMNS = ('adm_no', 'payment_id', 'amount')
+
+# Values per in_() filter when prefetching, to keep request URLs short
+# (ids and admission numbers); receipt keys are ~40 characters each, so
+# fewer of them fit under the 2-4 KB URL limit of common proxies
+LOOKUP_CHUNK_SIZE = 200
+KEY_CHUNK_SIZE = 50
+
+# Compare-and-set attempts per row when the RPC is not installed
+CAS_ATTEMPTS = 5
+
+
+class PaymentRowResult:
+    """Outcome of one line of a bulk posting"""
+    def __init__(self, line, adm_no, payment_id=None, amount=None, error=None):
+        self.line = line
+        self.adm_no = adm_no
+        self.payment_id = payment_id
+        self.amount = amount
+        self.error = error
+        self.title = None
+        self.record_key = None
+        self.receipt_id = None
+        # Amount as entered; None pays the remaining balance
+        self.requested = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BulkPostingReport:
+    """Per-row report of a bulk posting"""
+    def __init__(self, results=None):
+        self.results = results or []
+        self.replayed = False
+        self.settled = 0
+
+    @property
+    def posted(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def total_posted(self):
+        return sum(r.amount for r in self.posted)
+
+    def summary(self, limit=5):
+        """Short human readable description of the failed rows"""
+        failed = self.failed
+        parts = [f'line {r.line}: {r.error}' for r in failed[:limit]]
+        if len(failed) > limit:
+            parts.append(f'and {len(failed) - limit} more')
+        return '; '.join(parts)
+
+
+def _money(value):
+    return round(float(value), 2) if value not in (None, '') else 0.0
+
+
+def parse_payment_rows(text, max_rows=None):
+    """
+    Parse "adm_no, payment_id, amount" lines (a header line is optional,
+    the amount may be left blank to pay the remaining balance).
+    Returns a report holding one PaymentRowResult per non-blank line.
+    """
+    report = BulkPostingReport()
+    reader = csv.reader(io.StringIO(text))
+    for line, cells in enumerate(reader, start=1):
+        cells = [c.strip() for c in cells]
+        if not any(cells):
+            continue
+        if line == 1 and cells[0].lower() in ('adm_no', 'admission number', 'adm no'):
+            continue
+        if max_rows and len(report.results) >= max_rows:
+            report.results.append(PaymentRowResult(line, cells[0], error=f'More than {max_rows} rows; split the batch'))
+            break
+
+        cells += [''] * (len(CSV_COLUMNS) - len(cells))
+        adm_no, payment_id, amount = cells[:3]
+        result = PaymentRowResult(line, adm_no)
+        report.results.append(result)
+
+        if not adm_no:
+            result.error = 'Admission number is missing'
+            continue
+        try:
+            result.payment_id = int(payment_id)
+        except ValueError:
+            result.error = f'Payment id "{payment_id}" is not a number'
+            continue
+        if amount:
+            try:
+                result.amount = _money(amount)
+            except ValueError:
+                result.error = f'Amount "{amount}" is not a number'
+                continue
+            if result.amount <= 0:
+                result.error = 'Amount must be greater than zero'
+        result.requested = result.amount
+    return report
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _select_in(supabase, table, columns, column, values, chunk_size=LOOKUP_CHUNK_SIZE, **filters):
+    """Rows of table whose column is in values, one in_() query per chunk_size values"""
+    rows = []
+    for chunk in _chunks(sorted(values), chunk_size):
+        query = supabase.table(table).select(columns).in_(column, chunk)
+        for key, value in filters.items():
+            query = query.in_(key, value)
+        rows.extend(query.execute().data)
+    return rows
+
+
+def _line_key(batch_key, line):
+    return f'{batch_key}:{line}'
+
+
+def _prefetch(supabase, report, batch_key):
+    rows = [r for r in report.results if r.ok]
+    posted = {r['idempotency_key']: r['id'] for r in _select_in(
+        supabase, 'receipts', 'id, idempotency_key', 'idempotency_key',
+        {_line_key(batch_key, r.line) for r in rows}, chunk_size=KEY_CHUNK_SIZE)}
+    students = {s['adm_no']: s for s in _select_in(
+        supabase, 'student_records', 'id, user_id, adm_no, my_class_id', 'adm_no', {r.adm_no for r in rows})}
+    payments = {p['id']: p for p in _select_in(
+        supabase, 'payments', 'id, title, amount, year, my_class_id', 'id', {r.payment_id for r in rows})}
+
+    user_ids = {s['user_id'] for s in students.values()}
+    records = []
+    for payment_chunk in _chunks(sorted(payments), LOOKUP_CHUNK_SIZE):
+        records.extend(_select_in(supabase, 'payment_records', 'id, payment_id, student_id, year, amount_paid, paid',
+                                  'student_id', user_ids, payment_id=payment_chunk))
+    return students, payments, records, posted
+
+
+def _validate(report, students, payments, records):
+    """Check every row against the prefetched rows; the RPC checks balances again under lock"""
+    ledger = {(r['payment_id'], r['student_id']): dict(r) for r in records}
+
+    for result in report.results:
+        if not result.ok:
+            continue
+        student = students.get(result.adm_no)
+        payment = payments.get(result.payment_id)
+        if student is None:
+            result.error = f'No student with admission number {result.adm_no}'
+            continue
+        if payment is None:
+            result.error = f'No payment with id {result.payment_id}'
+            continue
+        if payment.get('my_class_id') and payment['my_class_id'] != student.get('my_class_id'):
+            result.error = f"{payment['title']} is not billed to this student's class"
+            continue
+
+        result.title = payment['title']
+        key = (payment['id'], student['user_id'])
+        record = ledger.setdefault(key, {'amount_paid': 0, 'paid': False})
+        due = _money(payment['amount'])
+        paid_so_far = _money(record.get('amount_paid'))
+        if record.get('paid') or paid_so_far >= due:
+            result.error = f"{payment['title']} is already paid"
+            continue
+        balance = round(due - paid_so_far, 2)
+        amount = balance if result.requested is None else result.requested
+        if amount > balance:
+            result.error = f'Amount {amount:.2f} is more than the balance {balance:.2f}'
+            continue
+
+        record['amount_paid'] = round(paid_so_far + amount, 2)
+        record['paid'] = record['amount_paid'] >= due
+        result.amount = amount
+        result.record_key = key
+
+
+def _is_unique_violation(error):
+    return getattr(error, 'code', None) == '23505'
+
+
+def _post_via_rpc(supabase, pending, batch_key):
+    res = supabase.rpc('post_payment_batch', {
+        'p_batch_key': batch_key,
+        'p_rows': [{
+            'line': r.line,
+            'payment_id': r.record_key[0],
+            'student_id': r.record_key[1],
+            'amount': r.requested
+        } for r in pending]
+    }).execute()
+    return {outcome['line']: outcome for outcome in res.data}
+
+
+def _load_record(supabase, payment, student_id):
+    res = supabase.table('payment_records').select('id, amount_paid, paid').eq(
+        'payment_id', payment['id']).eq('student_id', student_id).execute()
+    if res.data:
+        return res.data[0]
+    try:
+        res = supabase.table('payment_records').insert({
+            'payment_id': payment['id'], 'student_id': student_id,
+            'year': payment.get('year'), 'amount_paid': 0, 'paid': False
+        }).execute()
+        return res.data[0]
+    except Exception as e:
+        # Created by a concurrent post in the meantime
+        if not _is_unique_violation(e):
+            raise
+        return _load_record(supabase, payment, student_id)
+
+
+def _post_row_client_side(supabase, result, batch_key, payment):
+    """Post one row without the RPC; returns an outcome shaped like the RPC's"""
+    outcome = {'line': result.line}
+    due = _money(payment['amount'])
+    record = _load_record(supabase, payment, result.record_key[1])
+    receipt_id = None
+
+    for _ in range(CAS_ATTEMPTS):
+        paid_so_far = _money(record.get('amount_paid'))
+        amount = round(due - paid_so_far, 2) if result.requested is None else result.requested
+        if record.get('paid') or paid_so_far >= due or amount <= 0 or paid_so_far + amount > due:
+            outcome.update(status='already_paid' if record.get('paid') or paid_so_far >= due else 'over_balance',
+                           amount=round(due - paid_so_far, 2))
+            break
+
+        if receipt_id is None:
+            # Claim the line before touching the record; a second copy of the batch stops here
+            try:
+                res = supabase.table('receipts').insert({
+                    'pr_id': record['id'], 'amount_paid': amount,
+                    'year': payment.get('year'), 'idempotency_key': _line_key(batch_key, result.line)
+                }).execute()
+            except Exception as e:
+                if not _is_unique_violation(e):
+                    raise
+                return dict(outcome, status='duplicate')
+            receipt_id, receipt_amount = res.data[0]['id'], amount
+
+        new_total = round(paid_so_far + amount, 2)
+        update = supabase.table('payment_records').update({
+            'amount_paid': new_total, 'paid': new_total >= due
+        }).eq('id', record['id'])
+        if record.get('amount_paid') is None:
+            update = update.is_('amount_paid', 'null')
+        else:
+            update = update.eq('amount_paid', record['amount_paid'])
+        try:
+            updated = update.execute().data
+        except Exception:
+            supabase.table('receipts').delete().eq('id', receipt_id).execute()
+            raise
+        if updated:
+            if amount != receipt_amount:
+                supabase.table('receipts').update({'amount_paid': amount}).eq('id', receipt_id).execute()
+            return dict(outcome, status='posted', receipt_id=receipt_id, amount=amount, settled=new_total >= due)
+        # Another post changed the record since it was read
+        record = _load_record(supabase, payment, result.record_key[1])
+    else:
+        outcome.update(status='busy')
+
+    if receipt_id is not None:
+        # Release the line: the receipt was never matched by a payment
+        supabase.table('receipts').delete().eq('id', receipt_id).execute()
+    return outcome
+
+
+def _apply(result, outcome):
+    status = outcome.get('status')
+    if status == 'posted':
+        result.receipt_id = outcome['receipt_id']
+        result.amount = _money(outcome['amount'])
+    elif status == 'duplicate':
+        receipt = f" (receipt #{outcome['receipt_id']})" if outcome.get('receipt_id') else ''
+        result.error = f'This line has already been posted{receipt}'
+    elif status == 'already_paid':
+        result.error = f'{result.title} is already paid'
+    elif status == 'over_balance':
+        result.error = f"Amount {result.amount:.2f} is more than the balance {_money(outcome.get('amount')):.2f}"
+    elif status == 'missing_payment':
+        result.error = f'No payment with id {result.payment_id}'
+    elif status == 'busy':
+        result.error = 'The payment record kept changing; post this line again'
+    else:
+        result.error = outcome.get('error') or 'Not posted'
+
+
+def post_payment_rows(supabase, report, batch_key):
+    """
+    Check and post every parsed row of the report. Rows that fail the
+    checks are reported and skipped; each accepted row is posted or
+    rejected on its own, with the reason on the row.
+    """
+    if not any(r.ok for r in report.results):
+        return report
+
+    students, payments, records, posted = _prefetch(supabase, report, batch_key)
+    replays = [r for r in report.results if r.ok and _line_key(batch_key, r.line) in posted]
+    for result in replays:
+        result.error = f'This line has already been posted (receipt #{posted[_line_key(batch_key, result.line)]})'
+
+    _validate(report, students, payments, records)
+    pending = [r for r in report.results if r.ok]
+    if not pending:
+        report.replayed = bool(replays)
+        return report
+
+    try:
+        outcomes = _post_via_rpc(supabase, pending, batch_key)
+    except Exception as e:
+        if not is_missing_function(e):
+            for result in pending:
+                result.error = getattr(e, 'message', None) or str(e)
+            return report
+        outcomes = {}
+        for result in pending:
+            try:
+                outcomes[result.line] = _post_row_client_side(supabase, result, batch_key,
+                                                              payments[result.payment_id])
+            except Exception as row_error:
+                outcomes[result.line] = {'line': result.line, 'error': str(row_error)}
+
+    for result in pending:
+        _apply(result, outcomes.get(result.line, {}))
+    # Nothing new was written and at least one line had been posted before
+    report.replayed = not report.posted and (bool(replays) or any(
+        o.get('status') == 'duplicate' for o in outcomes.values()))
+    report.settled = sum(1 for outcome in outcomes.values() if outcome.get('settled'))
+    return report
@@ -0,0 +1,100 @@
+"""
+Class-wide password resets and the credential sheet handed to the class.
+
+A reset is three round trips however large the class: the class, its
+roster (with each student's login), and one set_user_passwords() call
+carrying every new hash (hashed in parallel by app.utils.passwords).
+Resets run as background jobs (app.utils.jobs). The new passwords exist
+only in the credential sheet kept on the job, as CSV or PDF (built with
+reportlab), which is deleted when the admin downloads it.
+"""
+import io
+import secrets
+from datetime import datetime
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from app.supabase_db import get_db
+from app.utils.exports import EXPORT_FORMATS, iter_csv, safe_filename
+from app.utils.jobs import job, JobError
+from app.utils.passwords import set_passwords
+from app.utils.projections import fields, STUDENT_USER
+
+# No 0/O, 1/l/I: the sheet is read off paper
+PASSWORD_ALPHABET = 'abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+PASSWORD_LENGTH = 8
+
+SHEET_HEADER = ['Adm No', 'Name', 'Username', 'Password']
+ROSTER_COLUMNS = f"id, adm_no, user:{STUDENT_USER}({fields('users', 'login')})"
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def reset_class_passwords(supabase, class_id, mode='random'):
+    """
+    Give every current student of a class a new password: a random one,
+    or their admission number (mode='adm_no') like the single reset.
+    Returns the credential rows [adm_no, name, username, password].
+    """
+    res = supabase.table('student_records').select(ROSTER_COLUMNS).eq(
+        'my_class_id', class_id).eq('grad', False).eq('wd', False).order('adm_no').execute()
+
+    credentials, passwords = [], {}
+    for student in res.data:
+        user = student.get('user')
+        if not user:
+            continue
+        password = student['adm_no'] if mode == 'adm_no' else generate_password()
+        passwords[user['id']] = password
+        credentials.append([student['adm_no'], user['name'], user.get('username'), password])
+
+    set_passwords(supabase, passwords)
+    return credentials
+
+
+def _pdf(title, credentials):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, title=title)
+    styles = getSampleStyleSheet()
+    table = Table([SHEET_HEADER] + [[str(v or '') for v in row] for row in credentials], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (3, 1), (3, -1), 'Courier-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    doc.build([
+        Paragraph(escape(title), styles['Title']),
+        Paragraph(f"Issued {datetime.now().strftime('%d %b %Y %H:%M')}. Change your password after first login.",
+                  styles['Normal']),
+        Spacer(1, 12),
+        table,
+    ])
+    return buffer.getvalue()
+
+
+def credential_sheet(fmt, class_name, credentials):
+    """(filename, mimetype, bytes) of the credential sheet as CSV or PDF"""
+    filename = safe_filename(f'{class_name}_credentials')
+    if fmt == 'csv':
+        return f'{filename}.csv', EXPORT_FORMATS['csv'], b''.join(iter_csv(SHEET_HEADER, credentials))
+    return f'{filename}.pdf', 'application/pdf', _pdf(f'{class_name} - Login Credentials', credentials)
+
+
+@job('reset_class_passwords')
+def reset_class_passwords_job(ctx, class_id, class_name, fmt='pdf', mode='random'):
+    """Background class reset; the sheet is kept on the job until it is downloaded"""
+    ctx.progress(0, message='Setting new passwords')
+    credentials = reset_class_passwords(get_db(), class_id, mode=mode)
+    if not credentials:
+        raise JobError('This class has no students to reset.')
+    ctx.progress(len(credentials), len(credentials), 'Writing the credential sheet')
+    ctx.attach(*credential_sheet(fmt, class_name, credentials))
+    return {'reset': len(credentials),
+            'message': f'{len(credentials)} passwords reset. Download the credential sheet now; it is deleted once downloaded.'}
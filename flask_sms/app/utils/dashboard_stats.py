@@ -0,0 +1,71 @@
+"""
+Admin dashboard counters.
+
+All counts come from the dashboard_stats() RPC (sql/002_dashboard_stats.sql)
+in one round trip and are cached for DASHBOARD_STATS_TTL seconds. Routes that
+add or remove users adjust the cached counters in place instead of dropping
+them, so the dashboard stays current without recounting.
+"""
+from flask import current_app
+from app.utils.cache import TTLCache
+
+_cache = TTLCache(maxsize=1)
+_KEY = 'dashboard'
+
+ROLE_STATS = {
+    'student': 'total_students',
+    'teacher': 'total_teachers',
+    'parent': 'total_parents',
+}
+
+
+def _count(supabase, table, **filters):
+    """Exact row count without pulling any row payload"""
+    query = supabase.table(table).select('id', count='exact', head=True)
+    for column, value in filters.items():
+        query = query.eq(column, value)
+    return query.execute().count
+
+
+def _fetch_stats(supabase):
+    try:
+        return dict(supabase.rpc('dashboard_stats').execute().data)
+    except Exception as e:
+        # Function not installed yet: fall back to head-only count queries
+        print(f"dashboard_stats RPC unavailable, counting per table: {e}")
+
+    stats = {key: _count(supabase, 'users', user_type=role) for role, key in ROLE_STATS.items()}
+    stats['total_classes'] = _count(supabase, 'my_classes')
+    stats['total_sections'] = _count(supabase, 'sections')
+    stats['outstanding_payments'] = None
+    return stats
+
+
+def get_dashboard_stats(supabase):
+    """Cached dashboard counters as a dict"""
+    stats = _cache.get(_KEY)
+    if stats is None:
+        stats = _fetch_stats(supabase)
+        _cache.set(_KEY, stats, ttl=current_app.config.get('DASHBOARD_STATS_TTL', 60))
+    return stats
+
+
+def adjust_stat(key, delta):
+    """Apply a +/- change to a cached counter, if the counters are cached"""
+    stats = _cache.get(_KEY)
+    if stats is not None and stats.get(key) is not None:
+        stats[key] = max(0, stats[key] + delta)
+
+
+def user_added(user_type):
+    if user_type in ROLE_STATS:
+        adjust_stat(ROLE_STATS[user_type], 1)
+
+
+def user_removed(user_type):
+    if user_type in ROLE_STATS:
+        adjust_stat(ROLE_STATS[user_type], -1)
+
+
+def invalidate_dashboard_stats():
+    _cache.clear()
@@ -0,0 +1,211 @@
+"""
+Streaming CSV / XLSX / ZIP downloads.
+
+export_response() turns a header and an iterable of rows into a Flask
+response that is written while the rows are still being fetched, so the
+download starts at once and only one batch of rows (see
+pagination.iter_batches) is in memory however long the export is.
+XLSX files are a zip of XML parts; the worksheet is compressed into the
+response as it is generated, without any spreadsheet library.
+
+CSV text cells that a spreadsheet would read as a formula are prefixed
+with a quote, so a name such as "=HYPERLINK(...)" stays plain text.
+"""
+import csv
+import io
+import re
+import unicodedata
+import zipfile
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+from flask import Response, abort, stream_with_context
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Rows written between flushes of the response
+FLUSH_ROWS = 200
+
+_CONTROL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# First characters that make Excel / LibreOffice treat a CSV cell as a formula
+_FORMULA_START = ('=', '+', '-', '@', '\t', '\r')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+class _Sink:
+    """Write-only file object whose contents are handed out in chunks"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+def _csv_text(value):
+    text = _text(value)
+    if isinstance(value, str) and text.startswith(_FORMULA_START):
+        return "'" + text
+    return text
+
+
+def iter_csv(header, rows):
+    """CSV bytes for a header and rows, FLUSH_ROWS rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens UTF-8 names correctly
+    buffer.write('\ufeff')
+    writer.writerow([_csv_text(v) for v in header])
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_csv_text(v) for v in row])
+        if count % FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_CONTROL_CHARS.sub('', _text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(number, values):
+    return f'<row r="{number}">' + ''.join(_cell(v) for v in values) + '</row>'
+
+
+def _sheet_name(name):
+    name = re.sub(r'[\[\]:*?/\\]', ' ', name or 'Sheet1').strip()[:31]
+    return escape(name or 'Sheet1', {'"': '&quot;'})
+
+
+def iter_xlsx(header, rows, sheet_name='Sheet1'):
+    """XLSX bytes for a header and rows, compressed and flushed every FLUSH_ROWS rows"""
+    sink = _Sink()
+    # The sink cannot seek, so zipfile writes sizes after each part instead of before it
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', _ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', _WORKBOOK.format(name=_sheet_name(sheet_name)))
+        workbook.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((_SHEET_START + _row(1, header)).encode('utf-8'))
+            for number, row in enumerate(rows, start=2):
+                sheet.write(_row(number, row).encode('utf-8'))
+                if number % FLUSH_ROWS == 0:
+                    yield sink.drain()
+            sheet.write(_SHEET_END.encode('utf-8'))
+        yield sink.drain()
+    yield sink.drain()
+
+
+def iter_zip(files):
+    """
+    ZIP bytes for (name, data) pairs, one entry flushed at a time.
+    Entries are stored, not deflated: they are meant for PDFs, which are
+    compressed already.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def safe_filename(name):
+    """Download file name without spaces or path characters"""
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'export'
+
+
+def content_disposition(filename):
+    """
+    Content-Disposition value for a download: an ASCII filename for old
+    clients plus the UTF-8 name (RFC 6266) for everything else
+    """
+    stem, dot, extension = filename.rpartition('.')
+    if not dot:
+        stem, extension = filename, ''
+    fallback = unicodedata.normalize('NFKD', stem).encode('ascii', 'ignore').decode('ascii')
+    fallback = (re.sub(r'[^A-Za-z0-9.-]+', '_', fallback).strip('_.') or 'download') + dot + extension
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def export_response(fmt, filename, header, rows, sheet_name=None):
+    """
+    Streamed download of rows in fmt ('csv' or 'xlsx'); 404 for any other
+    format. rows may be a generator that is still reading from Supabase.
+    """
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    filename = safe_filename(filename)
+    if fmt == 'csv':
+        body = iter_csv(header, rows)
+    else:
+        body = iter_xlsx(header, rows, sheet_name or filename)
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': content_disposition(f'{filename}.{fmt}')}
+    )
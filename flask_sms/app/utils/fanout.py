@@ -0,0 +1,70 @@
+"""
+Concurrent fan-out for independent Supabase reads.
+
+A route declares the reads it needs and fetch_all() runs them on a shared
+thread pool, so a page waits for the slowest round trip instead of the sum
+of all of them. Each read runs in a copy of the caller's context, so
+current_app, g and the request stay available (get_lookup() works).
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+# Set inside pool threads; nested fetch_all() calls run inline so a full pool cannot deadlock
+_in_fanout = contextvars.ContextVar('in_fanout', default=False)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # A pool inherited across fork has no live threads; build a new one
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                workers = current_app.config.get('FANOUT_WORKERS', 8)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sms-fanout')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _run_inline(read):
+    if callable(read):
+        return read()
+    return read.execute().data
+
+
+def _run(read):
+    _in_fanout.set(True)
+    return _run_inline(read)
+
+
+def fetch_all(**reads):
+    """
+    Run independent reads concurrently and return {name: result}.
+    Each value is either a query builder (its .execute().data is returned)
+    or a zero-argument callable (its return value). If any read fails, the
+    first error is raised once every read has finished.
+    """
+    if len(reads) < 2 or _in_fanout.get() or current_app.config.get('FANOUT_WORKERS', 8) < 2:
+        return {name: _run_inline(read) for name, read in reads.items()}
+
+    executor = _get_executor()
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, _run, read)
+        for name, read in reads.items()
+    }
+
+    results, error = {}, None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            error = error or e
+    if error:
+        raise error
+    return results
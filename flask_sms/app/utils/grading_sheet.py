@@ -0,0 +1,36 @@
+"""
+Grading sheet data for marks.manage.
+
+The class roster comes back with each student's current mark for the
+(exam, subject) already embedded (student_records -> users -> marks,
+narrowed by embedded filters), so a sheet is a single read however large
+the class is. Very large classes are paged by record id.
+"""
+from flask import current_app
+from app.utils.pagination import paginate
+from app.utils.projections import fields, STUDENT_USER
+
+SHEET_COLUMNS = (
+    f"{fields('student_records', 'roster')}, "
+    f"user:{STUDENT_USER}({fields('users', 'ref')}, marks({fields('marks', 'sheet')}))"
+)
+
+
+def load_grading_sheet(supabase, exam_id, subject_id, class_id):
+    """
+    One page of the class roster with `.mark` set on every student to
+    the existing mark (t1, exams, total) for this exam and subject, or None.
+    """
+    sheet = paginate(
+        supabase, 'student_records', SHEET_COLUMNS,
+        filters={'my_class_id': class_id},
+        embedded_filters={'user.marks.exam_id': exam_id, 'user.marks.subject_id': subject_id},
+        per_page=current_app.config.get('GRADING_SHEET_PAGE_SIZE', 100),
+        count=False
+    )
+    # Keep the models: .mark is set on them
+    sheet.items = list(sheet.items)
+    for student in sheet.items:
+        marks = student.user.get('marks') if student.user else None
+        student.mark = marks[0] if marks else None
+    return sheet
@@ -0,0 +1,363 @@
+"""
+Background jobs for long admin operations.
+
+Routes enqueue a job and redirect to its status page instead of doing the
+work inside the request. Jobs are rows of a local SQLite database
+(JOB_DB_PATH), so every gunicorn worker on the host sees the same queue
+and a job survives a restart. Each worker process runs JOB_WORKERS
+threads that claim queued jobs one at a time; with JOB_WORKERS = 0 a job
+runs inline when it is enqueued.
+
+A handler is a function registered with @job(name). It receives a
+JobContext for reporting progress and attaching a file (such as a
+credential sheet), plus the keyword arguments given to enqueue(). It
+raises JobError for failures retrying cannot fix; any other exception is
+retried up to JOB_MAX_ATTEMPTS times with exponential backoff. While a
+handler runs, a heartbeat thread touches the job every third of
+JOB_STALE_AFTER; a job that has not been touched for JOB_STALE_AFTER
+seconds lost its worker and is picked up again. Attached files (which
+may hold passwords) are deleted when first downloaded or JOB_FILE_TTL
+seconds after the job finished, whichever comes first.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from flask import current_app
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    message TEXT,
+    error TEXT,
+    result TEXT,
+    file_name TEXT,
+    file_type TEXT,
+    file_data BLOB,
+    user_id TEXT,
+    return_url TEXT,
+    dedupe_key TEXT,
+    created_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, run_after, created_at);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status);
+'''
+
+_TIMES = ('created_at', 'started_at', 'updated_at', 'finished_at')
+
+_handlers = {}
+
+
+def _decode(row):
+    data = dict(row)
+    for key in _TIMES:
+        if data.get(key) is not None:
+            data[key] = datetime.fromtimestamp(data[key])
+    return data
+
+
+class JobError(Exception):
+    """A job failure that retrying will not fix; its message is shown to the user"""
+    pass
+
+
+def job(name):
+    """Register a handler for jobs enqueued under name"""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+class JobContext:
+    """
+    Handed to a running handler for progress reports and file results.
+    done is the progress the previous attempt reached, so a retried
+    handler can skip work that already succeeded.
+    """
+    def __init__(self, queue, job_id, attempt, done=0):
+        self.queue = queue
+        self.job_id = job_id
+        self.attempt = attempt
+        self.done = done
+
+    def progress(self, done, total=None, message=None):
+        """Record how far the job has got, e.g. progress(200, 1000); total and message are kept if omitted"""
+        self.done = done
+        values = {'progress': done}
+        if total is not None:
+            values['total'] = total
+        if message is not None:
+            values['message'] = message
+        self.queue._update(self.job_id, **values)
+
+    def attach(self, filename, mimetype, data):
+        """Keep a file for the user to download from the status page"""
+        self.queue._update(self.job_id, file_name=filename, file_type=mimetype, file_data=data)
+
+
+class JobQueue:
+    """SQLite-backed queue served by a pool of threads in each worker process"""
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._app = None
+
+    # -- storage -----------------------------------------------------------
+
+    @staticmethod
+    def _connect(path):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _db(self):
+        path = current_app.config.get('JOB_DB_PATH')
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'path', None) != path:
+            conn = self._connect(path)
+            self._local.conn, self._local.path = conn, path
+        return conn
+
+    def _update(self, job_id, **values):
+        values['updated_at'] = time.time()
+        columns = ', '.join(f'{column} = ?' for column in values)
+        self._db().execute(f'UPDATE jobs SET {columns} WHERE id = ?', list(values.values()) + [job_id])
+
+    def _claim(self, job_id=None):
+        """
+        Mark the oldest runnable job as running and return it, or None.
+        With job_id only that job is claimed, even if its retry is not due yet.
+        """
+        config = current_app.config
+        now = time.time()
+        db = self._db()
+        # Jobs whose worker stopped reporting go back in the queue
+        stale = now - config.get('JOB_STALE_AFTER', 600)
+        db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "error = 'The worker running this job stopped', updated_at = ?, "
+            "finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END "
+            "WHERE status = 'running' AND updated_at < ?", (now, now, stale)
+        )
+        if job_id is not None:
+            row = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued' RETURNING *", (now, now, job_id)
+            ).fetchone()
+            return dict(row) if row else None
+        row = db.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? "
+            "ORDER BY created_at LIMIT 1) RETURNING *", (now, now, now)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _purge(self):
+        """Delete the files of jobs that finished more than JOB_FILE_TTL seconds ago"""
+        ttl = current_app.config.get('JOB_FILE_TTL', 600)
+        self._db().execute('UPDATE jobs SET file_data = NULL WHERE file_data IS NOT NULL AND finished_at < ?',
+                           (time.time() - ttl,))
+
+    # -- running -----------------------------------------------------------
+
+    def _heartbeat(self, path, job_id, interval, stop):
+        """Touch a running job until stop is set, so a long handler is not taken for a dead one"""
+        conn = None
+        try:
+            conn = self._connect(path)
+            while not stop.wait(interval):
+                conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                             (time.time(), job_id))
+        except Exception as e:
+            print(f"Job {job_id} heartbeat error: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _run(self, row):
+        config = current_app.config
+        ctx = JobContext(self, row['id'], row['attempts'], row['progress'])
+        handler = _handlers.get(row['name'])
+        stop = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, name=f"job-heartbeat-{row['id']}", daemon=True,
+            args=(config.get('JOB_DB_PATH'), row['id'], max(1, config.get('JOB_STALE_AFTER', 600) / 3), stop)
+        ).start()
+        try:
+            if handler is None:
+                raise JobError(f"Unknown job type {row['name']}")
+            result = handler(ctx, **json.loads(row['params'])) or {}
+        except JobError as e:
+            self._update(row['id'], status='failed', error=str(e), finished_at=time.time())
+        except Exception as e:
+            print(f"Job {row['id']} ({row['name']}) attempt {row['attempts']} failed: {e}")
+            if row['attempts'] < row['max_attempts']:
+                delay = config.get('JOB_RETRY_DELAY', 5) * 2 ** (row['attempts'] - 1)
+                self._update(row['id'], status='queued', error=str(e), run_after=time.time() + delay)
+            else:
+                self._update(row['id'], status='failed', error=str(e), finished_at=time.time())
+        else:
+            self._update(row['id'], status='done', error=None, result=json.dumps(result, default=str),
+                         message=result.get('message'), finished_at=time.time())
+        finally:
+            stop.set()
+
+    def _work(self):
+        interval = self._app.config.get('JOB_POLL_INTERVAL', 1.0)
+        while True:
+            try:
+                with self._app.app_context():
+                    # Also between jobs, so files expire while every worker is busy
+                    self._purge()
+                    row = self._claim()
+                    if row is not None:
+                        self._run(row)
+                        continue
+            except Exception as e:
+                print(f"Job worker error: {e}")
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def _ensure_workers(self):
+        # Threads do not survive fork; each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._app = current_app._get_current_object()
+            for number in range(self._app.config.get('JOB_WORKERS', 2)):
+                threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True).start()
+            self._pid = os.getpid()
+
+    # -- public ------------------------------------------------------------
+
+    def enqueue(self, name, user_id=None, return_url=None, dedupe_key=None, **params):
+        """
+        Queue a job and return its id. With a dedupe_key, a job with the
+        same key that has not started yet is reused instead. Inline
+        (JOB_WORKERS = 0) only this job runs, retries included.
+        """
+        config = current_app.config
+        db = self._db()
+        # The dedupe check and the insert share the write lock, so two
+        # requests cannot both queue a job for the same key
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = None
+            if dedupe_key:
+                row = db.execute("SELECT id FROM jobs WHERE dedupe_key = ? AND status = 'queued'",
+                                 (dedupe_key,)).fetchone()
+            if row:
+                job_id = row['id']
+            else:
+                now = time.time()
+                job_id = uuid.uuid4().hex
+                db.execute(
+                    'INSERT INTO jobs (id, name, params, max_attempts, user_id, return_url, dedupe_key, '
+                    'created_at, run_after, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, name, json.dumps(params, default=str), config.get('JOB_MAX_ATTEMPTS', 3),
+                     str(user_id) if user_id is not None else None, return_url, dedupe_key, now, now, now)
+                )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+        if config.get('JOB_WORKERS', 2) <= 0:
+            row = self._claim(job_id)
+            while row is not None:
+                self._run(row)
+                row = self._claim(job_id)
+        else:
+            self._ensure_workers()
+            self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """The job as a dict (without its file), or None"""
+        if current_app.config.get('JOB_WORKERS', 2) > 0:
+            self._ensure_workers()
+        self._purge()
+        row = self._db().execute(
+            'SELECT *, file_data IS NOT NULL AS has_file FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data = _decode(row)
+        data.pop('file_data')
+        data.pop('run_after')
+        data['params'] = json.loads(data['params'])
+        data['result'] = json.loads(data['result']) if data['result'] else None
+        return data
+
+    def recent(self, limit=50, user_id=None):
+        """Newest jobs first, optionally only those of one user"""
+        query = ('SELECT id, name, status, attempts, progress, total, message, error, user_id, '
+                 'created_at, finished_at FROM jobs')
+        params = []
+        if user_id is not None:
+            query += ' WHERE user_id = ?'
+            params.append(str(user_id))
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        return [_decode(row) for row in self._db().execute(query, params)]
+
+    def take_file(self, job_id):
+        """(filename, mimetype, data) of a job's file, deleted once taken; None if there is none"""
+        db = self._db()
+        # Read and delete under the write lock, so two downloads cannot both get the file
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._purge()
+            row = db.execute('SELECT file_name, file_type, file_data FROM jobs '
+                             'WHERE id = ? AND file_data IS NOT NULL', (job_id,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE jobs SET file_data = NULL WHERE id = ?', (job_id,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row['file_name'], row['file_type'], row['file_data']
+
+
+queue = JobQueue()
+
+
+def enqueue(name, user_id=None, return_url=None, dedupe_key=None, **params):
+    return queue.enqueue(name, user_id=user_id, return_url=return_url, dedupe_key=dedupe_key, **params)
+
+
+def get_job(job_id):
+    return queue.get(job_id)
+
+
+def recent_jobs(limit=50, user_id=None):
+    return queue.recent(limit=limit, user_id=user_id)
+
+
+def take_job_file(job_id):
+    return queue.take_file(job_id)
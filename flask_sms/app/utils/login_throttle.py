@@ -0,0 +1,60 @@
+"""
+Failed-login throttling.
+
+Failed attempts are counted per username/email and per client address in
+an in-process cache. Once either count reaches its limit within
+LOGIN_FAILURE_WINDOW seconds, further attempts are refused for
+LOGIN_LOCKOUT seconds without querying the users table or checking a
+hash, so a password-guessing run costs the database nothing. Counts are
+kept per gunicorn worker, which makes the effective limit at most
+workers x the configured one.
+
+The per-address count only runs when LOGIN_IP_MAX_FAILURES is set; the
+address is request.remote_addr, which is only the real client once
+PROXY_FIX_HOPS matches the proxies in front of the app.
+"""
+import threading
+import time
+from flask import current_app
+from app.utils.cache import TTLCache
+
+_failures = TTLCache(maxsize=10000)
+_lock = threading.Lock()
+
+
+def _keys(identity, remote_addr):
+    keys = [(f'identity:{(identity or "").strip().lower()}', 'LOGIN_MAX_FAILURES', 5)]
+    if remote_addr and current_app.config.get('LOGIN_IP_MAX_FAILURES', 0) > 0:
+        keys.append((f'addr:{remote_addr}', 'LOGIN_IP_MAX_FAILURES', 0))
+    return keys
+
+
+def retry_after(identity, remote_addr):
+    """Seconds until identity / remote_addr may try again, 0 if not locked out"""
+    now = time.monotonic()
+    wait = 0
+    for key, setting, default in _keys(identity, remote_addr):
+        entry = _failures.get(key)
+        if entry and entry[0] >= current_app.config.get(setting, default):
+            wait = max(wait, entry[1] - now)
+    return int(wait + 0.999)
+
+
+def record_failure(identity, remote_addr):
+    """Count a failed attempt; starts the lockout once a limit is reached"""
+    config = current_app.config
+    window = config.get('LOGIN_FAILURE_WINDOW', 900)
+    lockout = config.get('LOGIN_LOCKOUT', 900)
+    now = time.monotonic()
+    with _lock:
+        for key, setting, default in _keys(identity, remote_addr):
+            count, expires = _failures.get(key) or (0, now + window)
+            count += 1
+            if count >= config.get(setting, default):
+                expires = max(expires, now + lockout)
+            _failures.set(key, (count, expires), ttl=expires - now)
+
+
+def clear_failures(identity):
+    """Forget the failed attempts of an identity after it logged in"""
+    _failures.delete(_keys(identity, None)[0][0])
@@ -0,0 +1,59 @@
+"""
+Cached reference data (classes, sections, blood groups, teacher/parent lists...)
+used to populate form choices.
+
+Lookups are cached per request on `g` and process-wide with a TTL
+(REFERENCE_CACHE_TTL). Routes that write to one of these tables call
+invalidate_lookups() so the next form render sees the change.
+"""
+from flask import g, current_app
+from app.supabase_db import get_db
+from app.utils.cache import TTLCache
+
+_cache = TTLCache(maxsize=128)
+
+
+def _lookup_key(table, columns, filters):
+    return (table, columns, tuple(sorted(filters.items())))
+
+
+def get_lookup(table, columns='id, name', **filters):
+    """
+    Return the rows of a reference table as a list of dicts.
+    Keyword arguments are equality filters, e.g. get_lookup('users', user_type='teacher').
+    The returned list is shared, so treat it as read-only.
+    """
+    key = _lookup_key(table, columns, filters)
+
+    request_cache = g.setdefault('_lookups', {})
+    if key in request_cache:
+        return request_cache[key]
+
+    rows = _cache.get(key)
+    if rows is None:
+        query = get_db().table(table).select(columns)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        rows = query.execute().data or []
+        _cache.set(key, rows, ttl=current_app.config.get('REFERENCE_CACHE_TTL', 300))
+
+    request_cache[key] = rows
+    return rows
+
+
+def lookup_choices(table, placeholder=None, **filters):
+    """(id, name) choices for a SelectField, optionally prefixed with a (0, placeholder) entry"""
+    choices = [(row['id'], row['name']) for row in get_lookup(table, **filters)]
+    if placeholder:
+        choices.insert(0, (0, placeholder))
+    return choices
+
+
+def invalidate_lookups(*tables):
+    """Forget cached rows for the given tables in this worker and request"""
+    tables = set(tables)
+    _cache.delete_where(lambda key: key[0] in tables)
+    request_cache = g.get('_lookups')
+    if request_cache:
+        for key in [k for k in request_cache if k[0] in tables]:
+            del request_cache[key]
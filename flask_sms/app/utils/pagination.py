@@ -0,0 +1,235 @@
+"""
+Shared pagination for listing pages.
+
+Next/Previous links use keyset (cursor) pagination on (id) or (name, id):
+the page after a cursor is fetched with `WHERE key > cursor ORDER BY key
+LIMIT n`, which costs the same on page 500 as on page 1. Numbered page
+links still jump by offset. One extra row is fetched to decide whether a
+next page exists, so the total is only needed for the page count; it is
+requested head-only, in PAGINATION_COUNT mode (exact / planned /
+estimated) and cached for PAGINATION_COUNT_TTL seconds.
+"""
+import base64
+import json
+from flask import request, current_app
+from app.supabase_db import SupabaseModel
+from app.utils.cache import TTLCache
+
+COUNT_MODES = ('exact', 'planned', 'estimated')
+
+_counts = TTLCache(maxsize=512)
+
+
+class Paginator:
+    """
+    One page of rows with the attributes the pagination templates use
+    (items, page, pages, has_prev/has_next, prev_num/next_num, iter_pages)
+    plus prev_args/next_args for building cursor links.
+    """
+    def __init__(self, items, page, per_page, total=None, has_next=None,
+                 prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_prev = page > 1
+        self.has_next = has_next if has_next is not None else (total is not None and page * per_page < total)
+        self.prev_num = page - 1
+        self.next_num = page + 1
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+        pages = (total + per_page - 1) // per_page if total else 0
+        # Cached or estimated totals can lag behind the table
+        self.pages = max(pages, page + (1 if self.has_next else 0))
+        self.total = total if total is not None else self.pages * per_page
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def prev_args(self):
+        """url_for() arguments for the Previous link"""
+        if self.prev_cursor and self.prev_num > 1:
+            return {'page': self.prev_num, 'before': self.prev_cursor}
+        return {'page': self.prev_num}
+
+    @property
+    def next_args(self):
+        """url_for() arguments for the Next link"""
+        if self.next_cursor:
+            return {'page': self.next_num, 'after': self.next_cursor}
+        return {'page': self.next_num}
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
+        last = 0
+        for num in range(1, self.pages + 1):
+            if num <= left_edge or \
+               (num > self.page - left_current - 1 and num < self.page + right_current) or \
+               num > self.pages - right_edge:
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+
+def encode_cursor(row, keyset):
+    """Opaque cursor for the keyset values of a row"""
+    values = [row[column] for column in keyset]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keyset):
+    """Keyset values from a cursor, or None if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(keyset):
+        return None
+    return values
+
+
+def quote_literal(value):
+    """Quote a value for a PostgREST or=() filter"""
+    if isinstance(value, (int, float)):
+        return str(value)
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _seek(query, keyset, values, forward):
+    """Restrict query to rows after (forward=True) or before the keyset values"""
+    op = 'gt' if forward else 'lt'
+    if len(keyset) == 1:
+        return getattr(query, op)(keyset[0], values[0])
+    (col, tie), (value, tie_value) = keyset, values
+    return query.or_(
+        f'{col}.{op}.{quote_literal(value)},'
+        f'and({col}.eq.{quote_literal(value)},{tie}.{op}.{quote_literal(tie_value)})'
+    )
+
+
+def _count_key(table, filters):
+    return (table, tuple(sorted(filters.items())))
+
+
+def get_total(supabase, table, filters, mode=None):
+    """Row count for a filtered table, cached; None if the count failed"""
+    key = _count_key(table, filters)
+    total = _counts.get(key)
+    if total is not None:
+        return total
+
+    mode = mode or current_app.config.get('PAGINATION_COUNT', 'exact')
+    if mode not in COUNT_MODES:
+        mode = 'exact'
+    try:
+        query = supabase.table(table).select('id', count=mode, head=True)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        total = query.execute().count
+    except Exception as e:
+        print(f"Count failed for {table}: {e}")
+        return None
+
+    if total is not None:
+        _counts.set(key, total, ttl=current_app.config.get('PAGINATION_COUNT_TTL', 60))
+    return total
+
+
+def invalidate_counts(*tables):
+    """Forget cached totals after rows are added to or removed from these tables"""
+    tables = set(tables)
+    _counts.delete_where(lambda key: key[0] in tables)
+
+
+def paginate(supabase, table, columns='*', filters=None, keyset=('id',), desc=False,
+             per_page=None, count=None, embedded_filters=None, timestamps=()):
+    """
+    Fetch the page of `table` selected by the request's page / after /
+    before arguments. filters is a dict of equality filters; keyset is
+    ('id',) or ('name', 'id') and must be unique and selected in columns.
+    embedded_filters narrow embedded resources only ('user.marks.exam_id')
+    and are not part of the count. count=False skips the total entirely.
+    Returns a Paginator whose items are a lazy ResultSet of the rows, with
+    the timestamps columns decoded to datetimes.
+    """
+    filters = filters or {}
+    keyset = tuple(keyset)
+    per_page = per_page or current_app.config.get('ITEMS_PER_PAGE', 20)
+    page = max(request.args.get('page', 1, type=int), 1)
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    query = supabase.table(table).select(columns)
+    for column, value in list(filters.items()) + list((embedded_filters or {}).items()):
+        query = query.eq(column, value)
+
+    cursor = None
+    forward = True
+    if after:
+        cursor = decode_cursor(after, keyset)
+    elif before:
+        cursor = decode_cursor(before, keyset)
+        forward = cursor is None
+
+    # Reading backwards means walking the keyset in the opposite direction
+    descending = desc != (not forward)
+    for column in keyset:
+        query = query.order(column, desc=descending)
+
+    if cursor is not None:
+        query = _seek(query, keyset, cursor, forward != desc)
+        rows = query.limit(per_page + 1).execute().data or []
+    else:
+        start = (page - 1) * per_page
+        rows = query.range(start, start + per_page).execute().data or []
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if cursor is not None and not forward:
+        rows.reverse()
+        has_next = True
+        if not more:
+            # Walked back to the first page
+            page = 1
+    else:
+        has_next = more
+
+    return Paginator(
+        SupabaseModel.lazy(rows, timestamps), page, per_page,
+        total=get_total(supabase, table, filters, count) if count is not False else None,
+        has_next=has_next,
+        prev_cursor=encode_cursor(rows[0], keyset) if rows and page > 1 else None,
+        next_cursor=encode_cursor(rows[-1], keyset) if rows and has_next else None
+    )
+
+
+def iter_batches(supabase, table, columns='*', filters=None, keyset=('id',), batch_size=None,
+                 embedded_filters=None):
+    """
+    Yield every row of a filtered table as lists of at most batch_size
+    dicts, walking the keyset so each request costs the same however deep
+    into the table it is. Used by exports, which hold one batch at a time.
+    """
+    keyset = tuple(keyset)
+    batch_size = batch_size or current_app.config.get('EXPORT_BATCH_SIZE', 500)
+    cursor = None
+    while True:
+        query = supabase.table(table).select(columns)
+        for column, value in list((filters or {}).items()) + list((embedded_filters or {}).items()):
+            query = query.eq(column, value)
+        for column in keyset:
+            query = query.order(column)
+        if cursor is not None:
+            query = _seek(query, keyset, cursor, True)
+        rows = query.limit(batch_size).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        cursor = [rows[-1][column] for column in keyset]
@@ -0,0 +1,171 @@
+"""
+Password hashing service.
+
+Hashing is deliberately slow and CPU-bound, so it runs on a process pool
+of PASSWORD_HASH_WORKERS processes rather than on the request thread,
+where it would hold the GIL and stall every other request the worker is
+serving. A batch, such as an imported intake or a class-wide reset, is
+spread over the whole pool.
+
+The algorithm and cost come from PASSWORD_HASH_METHOD (any werkzeug
+method string, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1').
+Existing hashes keep verifying after it changes, because every hash
+records its own method. Timings are kept per worker process; see
+get_hash_metrics(). set_passwords() hashes and stores a whole batch with
+the set_user_passwords() RPC (sql/007_set_user_passwords.sql).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from werkzeug.security import generate_password_hash
+from app.supabase_db import is_missing_function
+from app.utils.user_cache import invalidate_user
+
+DEFAULT_METHOD = 'pbkdf2'
+DEFAULT_SALT_LENGTH = 16
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+class HashMetrics:
+    """Counts and timings of the hashes made by this worker process"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hashes = 0
+        self.calls = 0
+        self.pooled_calls = 0
+        self.hash_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.slowest_hash = 0.0
+
+    def record(self, durations, wall, pooled):
+        with self._lock:
+            self.calls += 1
+            self.pooled_calls += 1 if pooled else 0
+            self.hashes += len(durations)
+            self.hash_seconds += sum(durations)
+            self.wall_seconds += wall
+            self.slowest_hash = max([self.slowest_hash] + list(durations))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'hashes': self.hashes,
+                'calls': self.calls,
+                'pooled_calls': self.pooled_calls,
+                'avg_hash_ms': round(self.hash_seconds / self.hashes * 1000, 1) if self.hashes else None,
+                'slowest_hash_ms': round(self.slowest_hash * 1000, 1),
+                'wall_seconds': round(self.wall_seconds, 3),
+                'cpu_seconds': round(self.hash_seconds, 3),
+            }
+
+
+metrics = HashMetrics()
+
+
+def _hash(password, method, salt_length):
+    """Runs in a pool process; returns the hash and the time it took"""
+    start = time.perf_counter()
+    password_hash = generate_password_hash(password, method=method, salt_length=salt_length)
+    return password_hash, time.perf_counter() - start
+
+
+def _settings():
+    config = current_app.config
+    return (config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD,
+            config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH),
+            config.get('PASSWORD_HASH_WORKERS', 4))
+
+
+def _get_pool(workers):
+    global _pool, _pool_pid
+    # A pool inherited across fork belongs to the parent; build a new one
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(max_workers=workers)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _lock:
+        _pool = None
+
+
+def hash_passwords(passwords):
+    """Hashes for a list of plain passwords, in the same order"""
+    passwords = list(passwords)
+    if not passwords:
+        return []
+    method, salt_length, workers = _settings()
+    start = time.perf_counter()
+
+    results = None
+    pooled = workers >= 2
+    if pooled:
+        chunksize = max(1, len(passwords) // (workers * 4))
+        try:
+            results = list(_get_pool(workers).map(
+                _hash, passwords, [method] * len(passwords), [salt_length] * len(passwords),
+                chunksize=chunksize
+            ))
+        except BrokenProcessPool as e:
+            # A pool process died (e.g. OOM-killed); start over next time and finish inline
+            print(f"Password hashing pool failed, hashing inline: {e}")
+            _reset_pool()
+            pooled = False
+    if results is None:
+        results = [_hash(p, method, salt_length) for p in passwords]
+
+    metrics.record([seconds for _, seconds in results], time.perf_counter() - start, pooled)
+    return [password_hash for password_hash, _ in results]
+
+
+def hash_password(password):
+    """Hash one password off the request thread"""
+    return hash_passwords([password])[0]
+
+
+def get_hash_metrics():
+    """Hashing metrics and settings of the worker serving this request"""
+    method, salt_length, workers = _settings()
+    return dict(metrics.snapshot(), method=method, workers=workers)
+
+
+def set_passwords(supabase, passwords):
+    """
+    Hash and store new passwords for {user_id: plain password} in one batch.
+    Returns the number of users updated.
+    """
+    user_ids = list(passwords)
+    if not user_ids:
+        return 0
+    hashes = hash_passwords([passwords[user_id] for user_id in user_ids])
+
+    try:
+        updated = supabase.rpc('set_user_passwords', {
+            'p_user_ids': user_ids,
+            'p_hashes': hashes
+        }).execute().data
+    except Exception as e:
+        if not is_missing_function(e):
+            raise
+        # Function not installed yet: one update per user
+        updated = 0
+        for user_id, password_hash in zip(user_ids, hashes):
+            res = supabase.table('users').update({'password': password_hash}).eq('id', user_id).execute()
+            updated += len(res.data or [])
+
+    for user_id in user_ids:
+        invalidate_user(user_id)
+    return updated
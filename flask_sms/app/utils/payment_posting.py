@@ -0,0 +1,150 @@
+"""
+Atomic payment posting.
+
+Marking a fee paid and issuing its receipt is one call to the
+post_payment() RPC (sql/006_post_payment.sql): the payment record upsert
+and the receipt insert share a transaction, and every post carries a
+client-supplied idempotency key, so a double click or a retried request
+returns the receipt that was already issued instead of writing another.
+Until the function is installed the same steps run as plain statements,
+guarded by a compare-and-set on amount_paid and a per-worker memory of
+recent keys.
+
+A post settles what is still owed: the fee less any part payments already
+recorded (see bulk_payments.py). The receipt is for that balance only.
+"""
+from app.supabase_db import is_missing_function
+from app.utils.cache import TTLCache
+
+# Keys posted by this worker while the RPC is not installed
+_recent_keys = TTLCache(maxsize=4096, ttl=3600)
+
+
+class PaymentError(Exception):
+    """Raised when a payment could not be posted; nothing has been written"""
+    pass
+
+
+class PostingResult:
+    """Outcome of one post: status is 'posted', 'duplicate' or 'already_paid'"""
+    def __init__(self, status, receipt_id=None, pr_id=None, amount_paid=None):
+        self.status = status
+        self.receipt_id = receipt_id
+        self.pr_id = pr_id
+        self.amount_paid = amount_paid
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['status'], data.get('receipt_id'), data.get('pr_id'), data.get('amount_paid'))
+
+    def to_dict(self):
+        return {'status': self.status, 'receipt_id': self.receipt_id,
+                'pr_id': self.pr_id, 'amount_paid': self.amount_paid}
+
+    @property
+    def posted(self):
+        return self.status == 'posted'
+
+
+def _post_via_rpc(supabase, record_id, payment_id, key):
+    res = supabase.rpc('post_payment', {
+        'p_record_id': record_id,
+        'p_payment_id': payment_id,
+        'p_idempotency_key': key
+    }).execute()
+    return PostingResult.from_dict(res.data)
+
+
+def _post_client_side(supabase, record_id, payment_id, key):
+    replay = _recent_keys.get(key)
+    if replay is not None:
+        return PostingResult.from_dict(dict(replay, status='duplicate'))
+
+    res_st = supabase.table('student_records').select('id, user_id').eq('id', record_id).execute()
+    if not res_st.data:
+        raise PaymentError(f'Student record {record_id} not found')
+    res_pay = supabase.table('payments').select('id, amount, year').eq('id', payment_id).execute()
+    if not res_pay.data:
+        raise PaymentError(f'Payment {payment_id} not found')
+    student_id = res_st.data[0]['user_id']
+    payment = res_pay.data[0]
+
+    res_pr = supabase.table('payment_records').select('id, paid, amount_paid').eq(
+        'payment_id', payment_id).eq('student_id', student_id).execute()
+    record = res_pr.data[0] if res_pr.data else None
+    paid_so_far = float((record or {}).get('amount_paid') or 0)
+    balance = round(float(payment['amount']) - paid_so_far, 2)
+    if record and record.get('paid') or balance <= 0:
+        return PostingResult('already_paid', amount_paid=0)
+
+    try:
+        if record:
+            pr_id = record['id']
+            # Only if no part payment was recorded since it was read
+            query = supabase.table('payment_records').update({
+                'paid': True,
+                'amount_paid': payment['amount']
+            }).eq('id', pr_id)
+            if record.get('amount_paid') is None:
+                query = query.is_('amount_paid', 'null')
+            else:
+                query = query.eq('amount_paid', record['amount_paid'])
+            if not query.execute().data:
+                raise PaymentError('The payment record changed while it was being posted; try again')
+        else:
+            res_ins = supabase.table('payment_records').insert({
+                'payment_id': payment_id,
+                'student_id': student_id,
+                'year': payment['year'],
+                'amount_paid': payment['amount'],
+                'paid': True
+            }).execute()
+            pr_id = res_ins.data[0]['id']
+    except PaymentError:
+        raise
+    except Exception as e:
+        raise PaymentError(str(e))
+
+    try:
+        res_rc = supabase.table('receipts').insert({
+            'pr_id': pr_id,
+            'amount_paid': balance,
+            'year': payment['year']
+        }).execute()
+    except Exception as e:
+        # Put the record back so the balance still shows as owed
+        try:
+            if record:
+                supabase.table('payment_records').update({
+                    'paid': False,
+                    'amount_paid': record.get('amount_paid')
+                }).eq('id', pr_id).execute()
+            else:
+                supabase.table('payment_records').delete().eq('id', pr_id).execute()
+        except Exception as cleanup_error:
+            print(f"Payment rollback failed for payment_record {pr_id}: {cleanup_error}")
+        raise PaymentError(str(e))
+
+    result = PostingResult('posted', res_rc.data[0]['id'], pr_id, balance)
+    _recent_keys.set(key, result.to_dict())
+    return result
+
+
+def post_payment(supabase, record_id, payment_id, key):
+    """
+    Settle the outstanding balance of payment_id for the student_records
+    row record_id and issue its receipt for that balance, once per
+    idempotency key. Returns a PostingResult;
+    raises PaymentError if nothing was posted.
+    """
+    if not key:
+        raise PaymentError('Missing idempotency key')
+
+    try:
+        return _post_via_rpc(supabase, record_id, payment_id, key)
+    except Exception as e:
+        if not is_missing_function(e):
+            raise PaymentError(getattr(e, 'message', None) or str(e))
+
+    return _post_client_side(supabase, record_id, payment_id, key)
+
@@ -0,0 +1,27 @@
+"""
+PIN generation.
+
+PINs are generated by a background job (the pins.create route enqueues
+it) and inserted PIN_BATCH_SIZE at a time, so a large request neither
+holds a worker for the whole run nor sends one oversized insert.
+"""
+import secrets
+from app.supabase_db import get_db
+from app.utils.jobs import job
+from app.utils.pagination import invalidate_counts
+
+# PINs inserted per request by the generation job
+PIN_BATCH_SIZE = 500
+
+
+@job('generate_pins')
+def generate_pins(ctx, count):
+    """Insert count new PINs in batches, resuming after the last batch a failed attempt stored"""
+    supabase = get_db()
+    while ctx.done < count:
+        size = min(PIN_BATCH_SIZE, count - ctx.done)
+        pins_data = [{'code': secrets.token_hex(8).upper()} for _ in range(size)]
+        supabase.table('pins').insert(pins_data).execute()
+        invalidate_counts('pins')
+        ctx.progress(ctx.done + size, count, f'{ctx.done + size} of {count} PINs generated')
+    return {'generated': count, 'message': f'{count} PIN(s) generated successfully!'}
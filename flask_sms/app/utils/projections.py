@@ -0,0 +1,148 @@
+"""
+Column projections for list views.
+
+FIELD_SETS names the columns a page needs from each table and VIEWS
+combines them, with embedded relations, into the select() string of one
+route, e.g. select(projection('students.index')). Listing pages fetch
+only what their template renders, and no users field set may contain a
+password hash or remember token.
+"""
+from functools import lru_cache
+
+# Columns that must never be sent to a listing page
+SENSITIVE_COLUMNS = {
+    'users': {'password', 'remember_token'},
+}
+
+FIELD_SETS = {
+    'users': {
+        'ref': 'id, name',
+        'roster': 'id, name, gender',
+        'login': 'id, name, username',
+        'session': 'id, name, email, username, user_type, phone, phone2, address, photo',
+        'list': 'id, name, username, email, phone, user_type',
+    },
+    'my_classes': {
+        'ref': 'id, name',
+        'list': 'id, name, class_type_id, created_at',
+    },
+    'sections': {
+        'ref': 'id, name',
+        'list': 'id, name, teacher_id, active',
+    },
+    'student_records': {
+        'list': 'id, user_id, adm_no, my_class_id, section_id',
+        'roster': 'id, user_id, adm_no, my_class_id',
+        'graduated': 'id, user_id, adm_no, grad_date',
+        'class_list': 'id, user_id, adm_no, section_id',
+    },
+    'subjects': {
+        'ref': 'id, name',
+        'list': 'id, name, my_class_id, teacher_id',
+    },
+    'exams': {
+        'ref': 'id, name, year',
+    },
+    'exam_records': {
+        'ref': 'id',
+    },
+    'promotions': {
+        'list': 'id, student_id, from_session, to_session, created_at',
+    },
+    'timetables': {
+        'list': 'id, name, year, my_class_id',
+    },
+    'payments': {
+        'list': 'id, title, amount, description, year, my_class_id',
+        'billing': 'id, title, amount, year, my_class_id',
+    },
+    'payment_records': {
+        'billing': 'id, student_id, amount_paid, paid',
+    },
+    'marks': {
+        'sheet': 't1, exams, total',
+    },
+}
+
+# student_records has two foreign keys to users (student and parent)
+STUDENT_USER = 'users!student_records_user_id_fkey'
+
+# view -> (table, field set, {alias: (relation, field set)})
+VIEWS = {
+    'students.index': ('student_records', 'list', {
+        'user': (STUDENT_USER, 'ref'),
+        'my_class': ('my_classes', 'ref'),
+        'section': ('sections', 'ref'),
+    }),
+    'students.list_by_class': ('student_records', 'class_list', {
+        'user': (STUDENT_USER, 'roster'),
+        'section': ('sections', 'ref'),
+    }),
+    'students.graduated': ('student_records', 'graduated', {
+        'user': (STUDENT_USER, 'ref'),
+    }),
+    'students.promotion': ('my_classes', 'ref', {
+        'sections': ('sections', 'ref'),
+    }),
+    'students.promotion_selector': ('student_records', 'class_list', {
+        'user': (STUDENT_USER, 'ref'),
+        'section': ('sections', 'ref'),
+    }),
+    'students.promotion_manage': ('promotions', 'list', {
+        'student': ('users', 'ref'),
+        'prev_class': ('my_classes!from_class', 'ref'),
+        'new_class': ('my_classes!to_class', 'ref'),
+    }),
+    'users.index': ('users', 'list', {}),
+    'subjects.index': ('subjects', 'list', {
+        'my_class': ('my_classes', 'ref'),
+        'teacher': ('users', 'ref'),
+    }),
+    'classes.index': ('my_classes', 'list', {}),
+    'classes.show': ('sections', 'list', {
+        'teacher': ('users', 'ref'),
+    }),
+    'exams.show': ('exam_records', 'ref', {}),
+    'timetables.index': ('timetables', 'list', {
+        'my_class': ('my_classes', 'ref'),
+    }),
+    'payments.index': ('payments', 'list', {
+        'my_class': ('my_classes', 'ref'),
+    }),
+    'payments.invoice': ('student_records', 'roster', {
+        'user': (STUDENT_USER, 'ref'),
+        'my_class': ('my_classes', 'ref'),
+    }),
+}
+
+
+def fields(table, field_set):
+    """Column list of a named field set"""
+    return FIELD_SETS[table][field_set]
+
+
+def embed(alias, relation, field_set):
+    """Embedded resource, e.g. embed('user', 'users!fk', 'ref') -> 'user:users!fk(id, name)'"""
+    table = relation.split('!', 1)[0]
+    return f'{alias}:{relation}({fields(table, field_set)})'
+
+
+@lru_cache(maxsize=None)
+def projection(view):
+    """select() string for a view in VIEWS"""
+    table, field_set, embeds = VIEWS[view]
+    parts = [fields(table, field_set)]
+    parts += [embed(alias, relation, embedded_set) for alias, (relation, embedded_set) in embeds.items()]
+    return ', '.join(parts)
+
+
+def _check_field_sets():
+    for table, sets in FIELD_SETS.items():
+        blocked = SENSITIVE_COLUMNS.get(table, set())
+        for name, columns in sets.items():
+            columns = {c.strip() for c in columns.split(',')}
+            if '*' in columns or columns & blocked:
+                raise ValueError(f'Field set {table}.{name} exposes sensitive columns')
+
+
+_check_field_sets()
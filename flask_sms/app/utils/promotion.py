@@ -0,0 +1,104 @@
+"""
+Batch student promotion.
+
+Promotes a whole selection with the transactional promote_students() RPC
+(sql/003_promote_students.sql). Until that function is installed the same
+work is done in three set-based statements (one select, one bulk insert,
+one update) with a compensating delete, so a failure never leaves a class
+half promoted. The students.promote route runs it as a background job.
+"""
+from app.supabase_db import get_db, is_missing_function
+from app.utils.jobs import job, JobError
+from app.utils.result_snapshots import invalidate_class_snapshots
+
+
+class PromotionError(Exception):
+    """Raised when a promotion was rejected; no student has been changed"""
+    pass
+
+
+def _promote_via_rpc(supabase, record_ids, to_class, to_section, to_session):
+    res = supabase.rpc('promote_students', {
+        'p_record_ids': record_ids,
+        'p_to_class': to_class,
+        'p_to_section': to_section,
+        'p_to_session': to_session
+    }).execute()
+    return res.data
+
+
+def _promote_set_based(supabase, record_ids, to_class, to_section, to_session):
+    res = supabase.table('student_records').select(
+        'id, user_id, my_class_id, section_id, session'
+    ).in_('id', record_ids).execute()
+
+    missing = set(record_ids) - {r['id'] for r in res.data}
+    if missing:
+        raise PromotionError(f'{len(missing)} selected student(s) no longer exist')
+
+    promotions = [{
+        'student_id': r['user_id'],
+        'from_class': r['my_class_id'],
+        'from_section': r['section_id'],
+        'to_class': to_class,
+        'to_section': to_section,
+        'from_session': r['session'],
+        'to_session': to_session
+    } for r in res.data]
+
+    try:
+        res_ins = supabase.table('promotions').insert(promotions).execute()
+    except Exception as e:
+        raise PromotionError(str(e))
+
+    try:
+        supabase.table('student_records').update({
+            'my_class_id': to_class,
+            'section_id': to_section,
+            'session': to_session
+        }).in_('id', record_ids).execute()
+    except Exception as e:
+        # Roll back the promotion history we just wrote
+        inserted_ids = [p['id'] for p in res_ins.data]
+        try:
+            supabase.table('promotions').delete().in_('id', inserted_ids).execute()
+        except Exception as cleanup_error:
+            print(f"Promotion rollback failed for promotions {inserted_ids}: {cleanup_error}")
+        raise PromotionError(str(e))
+
+    return len(record_ids)
+
+
+def promote_students(supabase, record_ids, to_class, to_section, to_session):
+    """
+    Move every student_records id in record_ids to the target class,
+    section and session, recording a promotions row for each.
+    Returns the number promoted; raises PromotionError if nothing changed.
+    """
+    record_ids = sorted({int(i) for i in record_ids})
+    if not record_ids:
+        return 0
+
+    try:
+        return _promote_via_rpc(supabase, record_ids, to_class, to_section, to_session)
+    except Exception as e:
+        if not is_missing_function(e):
+            raise PromotionError(getattr(e, 'message', None) or str(e))
+
+    return _promote_set_based(supabase, record_ids, to_class, to_section, to_session)
+
+
+@job('promote_students')
+def promote_students_job(ctx, record_ids, to_class, to_section, to_session):
+    """Background promotion; a rejected promotion fails the job without a retry"""
+    ctx.progress(0, len(record_ids), 'Promoting students')
+    supabase = get_db()
+    res = supabase.table('student_records').select('my_class_id').in_('id', record_ids).execute()
+    try:
+        promoted = promote_students(supabase, record_ids, to_class, to_section, to_session)
+    except PromotionError as e:
+        raise JobError(f'Promotion failed and no students were changed: {e}')
+    # Both the classes left and the class joined have a new roster
+    invalidate_class_snapshots(supabase, [r['my_class_id'] for r in res.data] + [to_class])
+    ctx.progress(promoted, promoted)
+    return {'promoted': promoted, 'message': f'{promoted} students promoted successfully!'}
@@ -0,0 +1,249 @@
+"""
+Printable result cards.
+
+A class's cards come from one set of reads (subjects, roster and every
+mark of the class for the exam) and one ResultsTable, so totals, grades
+and positions are computed once for the whole class rather than once per
+student. Each card is rendered to PDF with reportlab on a process pool of
+RESULT_CARD_WORKERS processes and kept in RESULT_CARD_CACHE_DIR under
+(exam, student, version), where the version is a digest of everything
+printed on the card; a card is only rendered again once its marks, grades
+or position change. Cards of a class or a whole exam are sent as a ZIP
+that is written while later cards are still rendering.
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+from flask import Response, current_app, stream_with_context
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from app.utils.exports import iter_zip, safe_filename, content_disposition
+from app.utils.fanout import fetch_all
+from app.utils.projections import STUDENT_USER
+from app.utils.result_snapshots import load_class_subjects
+from grading import ResultsTable
+from app.supabase_db import SupabaseModel
+
+# Bump when the layout changes so cached cards are rendered again
+CARD_LAYOUT_VERSION = 1
+
+CARD_HEADER = ['Subject', 'Internal (25)', 'Theory (75)', 'Total (100)', 'Grade', 'Remark']
+ROSTER_COLUMNS = f'id, user_id, adm_no, session, user:{STUDENT_USER}(id, name)'
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+def load_class_cards(supabase, exam, class_id):
+    """
+    Card data of every student of a class for an exam, in admission
+    number order, or None if the class does not exist.
+    """
+    reads = fetch_all(
+        my_class=supabase.table('my_classes').select('id, name').eq('id', class_id),
+        subjects=lambda: load_class_subjects(supabase, class_id),
+        students=supabase.table('student_records').select(ROSTER_COLUMNS).eq('my_class_id', class_id),
+        marks=supabase.table('marks').select('*').eq('exam_id', exam['id']).eq('my_class_id', class_id)
+    )
+    if not reads['my_class']:
+        return None
+    my_class, subjects = reads['my_class'][0], reads['subjects']
+    students = sorted(SupabaseModel.from_list(reads['students']), key=lambda s: str(s.adm_no))
+
+    # marks.student_id refers to users.id
+    table = ResultsTable.from_marks(students, subjects, reads['marks'], student_key='user_id')
+    marks = {}
+    for mark in reads['marks']:
+        marks.setdefault(mark['student_id'], {})[mark['subject_id']] = mark
+
+    cards = []
+    for index, student in enumerate(students):
+        result = table.row(index)
+        own = marks.get(student.user_id, {})
+        lines = []
+        for subject, grade in zip(subjects, table.subject_grades(index)):
+            mark = own.get(subject.id) or {}
+            lines.append([subject.name, mark.get('t1') or 0, mark.get('exams') or 0, mark.get('total') or 0,
+                          str(grade), mark.get('teacher_remark') or ''])
+        cards.append({
+            'school': current_app.config.get('SCHOOL_NAME', 'School'),
+            'exam': f"{exam['name']} ({exam['year']})",
+            'exam_id': exam['id'],
+            'student_id': student.user_id,
+            'name': student.user['name'] if student.user else '',
+            'adm_no': student.adm_no,
+            'class': my_class['name'],
+            'session': student.get('session') or '',
+            'lines': lines,
+            'total': result['total_score'],
+            'percentage': round(result['percentage'], 1),
+            'gpa': result['gpa'],
+            'grade': result['grade'],
+            'position': result['position'],
+            'class_size': len(students),
+        })
+    return cards
+
+
+def card_version(card):
+    """Digest of everything printed on a card"""
+    payload = json.dumps([CARD_LAYOUT_VERSION, card], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def render_card(card):
+    """PDF bytes of one result card; runs in a pool process"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, title=f"{card['name']} - {card['exam']}")
+    styles = getSampleStyleSheet()
+
+    details = Table([
+        ['Student Name:', card['name'], 'Adm. Number:', card['adm_no']],
+        ['Class:', card['class'], 'Session:', card['session']],
+    ], colWidths=[80, 170, 80, 130])
+    details.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+    ]))
+
+    marks = Table([CARD_HEADER] + [[str(v) for v in line] for line in card['lines']], repeatRows=1)
+    marks.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (1, 0), (4, -1), 'CENTER'),
+    ]))
+
+    summary = Table([
+        ['Total Score:', str(card['total']), 'Overall Grade:', card['grade']],
+        ['Percentage:', f"{card['percentage']:.1f}%", 'Class Position:', f"{card['position']} of {card['class_size']}"],
+        ['GPA:', f"{card['gpa']:.2f}", '', ''],
+    ], colWidths=[80, 150, 90, 140])
+    summary.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, -1), colors.whitesmoke),
+    ]))
+
+    signatures = Table([['Class Teacher', 'Principal', 'Parent/Guardian']], colWidths=[150, 150, 150])
+    signatures.setStyle(TableStyle([
+        ('LINEABOVE', (0, 0), (-1, 0), 0.5, colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ]))
+
+    doc.build([
+        Paragraph(escape(card['school']), styles['Title']),
+        Paragraph(f"Student Report Card - {escape(card['exam'])}", styles['Heading3']),
+        Spacer(1, 12),
+        details,
+        Spacer(1, 12),
+        marks,
+        Spacer(1, 12),
+        summary,
+        Paragraph('Grading scale: A 90-100, B 80-89, C 70-79, D 60-69, E 50-59, F 0-49', styles['Normal']),
+        Spacer(1, 60),
+        signatures,
+    ])
+    return buffer.getvalue()
+
+
+def _get_pool(workers):
+    global _pool, _pool_pid
+    # A pool inherited across fork belongs to the parent; build a new one
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(max_workers=workers)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _lock:
+        _pool = None
+
+
+def _render_all(cards, workers):
+    """PDF bytes for each card in order, rendered on the pool when there is more than one"""
+    done = 0
+    if workers >= 2 and len(cards) > 1:
+        try:
+            for data in _get_pool(workers).map(render_card, cards, chunksize=max(1, len(cards) // (workers * 8))):
+                done += 1
+                yield data
+            return
+        except BrokenProcessPool as e:
+            # A pool process died (e.g. OOM-killed); start over next time and finish inline
+            print(f"Result card pool failed, rendering inline: {e}")
+            _reset_pool()
+    for card in cards[done:]:
+        yield render_card(card)
+
+
+def _cache_path(directory, card, version):
+    return os.path.join(directory, f"{card['exam_id']}_{card['student_id']}_{version}.pdf")
+
+
+def _store(directory, card, version, data):
+    path = _cache_path(directory, card, version)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        # Cards of earlier versions of this student's results are stale
+        for old in glob.glob(os.path.join(directory, f"{card['exam_id']}_{card['student_id']}_*.pdf")):
+            if old != path:
+                os.remove(old)
+    except OSError as e:
+        print(f"Result card cache write failed for {path}: {e}")
+
+
+def iter_card_pdfs(cards):
+    """(card, PDF bytes) for each card in order, from the cache or freshly rendered"""
+    config = current_app.config
+    directory = config.get('RESULT_CARD_CACHE_DIR')
+    versions = [card_version(card) for card in cards]
+    cached = [bool(directory) and os.path.exists(_cache_path(directory, card, version))
+              for card, version in zip(cards, versions)]
+
+    rendered = _render_all([card for card, hit in zip(cards, cached) if not hit],
+                           config.get('RESULT_CARD_WORKERS', 4))
+    for card, version, hit in zip(cards, versions, cached):
+        data = None
+        if hit:
+            try:
+                with open(_cache_path(directory, card, version), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = render_card(card)
+        else:
+            data = next(rendered)
+            if directory:
+                _store(directory, card, version, data)
+        yield card, data
+
+
+def card_filename(card):
+    return f"{safe_filename(card['adm_no'] or str(card['student_id']))}_{safe_filename(card['name'])}.pdf"
+
+
+def result_cards_response(filename, files):
+    """Streamed ZIP download of (name, PDF bytes) pairs"""
+    return Response(
+        stream_with_context(iter_zip(files)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': content_disposition(f'{safe_filename(filename)}.zip')}
+    )
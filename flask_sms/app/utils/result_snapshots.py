@@ -0,0 +1,280 @@
+"""
+Materialized exam results.
+
+Per-student and per-class aggregates are computed with the results engine
+and stored in result_snapshots / class_result_snapshots
+(sql/004_result_snapshots.sql) whenever marks are saved or an exam is
+finalized, so result pages read them back instead of recomputing.
+Writes that change a class roster (promotion, import, student edits)
+drop that class's snapshots and queue a rebuild; until it lands, result
+pages compute live results. `flask results rebuild` regenerates them for
+historic exams.
+"""
+import click
+from datetime import datetime, timezone
+from app.supabase_db import get_db, SupabaseModel
+from grading import ResultsTable
+from app.utils.fanout import fetch_all
+from app.utils.pagination import iter_batches
+from app.utils.jobs import job, enqueue
+
+STUDENT_CONFLICT_KEY = 'exam_id,student_id'
+CLASS_CONFLICT_KEY = 'exam_id,my_class_id'
+
+
+def load_class_subjects(supabase, class_id):
+    """Subjects taught in a class, or every subject when none are assigned, in id order"""
+    res = supabase.table('subjects').select('*').eq('my_class_id', class_id).order('id').execute()
+    if not res.data:
+        res = supabase.table('subjects').select('*').order('id').execute()
+    return SupabaseModel.from_list(res.data)
+
+
+def load_class_results(supabase, exam_id, class_id, subjects=None):
+    """
+    Compute results for one class live; pass subjects if already loaded.
+    Returns (students, subjects, ResultsTable).
+    """
+    reads = {
+        'students': supabase.table('student_records').select(
+            '*, user:users!student_records_user_id_fkey(id, name)'
+        ).eq('my_class_id', class_id),
+        'marks': supabase.table('marks').select('student_id, subject_id, total').eq('exam_id', exam_id).eq('my_class_id', class_id)
+    }
+    if subjects is None:
+        reads['subjects'] = lambda: load_class_subjects(supabase, class_id)
+    reads = fetch_all(**reads)
+    students = SupabaseModel.from_list(reads['students'])
+    subjects = reads.get('subjects', subjects)
+
+    # marks.student_id refers to users.id
+    table = ResultsTable.from_marks(students, subjects, reads['marks'], student_key='user_id')
+    return students, subjects, table
+
+
+def student_name(student):
+    """Display name of a student record loaded with its user"""
+    return student.user['name'] if student.user else None
+
+
+def rebuild_class_snapshot(supabase, exam_id, class_id, computed=None):
+    """
+    Store the snapshot for one class, recomputing it unless the
+    (students, subjects, table) result of load_class_results is passed in.
+    Returns the number of students written.
+    """
+    students, subjects, table = computed or load_class_results(supabase, exam_id, class_id)
+    now = datetime.now(timezone.utc).isoformat()
+
+    rows = []
+    for result in table.rows():
+        rows.append({
+            'exam_id': exam_id,
+            'student_id': result['student'].user_id,
+            'my_class_id': class_id,
+            'marks': {str(k): v for k, v in result['marks'].items()},
+            'total': result['total_score'],
+            'percentage': result['percentage'],
+            'grade': result['grade'],
+            'gpa': result['gpa'],
+            'position': result['position'],
+            'updated_at': now
+        })
+
+    if rows:
+        supabase.table('result_snapshots').upsert(rows, on_conflict=STUDENT_CONFLICT_KEY).execute()
+
+    # Drop students who have left the class since the last snapshot
+    stale = supabase.table('result_snapshots').delete().eq('exam_id', exam_id).eq('my_class_id', class_id)
+    if rows:
+        stale = stale.not_.in_('student_id', [r['student_id'] for r in rows])
+    stale.execute()
+
+    topper = table.topper_index
+    stats = table.subject_stats(student_name)
+    supabase.table('class_result_snapshots').upsert({
+        'exam_id': exam_id,
+        'my_class_id': class_id,
+        'subject_ids': [s.id for s in subjects],
+        'subject_stats': {str(k): v for k, v in stats.items()},
+        'class_average': table.class_average,
+        'topper_student_id': students[topper].user_id if topper is not None else None,
+        'student_count': len(students),
+        'updated_at': now
+    }, on_conflict=CLASS_CONFLICT_KEY).execute()
+
+    return len(rows)
+
+
+def exam_class_ids(supabase, exam_id):
+    """Ids of the classes that have marks in an exam"""
+    res = supabase.table('marks').select('my_class_id').eq('exam_id', exam_id).execute()
+    return sorted({m['my_class_id'] for m in res.data if m.get('my_class_id')})
+
+
+def rebuild_exam_snapshots(supabase, exam_id):
+    """Rebuild the snapshot of every class that has marks in an exam"""
+    class_ids = exam_class_ids(supabase, exam_id)
+    written = 0
+    for class_id in class_ids:
+        written += rebuild_class_snapshot(supabase, exam_id, class_id)
+    return len(class_ids), written
+
+
+def invalidate_class_snapshots(supabase, class_ids, exam_id=None, user_id=None):
+    """
+    Drop the stored results of classes whose roster or marks changed (the
+    class rows and their students' rows), so result pages compute live
+    results, and queue a rebuild of each (owned by user_id, if given).
+    With exam_id only that exam's snapshot is dropped and it is always
+    rebuilt; otherwise every exam that had a snapshot of the classes is
+    rebuilt.
+    """
+    class_ids = sorted({int(c) for c in class_ids if c})
+    if not class_ids:
+        return
+    query = supabase.table('class_result_snapshots').delete().in_('my_class_id', class_ids)
+    student_query = supabase.table('result_snapshots').delete().in_('my_class_id', class_ids)
+    if exam_id is not None:
+        query = query.eq('exam_id', exam_id)
+        student_query = student_query.eq('exam_id', exam_id)
+    try:
+        res = query.execute()
+    except Exception as e:
+        print(f"Result snapshot invalidation failed for classes {class_ids}: {e}")
+        return
+    # Student result pages read these rows directly; the rebuild below writes them again
+    try:
+        student_query.execute()
+    except Exception as e:
+        print(f"Student result snapshot invalidation failed for classes {class_ids}: {e}")
+
+    if exam_id is not None:
+        pairs = {(exam_id, class_id) for class_id in class_ids}
+    else:
+        pairs = {(row['exam_id'], row['my_class_id']) for row in res.data or []}
+    for snapshot_exam, class_id in sorted(pairs):
+        try:
+            enqueue('refresh_class_snapshot', user_id=user_id, dedupe_key=f'snapshot:{snapshot_exam}:{class_id}',
+                    exam_id=snapshot_exam, class_id=class_id)
+        except Exception as e:
+            print(f"Could not queue the result snapshot refresh for exam {snapshot_exam}, class {class_id}: {e}")
+
+
+@job('refresh_class_snapshot')
+def refresh_class_snapshot_job(ctx, exam_id, class_id):
+    """Queued rebuild after marks or a roster change; failures are retried by the job queue"""
+    rebuild_class_snapshot(get_db(), exam_id, class_id)
+    return {'message': 'Class results updated'}
+
+
+def load_class_snapshot(supabase, exam_id, class_id, subjects):
+    """
+    Stored results for a class in the shape class_results renders, or None
+    when there is no snapshot or it was computed over a different subject list.
+    """
+    try:
+        reads = fetch_all(
+            snapshot=supabase.table('class_result_snapshots').select('*').eq('exam_id', exam_id).eq('my_class_id', class_id),
+            rows=supabase.table('result_snapshots').select(
+                '*, user:users(id, name)'
+            ).eq('exam_id', exam_id).eq('my_class_id', class_id).order('position')
+        )
+    except Exception as e:
+        print(f"Result snapshots unavailable: {e}")
+        return None
+    if not reads['snapshot']:
+        return None
+
+    snapshot = reads['snapshot'][0]
+    if snapshot['subject_ids'] != [s.id for s in subjects]:
+        return None
+
+    results = [_snapshot_result(row) for row in reads['rows']]
+
+    if not results:
+        return None
+
+    topper = next((r for r in results if r['student'].user_id == snapshot['topper_student_id']), results[0])
+    return {
+        'results': results,
+        'topper': topper,
+        'subject_highs': {int(k): v for k, v in snapshot['subject_stats'].items()},
+        'class_avg': float(snapshot['class_average'])
+    }
+
+
+def _snapshot_result(row):
+    """A result_snapshots row in the shape of ResultsTable.row()"""
+    return {
+        'student': SupabaseModel({'user_id': row['student_id'], 'user': row['user']}),
+        'marks': {int(k): v for k, v in row['marks'].items()},
+        'total_score': row['total'],
+        'percentage': float(row['percentage']),
+        'grade': row['grade'],
+        'gpa': float(row['gpa']),
+        'position': row['position']
+    }
+
+
+def class_results_for_export(supabase, exam_id, class_id, subjects):
+    """
+    Result rows of a class in position order, or None if the class has no
+    students. A current snapshot is streamed in keyset batches; otherwise
+    the results are computed live like the class results page.
+    """
+    try:
+        res = supabase.table('class_result_snapshots').select('subject_ids').eq(
+            'exam_id', exam_id).eq('my_class_id', class_id).execute()
+        current = bool(res.data) and res.data[0]['subject_ids'] == [s.id for s in subjects]
+    except Exception as e:
+        print(f"Result snapshots unavailable: {e}")
+        current = False
+
+    if current:
+        def rows():
+            for batch in iter_batches(
+                supabase, 'result_snapshots',
+                'id, student_id, marks, total, percentage, grade, gpa, position, user:users(id, name)',
+                filters={'exam_id': exam_id, 'my_class_id': class_id},
+                keyset=('position', 'id')
+            ):
+                for row in batch:
+                    yield _snapshot_result(row)
+        return rows()
+
+    students, subjects, table = load_class_results(supabase, exam_id, class_id, subjects)
+    if not students:
+        return None
+    return sorted(table.rows(), key=lambda r: r['position'])
+
+
+def load_student_snapshot(supabase, exam_id, student_id):
+    """Stored summary row for one student, or None"""
+    try:
+        res = supabase.table('result_snapshots').select('total, percentage, grade, gpa, position').eq('exam_id', exam_id).eq('student_id', student_id).execute()
+    except Exception as e:
+        print(f"Result snapshots unavailable: {e}")
+        return None
+    return res.data[0] if res.data else None
+
+
+def register_result_commands(app):
+    """Register the `flask results` CLI commands"""
+
+    @app.cli.group('results')
+    def results_cli():
+        """Exam result snapshot commands"""
+
+    @results_cli.command('rebuild')
+    @click.option('--exam-id', type=int, help='Only rebuild this exam')
+    def rebuild(exam_id):
+        """Rebuild stored results for one or all exams"""
+        supabase = get_db()
+        if exam_id:
+            exam_ids = [exam_id]
+        else:
+            exam_ids = [e['id'] for e in supabase.table('exams').select('id').execute().data]
+        for eid in exam_ids:
+            classes, students = rebuild_exam_snapshots(supabase, eid)
+            click.echo(f'Exam {eid}: {students} student results across {classes} classes')
@@ -0,0 +1,34 @@
+"""
+Streamed page rendering.
+
+stream_page() renders a template with Jinja's generate() and sends the
+HTML as it is produced, so a long listing starts arriving before its last
+row is rendered and the finished page is never held in memory. Pair it
+with a lazy ResultSet (SupabaseModel.lazy / paginate) so rows are wrapped
+as they are written. STREAM_TEMPLATES=false falls back to render_template,
+e.g. behind a proxy that buffers responses anyway.
+
+The session cookie goes out with the headers, before the body, so
+anything the template would store in the session has to happen first:
+flashed messages are popped and the CSRF token is created up front.
+"""
+from flask import Response, current_app, get_flashed_messages, render_template, stream_with_context
+from flask_wtf.csrf import generate_csrf
+
+
+def stream_page(template_name, **context):
+    """Response that streams template_name rendered with context"""
+    if not current_app.config.get('STREAM_TEMPLATES', True):
+        return render_template(template_name, **context)
+
+    # Both are cached for the request, so the template gets the same values
+    get_flashed_messages(with_categories=True)
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        generate_csrf()
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(current_app.config.get('STREAM_BUFFER_SIZE', 64))
+    return Response(stream_with_context(stream), mimetype='text/html')
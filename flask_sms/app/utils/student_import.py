@@ -0,0 +1,294 @@
+"""
+Bulk student import from CSV.
+
+Every row of the file is validated before anything is written: required
+fields, formats, duplicates inside the file, and existing emails,
+usernames and admission numbers. Both checks ignore case, like the
+login lookup: the database is asked with ilike, one query per column per
+chunk of TAKEN_CHUNK_SIZE values.
+Passwords of the accepted rows are hashed on the process pool, then users
+and student_records are inserted in batches of IMPORT_BATCH_SIZE. If a
+student_records batch is rejected its users are deleted again, so no
+account is left without a student record.
+"""
+import csv
+import io
+import re
+from datetime import datetime
+from flask import current_app
+from app.utils.passwords import hash_passwords
+from app.utils.result_snapshots import invalidate_class_snapshots
+from app.utils.pagination import quote_literal
+
+REQUIRED_COLUMNS = ('name', 'email', 'username', 'adm_no')
+OPTIONAL_COLUMNS = ('password', 'phone', 'dob', 'gender', 'address', 'class', 'section', 'house', 'age')
+
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+GENDERS = ('male', 'female')
+
+# Values per or=(ilike...) lookup of existing users; keeps the request URL short
+TAKEN_CHUNK_SIZE = 50
+
+
+class ImportRowResult:
+    """Outcome of one line of a student import"""
+    def __init__(self, line, data, error=None):
+        self.line = line
+        self.data = data
+        self.error = error
+        self.user = None
+        self.record = None
+        self.password = None
+        self.user_id = None
+        self.record_id = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def label(self):
+        return self.data.get('adm_no') or self.data.get('name') or f'line {self.line}'
+
+
+class StudentImportReport:
+    """Per-row report of a student import"""
+    def __init__(self):
+        self.results = []
+        self.missing_columns = []
+
+    @property
+    def imported(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    def summary(self, limit=5):
+        """Short human readable description of the failed rows"""
+        failed = self.failed
+        parts = [f'line {r.line} ({r.label}): {r.error}' for r in failed[:limit]]
+        if len(failed) > limit:
+            parts.append(f'and {len(failed) - limit} more')
+        return '; '.join(parts)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _by_name(rows):
+    """{lowercase name or str(id): row} for matching CSV values to reference rows"""
+    index = {}
+    for row in rows:
+        index[str(row['id'])] = row
+        if row.get('name'):
+            index[row['name'].strip().lower()] = row
+    return index
+
+
+def parse_student_csv(text, max_rows=None):
+    """
+    Read an import file into a report with one ImportRowResult per data row.
+    The header names the columns; REQUIRED_COLUMNS must be present.
+    """
+    report = StudentImportReport()
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [(c or '').strip().lower() for c in (reader.fieldnames or [])]
+    report.missing_columns = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if report.missing_columns:
+        return report
+    reader.fieldnames = columns
+
+    for line, row in enumerate(reader, start=2):
+        data = {k: (v or '').strip() for k, v in row.items() if k in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+        if not any(data.values()):
+            continue
+        if max_rows and len(report.results) >= max_rows:
+            report.results.append(ImportRowResult(line, data, error=f'More than {max_rows} rows; split the file'))
+            break
+        report.results.append(ImportRowResult(line, data))
+    return report
+
+
+def _validate_row(result, defaults, classes, sections):
+    data = result.data
+    for column in REQUIRED_COLUMNS:
+        if not data.get(column):
+            return f'{column} is required'
+    if len(data['name']) > 191:
+        return 'name is longer than 191 characters'
+    if len(data['username']) > 100:
+        return 'username is longer than 100 characters'
+    if not EMAIL_RE.match(data['email']):
+        return f"invalid email {data['email']}"
+
+    gender = data.get('gender', '').lower() or None
+    if gender and gender not in GENDERS:
+        return f"gender must be male or female, not {data['gender']}"
+
+    dob = None
+    if data.get('dob'):
+        try:
+            dob = datetime.strptime(data['dob'], '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            return f"dob {data['dob']} is not a YYYY-MM-DD date"
+
+    age = None
+    if data.get('age'):
+        if not data['age'].isdigit():
+            return f"age {data['age']} is not a whole number"
+        age = int(data['age'])
+
+    my_class_id = defaults['my_class_id']
+    if data.get('class'):
+        my_class = classes.get(data['class'].lower())
+        if my_class is None:
+            return f"unknown class {data['class']}"
+        my_class_id = my_class['id']
+
+    section_id = defaults['section_id'] if my_class_id == defaults['my_class_id'] else None
+    if data.get('section'):
+        matches = [s for key, s in sections.items()
+                   if key == data['section'].lower() and s.get('my_class_id') in (None, my_class_id)]
+        if not matches:
+            return f"unknown section {data['section']} for this class"
+        section_id = matches[0]['id']
+    if not my_class_id or not section_id:
+        return 'class and section are required'
+
+    result.password = data.get('password') or data['adm_no']
+    result.user = {
+        'name': data['name'],
+        'email': data['email'].lower(),
+        'username': data['username'],
+        'user_type': 'student',
+        'phone': data.get('phone') or None,
+        'dob': dob,
+        'gender': gender,
+        'address': data.get('address') or None
+    }
+    result.record = {
+        'my_class_id': my_class_id,
+        'section_id': section_id,
+        'adm_no': data['adm_no'],
+        'year_admitted': defaults['year_admitted'],
+        'session': defaults['session'],
+        'house': data.get('house') or None,
+        'age': age
+    }
+    return None
+
+
+def _like_literal(value):
+    """value as an ilike pattern, with the LIKE wildcards % and _ escaped"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return quote_literal(escaped)
+
+
+def _taken(supabase, table, column, values):
+    """Lowercased values of column that already exist in table, compared without case"""
+    taken = set()
+    for chunk in _chunks(sorted(values), TAKEN_CHUNK_SIZE):
+        res = supabase.table(table).select(column).or_(
+            ','.join(f'{column}.ilike.{_like_literal(value)}' for value in chunk)
+        ).execute()
+        taken.update(str(row[column]).lower() for row in res.data)
+    # PostgREST also reads * as a wildcard, so only exact matches count
+    return taken & {value.lower() for value in values}
+
+
+def validate_students(supabase, report, defaults, classes, sections):
+    """
+    Check every row of the report, in the file and against the database.
+    defaults holds my_class_id, section_id, session and year_admitted for
+    rows that do not name their own class and section.
+    """
+    classes, sections = _by_name(classes), _by_name(sections)
+    seen = {'email': {}, 'username': {}, 'adm_no': {}}
+
+    for result in report.results:
+        if not result.ok:
+            continue
+        result.error = _validate_row(result, defaults, classes, sections)
+        if not result.ok:
+            continue
+        for column in seen:
+            value = result.data[column].lower()
+            if value in seen[column]:
+                result.error = f'{column} {result.data[column]} repeats line {seen[column][value]}'
+                break
+            seen[column][value] = result.line
+
+    pending = [r for r in report.results if r.ok]
+    if not pending:
+        return report
+
+    taken = {
+        'email': _taken(supabase, 'users', 'email', {r.user['email'] for r in pending}),
+        'username': _taken(supabase, 'users', 'username', {r.user['username'] for r in pending}),
+        'adm_no': _taken(supabase, 'student_records', 'adm_no', {r.record['adm_no'] for r in pending}),
+    }
+    for result in pending:
+        for column, existing in taken.items():
+            if result.data[column].lower() in existing:
+                result.error = f'{column} {result.data[column]} already exists'
+                break
+    return report
+
+
+def _insert_batch(supabase, batch):
+    try:
+        res = supabase.table('users').insert([r.user for r in batch]).execute()
+    except Exception as e:
+        for result in batch:
+            result.error = str(e)
+        return
+    ids = {row['username']: row['id'] for row in res.data}
+    for result in batch:
+        result.user_id = ids[result.user['username']]
+
+    records = [dict(r.record, user_id=r.user_id) for r in batch]
+    try:
+        res = supabase.table('student_records').insert(records).execute()
+    except Exception as e:
+        # Remove the accounts we just created so the rows can be imported again
+        user_ids = [r.user_id for r in batch]
+        try:
+            supabase.table('users').delete().in_('id', user_ids).execute()
+        except Exception as cleanup_error:
+            print(f"Student import rollback failed for users {user_ids}: {cleanup_error}")
+        for result in batch:
+            result.error = str(e)
+            result.user_id = None
+        return
+    record_ids = {row['user_id']: row['id'] for row in res.data}
+    for result in batch:
+        result.record_id = record_ids.get(result.user_id)
+
+
+def import_students(supabase, report):
+    """
+    Hash the passwords of every validated row and insert users and
+    student_records in batches. A rejected batch is retried row by row so
+    the error is pinned to the rows that caused it.
+    """
+    pending = [r for r in report.results if r.ok]
+    if not pending:
+        return report
+
+    hashes = hash_passwords([r.password for r in pending])
+    for result, password_hash in zip(pending, hashes):
+        result.user['password'] = password_hash
+
+    for batch in _chunks(pending, current_app.config.get('IMPORT_BATCH_SIZE', 200)):
+        _insert_batch(supabase, batch)
+        if len(batch) > 1 and not batch[0].ok:
+            print(f"Student import batch failed, retrying row by row: {batch[0].error}")
+            for result in batch:
+                result.error = None
+                _insert_batch(supabase, [result])
+    invalidate_class_snapshots(supabase, [r.record.get('my_class_id') for r in pending if r.ok])
+    return report
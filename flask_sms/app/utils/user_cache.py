@@ -0,0 +1,102 @@
+"""
+User row cache for the Flask-Login user loader.
+
+Rows are kept in an in-process LRU and, when USER_CACHE_URL points at a
+Redis server, in a shared cache (for USER_CACHE_TTL seconds) so every
+gunicorn worker sees the same entry and the same invalidations. The
+local copy only lives USER_CACHE_LOCAL_TTL seconds either way: an
+invalidation cannot reach other workers' memory, and the row carries the
+user's role, so that bounds how long another worker keeps authorizing a
+user who was deleted or demoted elsewhere.
+Password hashes are never cached; routes that need one fetch it explicitly.
+"""
+import json
+from flask import current_app
+from app.utils.cache import TTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_local = TTLCache(maxsize=1024)
+_shared = None
+_shared_url = None
+
+SENSITIVE_COLUMNS = ('password', 'remember_token')
+
+
+def _key(user_id):
+    return f'sms:user:{user_id}'
+
+
+def _ttl():
+    return current_app.config.get('USER_CACHE_TTL', 300)
+
+
+def _local_ttl():
+    return min(_ttl(), current_app.config.get('USER_CACHE_LOCAL_TTL', 5))
+
+
+def _shared_store():
+    """Redis client for USER_CACHE_URL, or None when no shared backend is configured"""
+    global _shared, _shared_url
+    url = current_app.config.get('USER_CACHE_URL')
+    if not url:
+        return None
+    if redis is None:
+        print("WARNING: USER_CACHE_URL is set but the redis package is not installed")
+        return None
+    if _shared is None or _shared_url != url:
+        _shared = redis.Redis.from_url(url, socket_timeout=0.5)
+        _shared_url = url
+    return _shared
+
+
+def get_cached_user(user_id):
+    """Cached user row (without secrets) or None"""
+    key = _key(user_id)
+    row = _local.get(key)
+    if row is not None:
+        return row
+
+    store = _shared_store()
+    if store is not None:
+        try:
+            raw = store.get(key)
+        except Exception as e:
+            print(f"User cache read failed: {e}")
+            raw = None
+        if raw:
+            row = json.loads(raw)
+            _local.set(key, row, ttl=_local_ttl())
+            return row
+    return None
+
+
+def cache_user(row):
+    """Store a users row, minus password columns, for the next requests"""
+    row = {k: v for k, v in row.items() if k not in SENSITIVE_COLUMNS}
+    key = _key(row['id'])
+    _local.set(key, row, ttl=_local_ttl())
+
+    store = _shared_store()
+    if store is not None:
+        try:
+            store.set(key, json.dumps(row, default=str), ex=_ttl())
+        except Exception as e:
+            print(f"User cache write failed: {e}")
+    return row
+
+
+def invalidate_user(user_id):
+    """Drop a user from the cache after their row was changed or deleted"""
+    key = _key(user_id)
+    _local.delete(key)
+
+    store = _shared_store()
+    if store is not None:
+        try:
+            store.delete(key)
+        except Exception as e:
+            print(f"User cache invalidation failed: {e}")
@@ -0,0 +1,84 @@
+"""
+Memory used by SupabaseModel rows on a students listing.
+
+Builds N rows shaped like the students.index projection and measures,
+with tracemalloc, the previous wrapper (row dict kept plus every key
+copied onto the instance __dict__) against the slotted SupabaseModel that
+reads the row in place: first the cost of wrapping rows the response
+already holds, then the whole listing, rows included.
+
+    python benchmarks/model_memory.py [rows]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.supabase_db import SupabaseModel  # noqa: E402
+
+
+class CopyingModel:
+    """The wrapper SupabaseModel used to be, kept here for comparison"""
+    def __init__(self, data):
+        self._data = data
+        if data:
+            for key, value in data.items():
+                setattr(self, key, value)
+
+    @classmethod
+    def from_list(cls, data_list):
+        return [cls(item) for item in data_list] if data_list else []
+
+
+def make_rows(count):
+    return [{
+        'id': i,
+        'user_id': 10000 + i,
+        'adm_no': f'SMS/2024/{i:05d}',
+        'my_class_id': i % 12 + 1,
+        'section_id': i % 36 + 1,
+        'user': {'id': 10000 + i, 'name': f'Student {i}'},
+        'my_class': {'id': i % 12 + 1, 'name': f'JSS {i % 3 + 1}'},
+        'section': {'id': i % 36 + 1, 'name': 'ABC'[i % 3]},
+    } for i in range(count)]
+
+
+def render(rows):
+    # What students/index.html reads from every row (Jinja falls back to [] for dicts)
+    return sum(len(r.adm_no) + len(r.user['name']) + len(r.my_class['name']) + len(r.section['name'])
+               for r in rows)
+
+
+def measure(model, count, keep_rows):
+    gc.collect()
+    tracemalloc.start()
+    rows = make_rows(count)
+    base = tracemalloc.get_traced_memory()[0]
+    models = model.from_list(rows)
+    render(models)
+    if not keep_rows:
+        del rows
+        gc.collect()
+        base = 0
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del models
+    return used
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f'{count} student rows, after rendering every embedded name')
+    for keep_rows, label in ((True, 'wrapping (rows already in memory)'),
+                             (False, 'whole listing (rows + wrappers)')):
+        old = measure(CopyingModel, count, keep_rows)
+        new = measure(SupabaseModel, count, keep_rows)
+        print(f'  {label}:')
+        print(f'    copying model  {old / 1024:10.0f} KiB  ({old / count:.0f} B/row)')
+        print(f'    slotted model  {new / 1024:10.0f} KiB  ({new / count:.0f} B/row)  {1 - new / old:.0%} less')
+
+
+if __name__ == '__main__':
+    main()
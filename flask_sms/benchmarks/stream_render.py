@@ -0,0 +1,82 @@
+"""
+Time to first byte and peak memory of a buffered vs a streamed listing.
+
+Renders students/graduated.html for 1k, 10k and 50k rows inside a test
+request through stream_page, with STREAM_TEMPLATES off (the whole page
+is rendered, then sent) and on (chunks consumed the way the server
+writes them out). Peak memory is measured with tracemalloc above the
+response rows, which both modes hold.
+
+    python benchmarks/stream_render.py [rows ...]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import current_app  # noqa: E402
+from flask_login import login_user  # noqa: E402
+from app import create_app  # noqa: E402
+from app.models import User  # noqa: E402
+from app.supabase_db import SupabaseModel  # noqa: E402
+from app.utils.pagination import Paginator  # noqa: E402
+from app.utils.streaming import stream_page  # noqa: E402
+
+TEMPLATE = 'students/graduated.html'
+
+
+def make_rows(count):
+    return [{
+        'id': i,
+        'user_id': 10000 + i,
+        'adm_no': f'SMS/2019/{i:05d}',
+        'grad_date': f'20{18 + i % 6}-07-01',
+        'user': {'id': 10000 + i, 'name': f'Graduate {i}'},
+    } for i in range(count)]
+
+
+def render(rows):
+    page = Paginator(SupabaseModel.lazy(rows, timestamps=('grad_date',)), 1, len(rows), total=len(rows))
+    response = current_app.make_response(stream_page(TEMPLATE, students=page))
+    # Buffered, the first byte leaves once the page is complete
+    return response.iter_encoded()
+
+
+def measure(app, stream, rows):
+    app.config['STREAM_TEMPLATES'] = stream
+    with app.test_request_context('/students/graduated'):
+        login_user(User({'id': 1, 'name': 'Admin', 'user_type': 'admin'}))
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_byte = None
+        size = 0
+        for chunk in render(rows):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return first_byte, total, peak, size
+
+
+def main():
+    counts = [int(n) for n in sys.argv[1:]] or [1000, 10000, 50000]
+    app = create_app('testing')
+    # Compile the templates before timing anything
+    measure(app, False, make_rows(10))
+    print(f"{'rows':>7} {'mode':>9} {'TTFB ms':>9} {'total ms':>9} {'peak KiB':>9} {'page KiB':>9}")
+    for count in counts:
+        rows = make_rows(count)
+        for label, stream in (('buffered', False), ('streamed', True)):
+            first_byte, total, peak, size = measure(app, stream, rows)
+            print(f'{count:>7} {label:>9} {first_byte * 1000:>9.1f} {total * 1000:>9.1f} '
+                  f'{peak / 1024:>9.0f} {size / 1024:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -54,6 +54,82 @@ class Config:
     # Pagination
     ITEMS_PER_PAGE = 20
     
+    # Caching (seconds)
+    REFERENCE_CACHE_TTL = int(os.environ.get('REFERENCE_CACHE_TTL', 300))
+    DASHBOARD_STATS_TTL = int(os.environ.get('DASHBOARD_STATS_TTL', 60))
+    # Logged-in user rows (app/utils/user_cache.py). Each worker keeps a row at most
+    # USER_CACHE_LOCAL_TTL seconds; USER_CACHE_TTL applies to the shared Redis copy.
+    # Invalidation reaches only the worker that made the change (and Redis), so without
+    # USER_CACHE_URL a deleted, deactivated or demoted user keeps their old role on
+    # the other workers for up to USER_CACHE_LOCAL_TTL seconds.
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    USER_CACHE_LOCAL_TTL = int(os.environ.get('USER_CACHE_LOCAL_TTL', 5))
+    USER_CACHE_URL = os.environ.get('USER_CACHE_URL')  # optional redis:// URL shared by all workers
+    PAGINATION_COUNT = os.environ.get('PAGINATION_COUNT', 'exact')  # exact, planned or estimated
+    PAGINATION_COUNT_TTL = int(os.environ.get('PAGINATION_COUNT_TTL', 60))
+    
+    # Thread pool for concurrent independent reads (app/utils/fanout.py); 1 disables it
+    FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 8))
+    
+    # Students per page of a marks grading sheet
+    GRADING_SHEET_PAGE_SIZE = int(os.environ.get('GRADING_SHEET_PAGE_SIZE', 100))
+    
+    # Largest batch accepted by the bulk payment posting page
+    BULK_PAYMENT_MAX_ROWS = int(os.environ.get('BULK_PAYMENT_MAX_ROWS', 1000))
+    
+    # Rows fetched per keyset request while streaming a CSV / XLSX export
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+    
+    # Result card PDFs (app/utils/result_cards.py): render processes (1 renders inline)
+    # and where generated cards are kept until the student's results change
+    RESULT_CARD_WORKERS = int(os.environ.get('RESULT_CARD_WORKERS', min(4, os.cpu_count() or 1)))
+    RESULT_CARD_CACHE_DIR = os.environ.get('RESULT_CARD_CACHE_DIR') or os.path.join(basedir, 'instance', 'result_cards')
+    
+    # Background jobs (app/utils/jobs.py): the SQLite queue shared by the workers of
+    # this host, worker threads per process (0 runs each job inline when queued),
+    # retries with a backoff of JOB_RETRY_DELAY x 2^n seconds, seconds without
+    # progress (running jobs report at least every third of it) before a running job
+    # is taken over, and how long an attached file (e.g. a credential sheet) is kept
+    # after the job finished if nobody downloads it
+    JOB_DB_PATH = os.environ.get('JOB_DB_PATH') or os.path.join(basedir, 'instance', 'jobs.sqlite3')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 600))
+    JOB_FILE_TTL = int(os.environ.get('JOB_FILE_TTL', 600))
+    
+    # Large listings (app/utils/streaming.py) are sent while they render; off buffers
+    # the whole page. Jinja output fragments per chunk when streaming.
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', 'true').lower() in ['true', 'on', '1']
+    STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 64))
+    
+    # Student CSV import: rows per uniqueness query / insert, and the largest file accepted
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 200))
+    IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', 2000))
+    
+    # Most PINs one generation request may ask for (they are inserted by a background job)
+    PIN_MAX_COUNT = int(os.environ.get('PIN_MAX_COUNT', 10000))
+    
+    # Password hashing (app/utils/passwords.py): pool processes (1 hashes inline),
+    # werkzeug method string with its cost, e.g. pbkdf2:sha256:600000 or scrypt:32768:8:1
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    
+    # Login throttling (app/utils/login_throttle.py): failed attempts allowed per
+    # username/email and per client address within the window, and the lockout after.
+    # The per-address limit is off (0) unless set: behind a proxy every client has the
+    # proxy's address until PROXY_FIX_HOPS is set, and a school lab shares one anyway.
+    LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', 5))
+    LOGIN_IP_MAX_FAILURES = int(os.environ.get('LOGIN_IP_MAX_FAILURES', 0))
+    LOGIN_FAILURE_WINDOW = int(os.environ.get('LOGIN_FAILURE_WINDOW', 900))
+    LOGIN_LOCKOUT = int(os.environ.get('LOGIN_LOCKOUT', 900))
+    
+    # Reverse proxies in front of the app (nginx, a load balancer) whose X-Forwarded-*
+    # headers are trusted for the client address and scheme; 0 trusts none
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+    
     # Application settings
     APP_NAME = 'School Management System'
     SCHOOL_NAME = os.environ.get('SCHOOL_NAME', 'Your School Name')
@@ -81,6 +157,8 @@ class TestingConfig(Config):
     TESTING = True
     # SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    # Run jobs inline when they are enqueued, so a request sees their result
+    JOB_WORKERS = 0
 
 
 class ProductionConfig(Config):
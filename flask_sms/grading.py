@@ -0,0 +1,151 @@
+"""
+Vectorized exam results engine.
+
+Marks are loaded into a dense students x subjects NumPy matrix and every
+aggregate (totals, percentages, grades, GPA, positions, subject statistics,
+class average) is computed with array operations. Shared by
+marks.class_results, marks.student_result and student_result_calculator.py,
+so it imports nothing from the app package and needs only NumPy.
+"""
+import numpy as np
+
+# Lower bounds of each grade band, ascending
+GRADE_BOUNDARIES = np.array([50, 60, 70, 80, 90])
+GRADES = np.array(['F', 'E', 'D', 'C', 'B', 'A'])
+GPAS = np.array([0.0, 2.4, 2.8, 3.2, 3.6, 4.0])
+
+
+def _band(percentages):
+    return np.searchsorted(GRADE_BOUNDARIES, percentages, side='right')
+
+
+def grades_for(percentages):
+    """Letter grade for each percentage in an array"""
+    return GRADES[_band(np.asarray(percentages, dtype=float))]
+
+
+def gpas_for(percentages):
+    """GPA on a 4.0 scale for each percentage in an array"""
+    return GPAS[_band(np.asarray(percentages, dtype=float))]
+
+
+def calculate_grade(percentage):
+    """Letter grade for a single percentage"""
+    return str(grades_for([percentage])[0])
+
+
+def calculate_gpa(percentage):
+    """GPA on a 4.0 scale for a single percentage"""
+    return float(gpas_for([percentage])[0])
+
+
+def native(value):
+    """Turn a NumPy scalar into an int when it is whole, else a float"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def competition_rank(values):
+    """Positions for descending values where ties share a position (1, 2, 2, 4)"""
+    values = np.asarray(values, dtype=float)
+    ascending = np.sort(values)
+    # Number of strictly higher values + 1
+    return len(values) - np.searchsorted(ascending, values, side='right') + 1
+
+
+class ResultsTable:
+    """
+    Results of one exam for a group of students.
+    scores is a (len(students) x len(subjects)) matrix; missing marks are 0.
+    """
+    def __init__(self, students, subjects, scores):
+        self.students = list(students)
+        self.subjects = list(subjects)
+        self.scores = np.asarray(scores, dtype=float).reshape(len(self.students), len(self.subjects))
+
+        subject_count = max(len(self.subjects), 1)
+        self.totals = self.scores.sum(axis=1)
+        self.percentages = self.totals / subject_count
+        self.grades = grades_for(self.percentages)
+        self.gpas = gpas_for(self.percentages)
+        self.positions = competition_rank(self.totals)
+
+        if self.students and self.subjects:
+            self.subject_highs = self.scores.max(axis=0)
+            self.subject_high_index = self.scores.argmax(axis=0)
+            self.subject_means = self.scores.mean(axis=0)
+            self.subject_std = self.scores.std(axis=0)
+        else:
+            empty = np.zeros(len(self.subjects))
+            self.subject_highs = self.subject_means = self.subject_std = empty
+            self.subject_high_index = empty.astype(int)
+
+    @classmethod
+    def from_marks(cls, students, subjects, marks, student_key, subject_key='id', field='total'):
+        """
+        Build the matrix from marks rows (dicts with student_id, subject_id and `field`).
+        student_key / subject_key give the attribute matched against student_id / subject_id.
+        """
+        row_of = {_key(s, student_key): i for i, s in enumerate(students)}
+        col_of = {_key(s, subject_key): j for j, s in enumerate(subjects)}
+        scores = np.zeros((len(students), len(subjects)))
+
+        hits = [(row_of[m['student_id']], col_of[m['subject_id']], m.get(field) or 0)
+                for m in marks
+                if m['student_id'] in row_of and m['subject_id'] in col_of]
+        if hits:
+            rows, cols, values = zip(*hits)
+            scores[list(rows), list(cols)] = values
+        return cls(students, subjects, scores)
+
+    def __len__(self):
+        return len(self.students)
+
+    @property
+    def class_average(self):
+        return float(self.percentages.mean()) if self.students else 0.0
+
+    @property
+    def topper_index(self):
+        return int(self.totals.argmax()) if self.students else None
+
+    def subject_grades(self, index):
+        """Grade per subject for one student, treating each subject score as a percentage"""
+        return grades_for(self.scores[index])
+
+    def row(self, index, subject_key='id'):
+        """Plain dict for one student, as used by the templates"""
+        return {
+            'student': self.students[index],
+            'marks': {_key(s, subject_key): native(v) for s, v in zip(self.subjects, self.scores[index])},
+            'total_score': native(self.totals[index]),
+            'percentage': float(self.percentages[index]),
+            'grade': str(self.grades[index]),
+            'gpa': float(self.gpas[index]),
+            'position': int(self.positions[index])
+        }
+
+    def rows(self, subject_key='id'):
+        return [self.row(i, subject_key) for i in range(len(self.students))]
+
+    def subject_stats(self, scorer_name, subject_key='id'):
+        """
+        Per-subject high score, scorer, mean and standard deviation.
+        scorer_name(student) gives the display name; nobody is credited with a high of 0.
+        """
+        stats = {}
+        for j, subject in enumerate(self.subjects):
+            high = self.subject_highs[j]
+            stats[_key(subject, subject_key)] = {
+                'score': native(high),
+                'scorer': scorer_name(self.students[self.subject_high_index[j]]) if high > 0 else None,
+                'mean': float(self.subject_means[j]),
+                'std': float(self.subject_std[j])
+            }
+        return stats
+
+
+def _key(item, key):
+    if isinstance(item, dict):
+        return item[key]
+    return getattr(item, key)
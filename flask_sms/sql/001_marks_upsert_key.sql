@@ -0,0 +1,13 @@
+-- Unique key used by the bulk marks upsert (app/utils/bulk_marks.py).
+-- Run once in the Supabase SQL editor.
+
+-- Keep only the newest row for any duplicated (exam, subject, student) triple
+DELETE FROM marks m
+USING marks d
+WHERE m.exam_id = d.exam_id
+  AND m.subject_id = d.subject_id
+  AND m.student_id = d.student_id
+  AND m.id < d.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS marks_exam_subject_student_key
+    ON marks (exam_id, subject_id, student_id);
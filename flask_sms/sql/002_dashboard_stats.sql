@@ -0,0 +1,30 @@
+-- Aggregate counters for the admin dashboard (app/utils/dashboard_stats.py).
+-- One call replaces a count query per role. Run in the Supabase SQL editor
+-- (again after updating this file; it only replaces the function).
+
+CREATE OR REPLACE FUNCTION dashboard_stats()
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object(
+        'total_students', (SELECT count(*) FROM users WHERE user_type = 'student'),
+        'total_teachers', (SELECT count(*) FROM users WHERE user_type = 'teacher'),
+        'total_parents',  (SELECT count(*) FROM users WHERE user_type = 'parent'),
+        'total_classes',  (SELECT count(*) FROM my_classes),
+        'total_sections', (SELECT count(*) FROM sections),
+        -- (student, payment) pairs for the student's class with no paid record
+        'outstanding_payments', (
+            SELECT count(*)
+            FROM student_records sr
+            JOIN payments p ON p.my_class_id = sr.my_class_id
+            LEFT JOIN payment_records pr
+                   ON pr.payment_id = p.id
+                  AND pr.student_id = sr.user_id
+                  AND pr.paid
+            WHERE pr.id IS NULL
+              AND NOT coalesce(sr.grad, false)
+              AND NOT coalesce(sr.wd, false)
+        )
+    );
+$$;
@@ -0,0 +1,39 @@
+-- Set-based, transactional student promotion (app/utils/promotion.py).
+-- Either every selected record is promoted or none is.
+-- Run once in the Supabase SQL editor.
+
+CREATE OR REPLACE FUNCTION promote_students(
+    p_record_ids bigint[],
+    p_to_class bigint,
+    p_to_section bigint,
+    p_to_session text
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    promoted integer;
+BEGIN
+    -- Lock the selected records so a concurrent promotion cannot interleave
+    PERFORM 1 FROM student_records WHERE id = ANY(p_record_ids) FOR UPDATE;
+
+    IF (SELECT count(*) FROM student_records WHERE id = ANY(p_record_ids))
+       <> cardinality(p_record_ids) THEN
+        RAISE EXCEPTION 'Some selected students no longer exist';
+    END IF;
+
+    INSERT INTO promotions (student_id, from_class, from_section, to_class, to_section, from_session, to_session)
+    SELECT user_id, my_class_id, section_id, p_to_class, p_to_section, session, p_to_session
+    FROM student_records
+    WHERE id = ANY(p_record_ids);
+
+    UPDATE student_records
+    SET my_class_id = p_to_class,
+        section_id = p_to_section,
+        session = p_to_session
+    WHERE id = ANY(p_record_ids);
+
+    GET DIAGNOSTICS promoted = ROW_COUNT;
+    RETURN promoted;
+END;
+$$;
@@ -0,0 +1,35 @@
+-- Materialized exam results (app/utils/result_snapshots.py).
+-- Rows are rewritten whenever marks are saved or an exam is finalized, and
+-- can be rebuilt for historic exams with `flask results rebuild`.
+-- Run once in the Supabase SQL editor.
+
+CREATE TABLE IF NOT EXISTS result_snapshots (
+    id bigserial PRIMARY KEY,
+    exam_id bigint NOT NULL REFERENCES exams(id) ON DELETE CASCADE,
+    student_id bigint NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    my_class_id bigint REFERENCES my_classes(id) ON DELETE CASCADE,
+    marks jsonb NOT NULL DEFAULT '{}',      -- subject_id -> total
+    total numeric NOT NULL DEFAULT 0,
+    percentage numeric NOT NULL DEFAULT 0,
+    grade text,
+    gpa numeric,
+    position integer,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (exam_id, student_id)
+);
+
+CREATE INDEX IF NOT EXISTS result_snapshots_exam_class_idx
+    ON result_snapshots (exam_id, my_class_id, position);
+
+CREATE TABLE IF NOT EXISTS class_result_snapshots (
+    id bigserial PRIMARY KEY,
+    exam_id bigint NOT NULL REFERENCES exams(id) ON DELETE CASCADE,
+    my_class_id bigint NOT NULL REFERENCES my_classes(id) ON DELETE CASCADE,
+    subject_ids jsonb NOT NULL DEFAULT '[]',  -- subjects the snapshot was computed over
+    subject_stats jsonb NOT NULL DEFAULT '{}', -- subject_id -> {score, scorer, mean, std}
+    class_average numeric NOT NULL DEFAULT 0,
+    topper_student_id bigint,
+    student_count integer NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (exam_id, my_class_id)
+);
@@ -0,0 +1,9 @@
+-- Indexes backing keyset pagination (app/utils/pagination.py).
+-- users.index walks (name, id), optionally filtered by user_type; the
+-- student lists walk id within the grad / wd filters.
+-- Run once in the Supabase SQL editor.
+
+CREATE INDEX IF NOT EXISTS users_name_id_idx ON users (name, id);
+CREATE INDEX IF NOT EXISTS users_type_name_id_idx ON users (user_type, name, id);
+CREATE INDEX IF NOT EXISTS student_records_active_id_idx ON student_records (id) WHERE grad = false AND wd = false;
+CREATE INDEX IF NOT EXISTS student_records_grad_id_idx ON student_records (id) WHERE grad = true;
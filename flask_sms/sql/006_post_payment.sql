@@ -0,0 +1,107 @@
+-- Atomic, idempotent payment posting (app/utils/payment_posting.py).
+-- The payment record upsert and its receipt are written in one transaction;
+-- a replayed idempotency key returns the receipt it already produced.
+-- A post settles the outstanding balance (amount less what part payments,
+-- see sql/008_post_payment_batch.sql, have already recorded), so the
+-- receipt is for the cash actually taken.
+-- Run once in the Supabase SQL editor (again after updating this file;
+-- every statement is safe to repeat).
+
+-- Fold duplicated (payment, student) records into the oldest one
+UPDATE receipts r
+SET pr_id = k.keep_id
+FROM (
+    SELECT id, min(id) OVER (PARTITION BY payment_id, student_id) AS keep_id
+    FROM payment_records
+) k
+WHERE r.pr_id = k.id AND k.id <> k.keep_id;
+
+DELETE FROM payment_records p
+USING payment_records d
+WHERE p.payment_id = d.payment_id
+  AND p.student_id = d.student_id
+  AND p.id > d.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS payment_records_payment_student_key
+    ON payment_records (payment_id, student_id);
+
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS idempotency_key text;
+
+CREATE UNIQUE INDEX IF NOT EXISTS receipts_idempotency_key
+    ON receipts (idempotency_key);
+
+-- Result of an earlier post with this key, or NULL
+CREATE OR REPLACE FUNCTION posted_receipt(p_idempotency_key text)
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object('status', 'duplicate', 'receipt_id', id,
+                             'pr_id', pr_id, 'amount_paid', amount_paid)
+    FROM receipts
+    WHERE idempotency_key = p_idempotency_key;
+$$;
+
+CREATE OR REPLACE FUNCTION post_payment(
+    p_record_id bigint,
+    p_payment_id bigint,
+    p_idempotency_key text
+)
+RETURNS json
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_student_id bigint;
+    v_payment payments%ROWTYPE;
+    v_pr_id bigint;
+    v_paid boolean;
+    v_balance numeric;
+    v_receipt_id bigint;
+    v_replay json;
+BEGIN
+    v_replay := posted_receipt(p_idempotency_key);
+    IF v_replay IS NOT NULL THEN
+        RETURN v_replay;
+    END IF;
+
+    SELECT user_id INTO v_student_id FROM student_records WHERE id = p_record_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Student record % not found', p_record_id USING ERRCODE = 'P0002';
+    END IF;
+
+    SELECT * INTO v_payment FROM payments WHERE id = p_payment_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Payment % not found', p_payment_id USING ERRCODE = 'P0002';
+    END IF;
+
+    -- Concurrent posts for the same fee serialize on the record lock; the
+    -- record is created unpaid first so there is always a row to lock
+    INSERT INTO payment_records (payment_id, student_id, year, amount_paid, paid)
+    VALUES (p_payment_id, v_student_id, v_payment.year, 0, false)
+    ON CONFLICT (payment_id, student_id) DO NOTHING;
+
+    SELECT id, coalesce(paid, false), v_payment.amount - coalesce(amount_paid, 0)
+    INTO v_pr_id, v_paid, v_balance
+    FROM payment_records
+    WHERE payment_id = p_payment_id AND student_id = v_student_id
+    FOR UPDATE;
+
+    IF v_paid OR v_balance <= 0 THEN
+        -- Paid already: by a replay of this key that won the race, or by another post
+        RETURN coalesce(posted_receipt(p_idempotency_key), json_build_object(
+            'status', 'already_paid', 'receipt_id', NULL,
+            'pr_id', NULL, 'amount_paid', 0));
+    END IF;
+
+    UPDATE payment_records
+    SET paid = true, amount_paid = v_payment.amount
+    WHERE id = v_pr_id;
+
+    INSERT INTO receipts (pr_id, amount_paid, year, idempotency_key)
+    VALUES (v_pr_id, v_balance, v_payment.year, p_idempotency_key)
+    RETURNING id INTO v_receipt_id;
+
+    RETURN json_build_object('status', 'posted', 'receipt_id', v_receipt_id,
+                             'pr_id', v_pr_id, 'amount_paid', v_balance);
+END;
+$$;
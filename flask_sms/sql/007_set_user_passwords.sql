@@ -0,0 +1,27 @@
+-- Batch password writes for mass resets (app/utils/passwords.py).
+-- Hashes are computed by the application; this only stores them in one statement.
+-- Run once in the Supabase SQL editor.
+
+CREATE OR REPLACE FUNCTION set_user_passwords(
+    p_user_ids bigint[],
+    p_hashes text[]
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    updated integer;
+BEGIN
+    IF cardinality(p_user_ids) <> cardinality(p_hashes) THEN
+        RAISE EXCEPTION 'Expected one hash per user';
+    END IF;
+
+    UPDATE users u
+    SET password = h.hash
+    FROM unnest(p_user_ids, p_hashes) AS h(user_id, hash)
+    WHERE u.id = h.user_id;
+
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$;
@@ -0,0 +1,90 @@
+-- Bulk payment posting (app/utils/bulk_payments.py).
+-- Every row of a batch is posted under the lock of its payment record:
+-- amount_paid is incremented in place, never overwritten with a value the
+-- client computed, and the receipt key "<batch key>:<line>" is checked
+-- after the lock is taken, so a batch submitted twice at once posts each
+-- line only once. Requires sql/006_post_payment.sql.
+-- Run once in the Supabase SQL editor.
+
+-- p_rows: [{"line": 3, "payment_id": 1, "student_id": 42, "amount": 50.00}, ...]
+-- amount may be null to pay the remaining balance. Returns one object per
+-- row: {"line", "status", "receipt_id", "amount", "settled"} where status is
+-- posted, duplicate, already_paid, over_balance or missing_payment.
+CREATE OR REPLACE FUNCTION post_payment_batch(
+    p_batch_key text,
+    p_rows json
+)
+RETURNS json
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_row record;
+    v_payment payments%ROWTYPE;
+    v_pr_id bigint;
+    v_paid_so_far numeric;
+    v_paid boolean;
+    v_amount numeric;
+    v_key text;
+    v_receipt_id bigint;
+    v_results json[] := '{}';
+BEGIN
+    -- Records are locked in a fixed order so two batches cannot deadlock
+    FOR v_row IN
+        SELECT * FROM json_to_recordset(p_rows)
+            AS x(line int, payment_id bigint, student_id bigint, amount numeric)
+        ORDER BY payment_id, student_id, line
+    LOOP
+        v_key := p_batch_key || ':' || v_row.line;
+
+        SELECT * INTO v_payment FROM payments WHERE id = v_row.payment_id;
+        IF NOT FOUND THEN
+            v_results := v_results || json_build_object('line', v_row.line, 'status', 'missing_payment');
+            CONTINUE;
+        END IF;
+
+        INSERT INTO payment_records (payment_id, student_id, year, amount_paid, paid)
+        VALUES (v_row.payment_id, v_row.student_id, v_payment.year, 0, false)
+        ON CONFLICT (payment_id, student_id) DO NOTHING;
+
+        SELECT id, coalesce(amount_paid, 0), coalesce(paid, false)
+        INTO v_pr_id, v_paid_so_far, v_paid
+        FROM payment_records
+        WHERE payment_id = v_row.payment_id AND student_id = v_row.student_id
+        FOR UPDATE;
+
+        -- Checked under the lock: a concurrent copy of this batch has committed by now
+        SELECT id INTO v_receipt_id FROM receipts WHERE idempotency_key = v_key;
+        IF FOUND THEN
+            v_results := v_results || json_build_object('line', v_row.line, 'status', 'duplicate',
+                                                        'receipt_id', v_receipt_id);
+            CONTINUE;
+        END IF;
+
+        v_amount := coalesce(v_row.amount, v_payment.amount - v_paid_so_far);
+        IF v_paid OR v_paid_so_far >= v_payment.amount THEN
+            v_results := v_results || json_build_object('line', v_row.line, 'status', 'already_paid');
+            CONTINUE;
+        END IF;
+        IF v_amount <= 0 OR v_paid_so_far + v_amount > v_payment.amount THEN
+            v_results := v_results || json_build_object('line', v_row.line, 'status', 'over_balance',
+                                                        'amount', v_payment.amount - v_paid_so_far);
+            CONTINUE;
+        END IF;
+
+        UPDATE payment_records
+        SET amount_paid = v_paid_so_far + v_amount,
+            paid = v_paid_so_far + v_amount >= v_payment.amount
+        WHERE id = v_pr_id;
+
+        INSERT INTO receipts (pr_id, amount_paid, year, idempotency_key)
+        VALUES (v_pr_id, v_amount, v_payment.year, v_key)
+        RETURNING id INTO v_receipt_id;
+
+        v_results := v_results || json_build_object(
+            'line', v_row.line, 'status', 'posted', 'receipt_id', v_receipt_id, 'amount', v_amount,
+            'settled', v_paid_so_far + v_amount >= v_payment.amount);
+    END LOOP;
+
+    RETURN array_to_json(v_results);
+END;
+$$;
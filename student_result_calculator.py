@@ -1,35 +1,11 @@
 
 import os
+import sys
 
-def calculate_grade(percentage):
-    """Calculates the grade based on percentage."""
-    if percentage >= 90:
-        return 'A'
-    elif percentage >= 80:
-        return 'B'
-    elif percentage >= 70:
-        return 'C'
-    elif percentage >= 60:
-        return 'D'
-    elif percentage >= 50:
-        return 'E'
-    else:
-        return 'F'
+# Share the grading engine with the web app
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), 'flask_sms'))
 
-def calculate_gpa(percentage):
-    """Calculates GPA on a 4.0 scale based on percentage."""
-    if percentage >= 90:
-        return 4.0
-    elif percentage >= 80:
-        return 3.6
-    elif percentage >= 70:
-        return 3.2
-    elif percentage >= 60:
-        return 2.8
-    elif percentage >= 50:
-        return 2.4
-    else:
-        return 0.0
+from grading import ResultsTable
 
 def get_valid_float(prompt, min_val, max_val):
     """Prompts user for input and validates it's a float within range."""
@@ -61,14 +37,15 @@ def main():
     print(f"\nEntering data for {num_students} students.")
     print("Marks: Theory (Max 75), Internal (Max 25)")
     
+    names = []
+    scores = []
     for i in range(num_students):
         print(f"\nStudent {i+1}:")
         name = input("Enter Student Name: ").strip()
         
         student_data = {
             "name": name,
-            "marks": {},
-            "total_marks": 0
+            "marks": {}
         }
         
         for subject in subjects:
@@ -76,18 +53,14 @@ def main():
             theory = get_valid_float(f"    Theory (0-75): ", 0, 75)
             internal = get_valid_float(f"    Internal (0-25): ", 0, 25)
             
-            total_subject_marks = theory + internal
             student_data["marks"][subject] = {
                 "theory": theory,
                 "internal": internal,
-                "total": total_subject_marks
+                "total": theory + internal
             }
-            student_data["total_marks"] += total_subject_marks
-            
-        student_data["percentage"] = student_data["total_marks"] / len(subjects)
-        student_data["grade"] = calculate_grade(student_data["percentage"])
-        student_data["gpa"] = calculate_gpa(student_data["percentage"])
         
+        names.append(name)
+        scores.append([student_data["marks"][subject]["total"] for subject in subjects])
         students.append(student_data)
 
     # Class Statistics
@@ -95,23 +68,25 @@ def main():
         print("No student data entered.")
         return
 
+    table = ResultsTable(names, subjects, scores)
+    for i, student_data in enumerate(students):
+        student_data["total_marks"] = float(table.totals[i])
+        student_data["percentage"] = float(table.percentages[i])
+        student_data["grade"] = str(table.grades[i])
+        student_data["gpa"] = float(table.gpas[i])
+
     # Topper
-    topper = max(students, key=lambda x: x["total_marks"])
+    topper = students[table.topper_index]
     
     # Subject High Scores
     subject_highs = {}
-    for subject in subjects:
-        highest_mark = 0
-        scorer = ""
-        for student in students:
-            if student["marks"][subject]["total"] > highest_mark:
-                highest_mark = student["marks"][subject]["total"]
-                scorer = student["name"]
+    for j, subject in enumerate(subjects):
+        highest_mark = float(table.subject_highs[j])
+        scorer = names[table.subject_high_index[j]] if highest_mark > 0 else ""
         subject_highs[subject] = (scorer, highest_mark)
         
     # Class Average
-    total_class_percentage = sum(s["percentage"] for s in students)
-    class_average = total_class_percentage / len(students)
+    class_average = table.class_average
 
     # Output Formatting
     output_lines = []